@@ -0,0 +1,101 @@
+# Micro-benchmark: Sensirion frame decoding
+#
+# Compares the original per-float decode path of sps30/scd30 (bitwise crc8,
+# struct.pack('>BBBB') + struct.unpack('>f') per value) with SensirionFrame.
+#
+# Runs on the board (copy next to lib/) or on a host:
+#   python bench/bench_sensirion.py [iterations]
+
+import sys
+import struct
+
+# On the board lib/ is already on the path
+try:
+    import os.path
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+except ImportError:
+    pass
+
+try:
+    from time import ticks_us, ticks_diff
+except ImportError:
+    from time import perf_counter
+
+    def ticks_us():
+        return int(perf_counter() * 1000000)
+
+    def ticks_diff(a, b):
+        return a - b
+
+from crc8 import crc8
+from sensirion import SensirionFrame
+
+# Original calc_crc8 + decode loop, kept here as the reference
+def _legacy_crc8(data):
+    crc = 0xFF
+    for i in range(0, 2):
+        crc ^= data[i]
+        for j in range(8, 0, -1):
+            if(crc & 0x80):
+                crc = (crc << 1) ^ 0x31
+            else:
+                crc = (crc << 1)
+    return bytes([crc & 0xFF])
+
+def legacy_decode(read, n, out):
+    for i in range(0, n):
+        assert _legacy_crc8(read[i * 6 : i * 6 + 2]) == bytes([read[i * 6 + 2]]), "Bad upper crc8"
+        assert _legacy_crc8(read[i * 6 + 3: i * 6 + 5]) == bytes([read[i * 6 + 5]]), "Bad lower crc8"
+        float_struct = struct.pack('>BBBB', read[i * 6], read[i * 6 + 1], read[i * 6 + 3], read[i * 6 + 4])
+        out[i] = struct.unpack('>f', float_struct)[0]
+
+def make_read(values):
+    raw = struct.pack('>{}f'.format(len(values)), *values)
+    read = bytearray()
+    for i in range(0, len(raw), 2):
+        read += raw[i:i + 2]
+        read.append(crc8(raw, i, i + 2))
+    return bytes(read)
+
+def _time(fn, iterations):
+    start = ticks_us()
+    for _ in range(iterations):
+        fn()
+    return ticks_diff(ticks_us(), start) / iterations
+
+def _allocs(fn):
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    # peak bytes allocated by one call
+    tracemalloc.start()
+    fn()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def run(iterations=1000):
+    results = []
+    for name, n in (('sps30', 10), ('scd30', 3)):
+        read = make_read([i * 1.5 for i in range(n)])
+        out = [0.0] * n
+        frame = SensirionFrame(n)
+
+        legacy = lambda: legacy_decode(read, n, out)
+        shared = lambda: frame.decode(read)
+
+        legacy()
+        shared()
+        assert frame.values == out, "decoders disagree"
+
+        results.append((name, 'legacy', _time(legacy, iterations), _allocs(legacy)))
+        results.append((name, 'frame', _time(shared, iterations), _allocs(shared)))
+
+    return results
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    print('{:<6} {:<7} {:>10} {:>7}'.format('sensor', 'path', 'us/call', 'peak B'))
+    for name, path, us, allocs in run(iterations):
+        print('{:<6} {:<7} {:>10.1f} {:>7}'.format(name, path, us, '-' if allocs is None else allocs))
@@ -0,0 +1,249 @@
+# Benchmark suite: bus transactions, allocations and time per driver call
+#
+# Runs every driver method and one full sense-and-send cycle against the
+# simulator (sim/) and reports, per call:
+#   i2c_tx      I2C transactions
+#   i2c_bytes   bytes on the bus (written + read)
+#   bus_us      bus time on the virtual clock
+#   sleep_us    time spent in time.sleep*, virtual
+#   device_us   total virtual time, what the call costs on the board
+#   alloc_B     peak Python allocation during one call (tracemalloc)
+#   wall_us     host wall time, only comparable on the same machine
+#
+# Usage:
+#   python bench/suite.py                       print the table
+#   python bench/suite.py --save baseline.json  also save the results
+#   python bench/suite.py --check baseline.json exit 1 on regressions
+#   python bench/suite.py --check bench/baseline.json --no-wall   on another machine
+#   python bench/suite.py -k si7006             only cases containing 'si7006'
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sim import Simulation
+
+METRICS = ('i2c_tx', 'i2c_bytes', 'bus_us', 'sleep_us', 'device_us', 'alloc_B', 'wall_us')
+
+# Allowed relative increase before a metric counts as a regression
+TOLERANCES = {
+    'i2c_tx': 0.0,
+    'i2c_bytes': 0.0,
+    'bus_us': 0.02,
+    'sleep_us': 0.02,
+    'device_us': 0.02,
+    'alloc_B': 0.25,
+    'wall_us': 0.5,
+}
+
+# Absolute slack on top, short calls are dominated by timer noise
+ABS_SLACK = {
+    'alloc_B': 64,
+    'wall_us': 10,
+}
+
+CASES = []
+
+def case(name):
+    """ registers setup(sim) -> fn, fn() is the measured call """
+    def register(setup):
+        CASES.append((name, setup))
+        return setup
+    return register
+
+def _pysense(sim):
+    from pysense import Pysense
+    return Pysense()
+
+@case('pysense.setup')
+def _(sim):
+    import main
+    return lambda: main.pysense_registry().setup()
+
+@case('pycoproc.read_battery_voltage')
+def _(sim):
+    return _pysense(sim).read_battery_voltage
+
+@case('si7006a20.read_all')
+def _(sim):
+    from SI7006A20 import SI7006A20
+    return SI7006A20(_pysense(sim)).read_all
+
+@case('si7006a20.temperature')
+def _(sim):
+    from SI7006A20 import SI7006A20
+    return SI7006A20(_pysense(sim)).temperature
+
+@case('si7006a20.humidity')
+def _(sim):
+    from SI7006A20 import SI7006A20
+    return SI7006A20(_pysense(sim)).humidity
+
+@case('mpl3115a2.pressure_temperature')
+def _(sim):
+    from MPL3115A2 import MPL3115A2, PRESSURE
+    return MPL3115A2(_pysense(sim), mode=PRESSURE).pressure_temperature
+
+@case('mpl3115a2.altitude')
+def _(sim):
+    from MPL3115A2 import MPL3115A2, ALTITUDE
+    return MPL3115A2(_pysense(sim), mode=ALTITUDE).altitude
+
+@case('mpl3115a2.temperature')
+def _(sim):
+    from MPL3115A2 import MPL3115A2, ALTITUDE
+    return MPL3115A2(_pysense(sim), mode=ALTITUDE).temperature
+
+@case('ltr329als01.light')
+def _(sim):
+    from LTR329ALS01 import LTR329ALS01
+    return LTR329ALS01(_pysense(sim)).light
+
+@case('lis2hh12.acceleration')
+def _(sim):
+    from LIS2HH12 import LIS2HH12
+    return LIS2HH12(_pysense(sim)).acceleration
+
+@case('sps30.sample')
+def _(sim):
+    from sps30 import sps30
+    return sps30().sample
+
+@case('scd30.sample')
+def _(sim):
+    from scd30 import scd30
+    return scd30().sample
+
+@case('cycle')
+def _(sim):
+    import main
+    from sps30 import sps30
+    from scd30 import scd30
+
+    main.using_pm = main.using_co2 = main.using_pysense_sensor = True
+    pm_sensor = sps30()
+    co2_sensor = scd30()
+    pm_sensor.sample()
+    co2_sensor.sample()
+    pysense_sensors = main.pysense_registry()
+    pysense_sensors.setup()
+
+    sim.radio.joined = sim.radio.session_valid = True
+    main.lora_radio = lora = main.LoRa(mode=main.LoRa.LORAWAN, region=main.LoRa.US915, device_class=main.LoRa.CLASS_C)
+    main.prepare_channels(lora, main.LORA_FREQUENCY)
+    lora_socket = main.open_socket()
+    lora.callback(trigger=(main.LoRa.TX_PACKET_EVENT | main.LoRa.TX_FAILED_EVENT), handler=main.lora_cb)
+
+    def cycle():
+        # Send the same Sensirion samples every cycle
+        main.sent_seqs.clear()
+        payloads = main.sample(pm_sensor, co2_sensor, pysense_sensors)
+        main.transmit(lora_socket, payloads)
+    return cycle
+
+def measure(sim, fn, repeat):
+    fn()  # warm up
+    sim.reset_stats()
+    start_us = sim.clock.now_us
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    wall = time.perf_counter() - start
+    stats = sim.i2c_stats()
+    slept_us = sim.clock.slept_us
+    elapsed_us = sim.clock.now_us - start_us
+
+    tracemalloc.start()
+    fn()
+    alloc = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        'i2c_tx': stats['transactions'] / repeat,
+        'i2c_bytes': (stats['bytes_written'] + stats['bytes_read']) / repeat,
+        'bus_us': stats['bus_time_us'] / repeat,
+        'sleep_us': slept_us / repeat,
+        'device_us': elapsed_us / repeat,
+        'alloc_B': alloc,
+        'wall_us': wall * 1e6 / repeat,
+    }
+
+def run(repeat=20, selected=None):
+    results = {}
+    for name, setup in CASES:
+        if selected and not any(k in name for k in selected):
+            continue
+        sim = Simulation.default()
+        with sim, contextlib.redirect_stdout(io.StringIO()):
+            import main
+            saved = (main.using_pm, main.using_co2, main.using_pysense_sensor, main.lora_radio)
+            try:
+                results[name] = measure(sim, setup(sim), repeat)
+            finally:
+                main.using_pm, main.using_co2, main.using_pysense_sensor, main.lora_radio = saved
+    return results
+
+def compare(results, baseline):
+    """ returns [(case, metric, baseline, current)] for every regression """
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric, value in metrics.items():
+            ref = base.get(metric)
+            if ref is None:
+                continue
+            if value > ref * (1 + TOLERANCES[metric]) + ABS_SLACK.get(metric, 1e-9):
+                regressions.append((name, metric, ref, value))
+    return regressions
+
+def print_table(results):
+    print('{:<32}'.format('case') + ''.join('{:>12}'.format(m) for m in METRICS))
+    for name, metrics in results.items():
+        print('{:<32}'.format(name) + ''.join('{:>12.1f}'.format(metrics[m]) for m in METRICS))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='bevo-pycom benchmark suite')
+    parser.add_argument('--repeat', type=int, help='calls per case (default 20, or the baseline\'s)')
+    parser.add_argument('--save', metavar='JSON')
+    parser.add_argument('--check', metavar='JSON')
+    parser.add_argument('--no-wall', action='store_true', help='ignore wall time when checking')
+    parser.add_argument('-k', action='append', dest='selected')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.check:
+        with open(args.check) as f:
+            baseline = json.load(f)
+
+    # Averages of polling loops depend on the number of calls, check with the baseline's
+    repeat = args.repeat or (baseline['repeat'] if baseline else 20)
+    results = run(repeat, args.selected)
+    print_table(results)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'repeat': repeat, 'cases': results}, f, indent=2, sort_keys=True)
+
+    if baseline is not None:
+        regressions = compare(results, baseline['cases'])
+        if args.no_wall:
+            regressions = [r for r in regressions if r[1] != 'wall_us']
+        for name, metric, ref, value in regressions:
+            print('REGRESSION {} {}: {:.1f} -> {:.1f}'.format(name, metric, ref, value))
+        if regressions:
+            return 1
+        print('no regressions against {}'.format(args.check))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+# Host side decoder for bevo-pycom uplinks
+#
+# Usage:
+#   python host/decode.py <port> <hex payload> [<hex payload> ...]
+#   python host/decode.py <port> < payloads.txt      (one hex payload per line)
+#   python host/decode.py --columns <port> ...       one list per field instead
+#
+# Port 11 frames are multiplexed (see lib/mux.py): version 1 frames carry
+# float32 payloads, version 2 the quantized payloads of lib/codec.py. Ports
+# 8/9/10 are the legacy one-sensor-per-uplink float payloads. Batch frames
+# (lib/batch.py) share port 11, byte 0 is 3 (delta) or 4 (aggregate).
+# Ports, names and payload layouts all come from the schema registry,
+# lib/codec.py SCHEMAS. Port 12 frames are settings reports of the remote
+# configuration (lib/remote.py), port 13 frames diagnostics (lib/instrument.py).
+#
+# decode_columns() decodes many frames at once: payloads are grouped per
+# sensor and layout and unpacked in one struct.iter_unpack pass each.
+
+import os
+import sys
+import struct
+import binascii
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from mux import unpack_frame
+from codec import SCHEMAS, LEGACY_PORTS, MUX_PORT, MUX_VERSION, MUX_VERSION_FLOAT, BATCH_DELTA, BATCH_AGGREGATE
+from batch import unpack_batch
+from remote import CONFIG_PORT, CMD_SET, parse
+from instrument import DIAG_PORT, unpack as unpack_diag
+
+# Sensor id -> name, from the schema registry
+NAMES = dict((sensor_id, schema.name) for sensor_id, schema in SCHEMAS.items())
+
+def decode_payload(sensor_id, payload, version=MUX_VERSION_FLOAT):
+    schema = SCHEMAS[sensor_id]
+    if version == MUX_VERSION:
+        return dict(zip(schema.names, schema.decode(payload)))
+    return dict(zip(schema.names, struct.unpack(schema.raw_fmt, payload)))
+
+def is_batch(port, frame):
+    return port == MUX_PORT and frame[0] in (BATCH_DELTA, BATCH_AGGREGATE)
+
+def scale_row(schema, row):
+    return dict((name, None if q == invalid else q / s)
+                for name, q, s, invalid in zip(schema.names, row, schema.scales, schema.invalid))
+
+'''
+    decodes a batch frame
+    delta: {name: {'count', 'interval_s', 'age_s', 'samples': [{field: value}]}}
+    aggregate: {name: {'count', 'interval_s', 'age_s', 'min', 'mean', 'max', 'last'}}
+    age_s is the age of the last sample when the frame was packed
+'''
+def decode_batch(frame):
+    kind, sensor_id, header, rows = unpack_batch(frame, SCHEMAS)
+    schema = SCHEMAS[sensor_id]
+    out = dict(header)
+    if kind == BATCH_DELTA:
+        out['samples'] = [scale_row(schema, row) for row in rows]
+    else:
+        for key, row in zip(('min', 'mean', 'max', 'last'), rows):
+            out[key] = scale_row(schema, row)
+    return {NAMES[sensor_id]: out}
+
+'''
+    returns (version, {sensor id: payload}) of one uplink
+'''
+def split(port, frame):
+    if port == MUX_PORT:
+        return frame[0], unpack_frame(frame)
+    if port in LEGACY_PORTS:
+        return MUX_VERSION_FLOAT, {LEGACY_PORTS[port]: frame}
+    raise ValueError("Unknown port {}".format(port))
+
+def decode(port, frame):
+    if port == CONFIG_PORT:
+        return {'config': dict((name, value) for op, name, value in parse(frame) if op == CMD_SET)}
+    if port == DIAG_PORT:
+        return unpack_diag(frame)
+    if is_batch(port, frame):
+        return decode_batch(frame)
+    version, payloads = split(port, frame)
+    return {NAMES[sensor_id]: decode_payload(sensor_id, payload, version) for sensor_id, payload in payloads.items()}
+
+'''
+    decodes many uplinks of one port into columns
+    returns {sensor name: {field: [value per uplink carrying that sensor]}}
+    values keep the order of the frames, the samples of a delta batch frame
+    are one row each; aggregate batch frames are left to decode()
+'''
+def decode_columns(port, frames):
+    # (sensor id, version) -> [(frame index, payload)]
+    groups = {}
+    # sensor id -> [(frame index, quantized row)] from delta batch frames
+    batched = {}
+    for index, frame in enumerate(frames):
+        if is_batch(port, frame):
+            kind, sensor_id, _, rows = unpack_batch(frame, SCHEMAS)
+            if kind == BATCH_DELTA:
+                batched.setdefault(sensor_id, []).extend((index, row) for row in rows)
+            continue
+        version, payloads = split(port, frame)
+        for sensor_id, payload in payloads.items():
+            groups.setdefault((sensor_id, version), []).append((index, payload))
+
+    columns = {}
+    for (sensor_id, version), rows in groups.items():
+        schema = SCHEMAS[sensor_id]
+        blob = b''.join(payload for _, payload in rows)
+        fmt = schema.fmt if version == MUX_VERSION else schema.raw_fmt
+        values = list(zip(*struct.iter_unpack(fmt, blob)))
+        if version == MUX_VERSION:
+            # Scale whole columns, keep the "no value" markers as None
+            values = [[None if q == invalid else q / scale for q in column]
+                      for column, scale, invalid in zip(values, schema.scales, schema.invalid)]
+
+        out = columns.setdefault(NAMES[sensor_id], {'frame': []})
+        out['frame'].extend(index for index, _ in rows)
+        for name, column in zip(schema.names, values):
+            out.setdefault(name, []).extend(column)
+
+    for sensor_id, rows in batched.items():
+        schema = SCHEMAS[sensor_id]
+        values = list(zip(*(row for _, row in rows)))
+        values = [[None if q == invalid else q / scale for q in column]
+                  for column, scale, invalid in zip(values, schema.scales, schema.invalid)]
+        out = columns.setdefault(NAMES[sensor_id], {'frame': []})
+        out['frame'].extend(index for index, _ in rows)
+        for name, column in zip(schema.names, values):
+            out.setdefault(name, []).extend(column)
+
+    # Frames of several versions may be mixed, restore frame order (stable,
+    # batch samples stay in sample order)
+    for out in columns.values():
+        order = sorted(range(len(out['frame'])), key=out['frame'].__getitem__)
+        for name in out:
+            out[name] = [out[name][i] for i in order]
+
+    return columns
+
+def main(argv):
+    columns = '--columns' in argv
+    argv = [arg for arg in argv if arg != '--columns']
+    if len(argv) < 2:
+        print("usage: decode.py [--columns] <port> [hex payload ...]")
+        return 1
+
+    port = int(argv[1])
+    frames = argv[2:] if len(argv) > 2 else (line.strip() for line in sys.stdin)
+    frames = [binascii.unhexlify(frame) for frame in frames if frame]
+
+    if columns:
+        for name, fields in decode_columns(port, frames).items():
+            print(name)
+            for field, values in fields.items():
+                print("  {}: {}".format(field, values))
+    else:
+        for frame in frames:
+            print(decode(port, frame))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
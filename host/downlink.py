@@ -0,0 +1,64 @@
+# Host side encoder for configuration downlinks (lib/remote.py)
+#
+# Usage:
+#   python host/downlink.py <command> [<command> ...]
+#
+# Commands, in the order they are applied:
+#   NAME=VALUE   set a setting of lib/remote.py SETTINGS, in main.py units
+#                (ms for periods and the airtime budget, 0/1 for flags)
+#   defaults     every setting back to the built-in value
+#   report       the device sends its settings on port 12
+#   reboot       reset once applied, needed for the sensor flags
+#
+#   python host/downlink.py CYCLE_S=60 LORA_DR=2 report
+#
+# Prints the frame in hex and base64 (network server consoles and APIs),
+# to be scheduled on port 12.
+
+import os
+import sys
+import binascii
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+from remote import CONFIG_PORT, CMD_DEFAULTS, CMD_REPORT, CMD_REBOOT, KEYS, RemoteError, encode_set, parse
+
+OPS = {'defaults': CMD_DEFAULTS, 'report': CMD_REPORT, 'reboot': CMD_REBOOT}
+
+'''
+    builds one downlink frame of command line commands
+'''
+def encode(commands):
+    frame = b''
+    for command in commands:
+        if command.lower() in OPS:
+            frame += bytes([OPS[command.lower()]])
+            continue
+        name, sep, value = command.partition('=')
+        if not sep or name not in KEYS:
+            raise RemoteError("Unknown command {}, settings: {}".format(command, ', '.join(sorted(KEYS))))
+        if value.lower() in ('true', 'false'):
+            value = value.lower() == 'true'
+        frame += encode_set(name, int(value))
+    return frame
+
+def main(argv):
+    if len(argv) < 2:
+        print("usage: downlink.py NAME=VALUE|defaults|report|reboot ...")
+        return 1
+
+    try:
+        frame = encode(argv[1:])
+    except (RemoteError, ValueError) as e:
+        print(e)
+        return 1
+
+    # Same check as the device
+    parse(frame)
+    print("port {}, {} bytes".format(CONFIG_PORT, len(frame)))
+    print("hex:    {}".format(binascii.hexlify(frame).decode()))
+    print("base64: {}".format(binascii.b2a_base64(frame).decode().strip()))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
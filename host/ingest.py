@@ -0,0 +1,342 @@
+# Bulk uplink ingest for bevo-pycom archives
+#
+# Usage:
+#   python host/ingest.py [--chunk N] <out dir> <input> [<input> ...]
+#   python host/ingest.py --archive <out.frames> <input> [<input> ...]
+#
+# Inputs, by extension:
+#   .jsonl    TTN uplink messages, one per line: v3 ("uplink_message" with
+#             "f_port", "frm_payload", "received_at") or v2 ("port",
+#             "payload_raw", "metadata.time"), payloads in base64
+#   .frames   frame archive written by --archive / write_frames()
+#   other     "<port> <hex payload>" per line, as host/decode.py reads them
+#
+# Frames are read in chunks into a frame_dtype() array: receive time, port,
+# length and the frame bytes zero-padded to a fixed width. Each chunk is
+# decoded with NumPy, not frame by frame: frames are grouped by port, length
+# and header bytes, which fixes their layout, and each sensor payload of a
+# group is viewed as a structured array of its codec.SCHEMAS layout in one go.
+# Only batch frames (lib/batch.py, varint deltas) go through the per-frame
+# decoder.
+#
+# Output: one directory per sensor with one file per column (<column>.bin,
+# raw little-endian) appended chunk by chunk, and columns.json with the
+# column dtypes and row count; load_columns() reads them back. Columns are
+# time_ms (receive time, minus the sample age for batch samples), frame (the
+# frame's index in the input) and the payload fields as float32, NaN where
+# a sensor had no value.
+#
+# Needs numpy, the per-frame decoder in host/decode.py does not.
+
+import os
+import sys
+import json
+import binascii
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'lib'))
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from mux import SENSOR_SIZES, MUX_HEADER_SIZE, US915_MAX_PAYLOAD
+from codec import SCHEMAS, LEGACY_PORTS, MUX_PORT, MUX_VERSION_FLOAT, BATCH_DELTA, BATCH_AGGREGATE
+from batch import unpack_batch, BatchError
+from decode import NAMES
+
+ARCHIVE_MAGIC = b'BEVOFRM1'
+MAX_FRAME = max(US915_MAX_PAYLOAD.values())
+CHUNK_FRAMES = 1 << 16
+
+# struct format character -> numpy type
+_NP_TYPES = {'B': 'u1', 'H': 'u2', 'I': 'u4', 'b': 'i1', 'h': 'i2', 'i': 'i4', 'f': 'f4'}
+
+def frame_dtype(width=MAX_FRAME):
+    return np.dtype([('time_ms', '<i8'), ('port', 'u1'), ('length', 'u1'), ('data', 'u1', (width,))])
+
+def schema_dtype(schema, raw=False):
+    """ structured dtype of a sensor payload, the float layout if raw """
+    fmt = (schema.raw_fmt if raw else schema.fmt).lstrip('<')
+    return np.dtype([(name, '<' + _NP_TYPES[c]) for name, c in zip(schema.names, fmt)])
+
+'''
+    builds a frame array from (time_ms, port, frame bytes) tuples
+'''
+def to_frames(records, width=MAX_FRAME):
+    n = len(records)
+    frames = np.zeros(n, frame_dtype(width))
+    if not n:
+        return frames
+    times, ports, payloads = zip(*records)
+    frames['time_ms'] = times
+    frames['port'] = ports
+    frames['length'] = [len(p) for p in payloads]
+    if max(frames['length']) > width:
+        raise ValueError("Frame longer than {} bytes".format(width))
+    blob = b''.join(p.ljust(width, b'\0') for p in payloads)
+    frames['data'] = np.frombuffer(blob, 'u1').reshape(n, width)
+    return frames
+
+def _ttn_record(line):
+    msg = json.loads(line)
+    up = msg.get('uplink_message')
+    if up is not None:
+        return (msg.get('received_at', ''), up['f_port'], binascii.a2b_base64(up['frm_payload']))
+    return (msg.get('metadata', {}).get('time', ''), msg['port'], binascii.a2b_base64(msg['payload_raw']))
+
+def _iso_ms(stamps):
+    # numpy parses ISO 8601 without the zone suffix, TTN times are UTC
+    stamps = [s.rstrip('Z') if s else 'NaT' for s in stamps]
+    ms = np.array(stamps, dtype='datetime64[ms]')
+    return np.where(np.isnat(ms), 0, ms.astype('<i8'))
+
+'''
+    yields frame arrays of up to chunk frames from one input file
+'''
+def read_frames(path, chunk=CHUNK_FRAMES):
+    if path.endswith('.frames'):
+        with open(path, 'rb') as f:
+            if f.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError("{}: not a frame archive".format(path))
+            dtype = frame_dtype(int(np.frombuffer(f.read(2), '<u2')[0]))
+            while True:
+                frames = np.fromfile(f, dtype, count=chunk)
+                if not len(frames):
+                    return
+                yield frames
+        return
+
+    jsonl = path.endswith('.jsonl')
+    with open(path) as f:
+        records = []
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if jsonl:
+                records.append(_ttn_record(line))
+            else:
+                port, payload = line.split()
+                records.append(('', int(port), binascii.unhexlify(payload)))
+            if len(records) == chunk:
+                yield _records_to_frames(records)
+                records = []
+        if records:
+            yield _records_to_frames(records)
+
+def _records_to_frames(records):
+    stamps, ports, payloads = zip(*records)
+    return to_frames(list(zip(_iso_ms(stamps), ports, payloads)))
+
+'''
+    writes frame arrays to a .frames archive
+'''
+def write_frames(path, chunks, width=MAX_FRAME):
+    dtype = frame_dtype(width)
+    with open(path, 'wb') as f:
+        f.write(ARCHIVE_MAGIC)
+        f.write(np.array([width], '<u2').tobytes())
+        for frames in chunks:
+            out = np.zeros(len(frames), dtype)
+            for name in ('time_ms', 'port', 'length'):
+                out[name] = frames[name]
+            w = min(width, frames['data'].shape[1])
+            out['data'][:, :w] = frames['data'][:, :w]
+            out.tofile(f)
+
+def _scale(schema, raw, values):
+    """ structured payload array -> {field: float32 column} """
+    out = {}
+    for i, name in enumerate(schema.names):
+        column = values[name]
+        if raw:
+            out[name] = column.astype('f4')
+        else:
+            scaled = column / np.float32(schema.scales[i])
+            out[name] = np.where(column == schema.invalid[i], np.float32('nan'), scaled).astype('f4')
+    return out
+
+'''
+    decodes one frame array
+    returns ({sensor name: {column: array}}, bad frame count)
+    first: index of frames[0] in the input, for the frame column
+'''
+def decode_frames(frames, first=0):
+    data = frames['data']
+    port = frames['port'].astype('<u4')
+    length = frames['length'].astype('<u4')
+    mux = port == MUX_PORT
+    # Port, length and (for mux frames) version and bitmap fix the layout
+    key = (port << 24) | (length << 16) | np.where(mux, (data[:, 0].astype('<u4') << 8) | data[:, 1], 0)
+    keys, inverse = np.unique(key, return_inverse=True)
+    order = np.argsort(inverse, kind='stable')
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(keys)))
+
+    pieces = {}
+    bad = 0
+    start = 0
+    for g, k in enumerate(keys):
+        idx = order[start:bounds[g]]
+        start = bounds[g]
+        p, n = int(k >> 24), int((k >> 16) & 0xFF)
+        version, bitmap = int((k >> 8) & 0xFF), int(k & 0xFF)
+
+        if p in LEGACY_PORTS:
+            layout = [(LEGACY_PORTS[p], 0, True)]
+            size = SCHEMAS[LEGACY_PORTS[p]].raw_size
+        elif p == MUX_PORT and version in (BATCH_DELTA, BATCH_AGGREGATE):
+            bad += _decode_batches(frames, idx, first, pieces)
+            continue
+        elif p == MUX_PORT and version in SENSOR_SIZES:
+            layout = []
+            size = MUX_HEADER_SIZE
+            for sensor_id in range(8):
+                if bitmap & (1 << sensor_id):
+                    if sensor_id not in SENSOR_SIZES[version]:
+                        size = -1
+                        break
+                    layout.append((sensor_id, size, version == MUX_VERSION_FLOAT))
+                    size += SENSOR_SIZES[version][sensor_id]
+        else:
+            bad += len(idx)
+            continue
+
+        if size != n:
+            bad += len(idx)
+            continue
+
+        block = data[idx]
+        for sensor_id, offset, raw in layout:
+            schema = SCHEMAS[sensor_id]
+            dtype = schema_dtype(schema, raw)
+            values = np.ascontiguousarray(block[:, offset:offset + dtype.itemsize]).view(dtype)[:, 0]
+            columns = {'time_ms': frames['time_ms'][idx], 'frame': idx.astype('<i8') + first}
+            columns.update(_scale(schema, raw, values))
+            pieces.setdefault(sensor_id, []).append(columns)
+
+    return _merge(pieces), bad
+
+def _decode_batches(frames, idx, first, pieces):
+    # Varint deltas have no fixed layout, one frame at a time
+    bad = 0
+    for i in idx:
+        frame = frames['data'][i, :frames['length'][i]].tobytes()
+        try:
+            kind, sensor_id, header, rows = unpack_batch(frame, SCHEMAS)
+        except BatchError:
+            bad += 1
+            continue
+        if kind != BATCH_DELTA:
+            # Aggregates are summaries, not samples, see host/decode.py
+            continue
+        schema = SCHEMAS[sensor_id]
+        n = len(rows)
+        values = np.array(rows, dtype='<i8').view([(name, '<i8') for name in schema.names])[:, 0]
+        ages_s = header['age_s'] + header['interval_s'] * np.arange(n - 1, -1, -1)
+        columns = {'time_ms': frames['time_ms'][i] - ages_s * 1000, 'frame': np.full(n, i + first, '<i8')}
+        columns.update(_scale(schema, False, values))
+        pieces.setdefault(sensor_id, []).append(columns)
+    return bad
+
+def _merge(pieces):
+    out = {}
+    for sensor_id, parts in pieces.items():
+        columns = dict((name, np.concatenate([part[name] for part in parts])) for name in parts[0])
+        order = np.argsort(columns['frame'], kind='stable')
+        out[NAMES[sensor_id]] = dict((name, column[order]) for name, column in columns.items())
+    return out
+
+class ColumnWriter:
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self._files = {}
+        self._dtypes = {}
+        self.rows = {}
+
+    def append(self, decoded):
+        """ appends the output of decode_frames() """
+        for sensor, columns in decoded.items():
+            if sensor not in self.rows:
+                os.makedirs(os.path.join(self.out_dir, sensor), exist_ok=True)
+                self.rows[sensor] = 0
+                self._dtypes[sensor] = {}
+            for name, column in columns.items():
+                key = (sensor, name)
+                if key not in self._files:
+                    self._files[key] = open(os.path.join(self.out_dir, sensor, name + '.bin'), 'wb')
+                    self._dtypes[sensor][name] = column.dtype.newbyteorder('<').str
+                column.astype(self._dtypes[sensor][name], copy=False).tofile(self._files[key])
+            self.rows[sensor] += len(columns['frame'])
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        for sensor, rows in self.rows.items():
+            with open(os.path.join(self.out_dir, sensor, 'columns.json'), 'w') as f:
+                json.dump({'rows': rows, 'columns': self._dtypes[sensor]}, f, indent=1)
+
+'''
+    reads an ingest output directory back, {sensor: {column: array}}
+'''
+def load_columns(out_dir):
+    out = {}
+    for sensor in sorted(os.listdir(out_dir)):
+        meta_path = os.path.join(out_dir, sensor, 'columns.json')
+        if not os.path.exists(meta_path):
+            continue
+        with open(meta_path) as f:
+            meta = json.load(f)
+        out[sensor] = dict((name, np.fromfile(os.path.join(out_dir, sensor, name + '.bin'), dtype))
+                           for name, dtype in meta['columns'].items())
+    return out
+
+'''
+    decodes every input into out_dir, returns (frames, bad frames, {sensor: rows})
+'''
+def ingest(out_dir, paths, chunk=CHUNK_FRAMES):
+    writer = ColumnWriter(out_dir)
+    total = 0
+    bad = 0
+    try:
+        for path in paths:
+            for frames in read_frames(path, chunk):
+                decoded, n_bad = decode_frames(frames, total)
+                writer.append(decoded)
+                total += len(frames)
+                bad += n_bad
+    finally:
+        writer.close()
+    return total, bad, writer.rows
+
+def main(argv):
+    if np is None:
+        print("ingest.py needs numpy")
+        return 1
+
+    args = argv[1:]
+    chunk = CHUNK_FRAMES
+    if '--chunk' in args:
+        i = args.index('--chunk')
+        chunk = int(args[i + 1])
+        del args[i:i + 2]
+    archive = '--archive' in args
+    args = [arg for arg in args if arg != '--archive']
+    if len(args) < 2:
+        print("usage: ingest.py [--chunk N] <out dir> <input> ... | --archive <out.frames> <input> ...")
+        return 1
+
+    if archive:
+        write_frames(args[0], (frames for path in args[1:] for frames in read_frames(path, chunk)))
+        return 0
+
+    total, bad, rows = ingest(args[0], args[1:], chunk)
+    print("{} frames, {} bad".format(total, bad))
+    for sensor, n in rows.items():
+        print("  {}: {} rows".format(sensor, n))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
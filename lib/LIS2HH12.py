@@ -12,6 +12,7 @@ import math
 import time
 import struct
 from machine import Pin
+import instrument
 
 
 FULL_SCALE_2G = const(0)
@@ -56,7 +57,7 @@ class LIS2HH12:
             self.i2c = pysense.i2c
         else:
             from machine import I2C
-            self.i2c = I2C(0, mode=I2C.MASTER, pins=(sda, scl))
+            self.i2c = instrument.wrap_i2c(I2C(0, mode=I2C.MASTER, pins=(sda, scl)), 'pysense')
 
         self.odr = 0
         self.full_scale = 0
@@ -67,6 +68,9 @@ class LIS2HH12:
         self.act_dur = 0
         self.debounced = False
 
+        # X, Y, Z low/high, read in one burst
+        self._data = bytearray(6)
+
         whoami = self.i2c.readfrom_mem(ACC_I2CADDR , PRODUCTID_REG, 1)
         if (whoami[0] != 0x41):
             raise ValueError("LIS2HH12 not found")
@@ -84,14 +88,11 @@ class LIS2HH12:
         self.acceleration()
 
     def acceleration(self):
-        x = self.i2c.readfrom_mem(ACC_I2CADDR , ACC_X_L_REG, 2)
-        self.x = struct.unpack('<h', x)
-        y = self.i2c.readfrom_mem(ACC_I2CADDR , ACC_Y_L_REG, 2)
-        self.y = struct.unpack('<h', y)
-        z = self.i2c.readfrom_mem(ACC_I2CADDR , ACC_Z_L_REG, 2)
-        self.z = struct.unpack('<h', z)
+        # register address auto-increment (CTRL4 IF_ADD_INC) is on by default
+        self.i2c.readfrom_mem_into(ACC_I2CADDR , ACC_X_L_REG, self._data)
+        self.x, self.y, self.z = struct.unpack_from('<hhh', self._data, 0)
         _mult = self.SCALES[self.full_scale] / ACC_G_DIV
-        return (self.x[0] * _mult, self.y[0] * _mult, self.z[0] * _mult)
+        return (self.x * _mult, self.y * _mult, self.z * _mult)
 
     def roll(self):
         x,y,z = self.acceleration()
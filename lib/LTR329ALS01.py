@@ -9,7 +9,9 @@
 #
 
 import time
+import struct
 from machine import I2C
+import instrument
 
 class LTR329ALS01:
     ALS_I2CADDR = const(0x29) # The device's I2C address
@@ -49,7 +51,7 @@ class LTR329ALS01:
         if pysense is not None:
             self.i2c = pysense.i2c
         else:
-            self.i2c = I2C(0, mode=I2C.MASTER, pins=(sda, scl))
+            self.i2c = instrument.wrap_i2c(I2C(0, mode=I2C.MASTER, pins=(sda, scl)), 'pysense')
 
         contr = self._getContr(gain)
         self.i2c.writeto_mem(ALS_I2CADDR, ALS_CONTR_REG, bytearray([contr]))
@@ -59,6 +61,9 @@ class LTR329ALS01:
 
         time.sleep(0.01)
 
+        # CH1 low/high, CH0 low/high, read in one burst
+        self._data = bytearray(4)
+
     def _getContr(self, gain):
         return ((gain & 0x07) << 2) + 0x01
 
@@ -69,12 +74,8 @@ class LTR329ALS01:
         return ((high & 0xFF) << 8) + (low & 0xFF)
 
     def light(self):
-        ch1low = self.i2c.readfrom_mem(ALS_I2CADDR , ALS_DATA_CH1_LOW, 1)
-        ch1high = self.i2c.readfrom_mem(ALS_I2CADDR , ALS_DATA_CH1_HIGH, 1)
-        data1 = int(self._getWord(ch1high[0], ch1low[0]))
-
-        ch0low = self.i2c.readfrom_mem(ALS_I2CADDR , ALS_DATA_CH0_LOW, 1)
-        ch0high = self.i2c.readfrom_mem(ALS_I2CADDR , ALS_DATA_CH0_HIGH, 1)
-        data0 = int(self._getWord(ch0high[0], ch0low[0]))
+        # CH1 must be read before CH0, which the burst from 0x88 does
+        self.i2c.readfrom_mem_into(ALS_I2CADDR , ALS_DATA_CH1_LOW, self._data)
+        data1, data0 = struct.unpack_from('<HH', self._data, 0)
 
         return (data0, data1)
@@ -9,7 +9,9 @@
 #
 
 import time
+import struct
 from machine import I2C
+import instrument
 
 ALTITUDE = const(0)
 PRESSURE = const(1)
@@ -57,11 +59,17 @@ class MPL3115A2:
         if pysense is not None:
             self.i2c = pysense.i2c
         else:
-            self.i2c = I2C(0, mode=I2C.MASTER, pins=(sda, scl))
+            self.i2c = instrument.wrap_i2c(I2C(0, mode=I2C.MASTER, pins=(sda, scl)), 'pysense')
 
         self.STA_reg = bytearray(1)
         self.mode = mode
 
+        # OUT_P_MSB, OUT_P_CSB, OUT_P_LSB, OUT_T_MSB, OUT_T_LSB, read in bursts
+        self._data = bytearray(5)
+        _mv = memoryview(self._data)
+        self._p_data = _mv[0:3]
+        self._t_data = _mv[3:5]
+
         if self.mode is PRESSURE:
             self.i2c.writeto_mem(MPL3115_I2CADDR, MPL3115_CTRL_REG1, bytes([0x38])) # barometer mode, not raw, oversampling 128, minimum time 512 ms
             self.i2c.writeto_mem(MPL3115_I2CADDR, MPL3115_PT_DATA_CFG, bytes([0x07])) # no events detected
@@ -90,40 +98,42 @@ class MPL3115A2:
             else:
                 return False
 
+    def _decode_pressure(self):
+        # Q18.2 Pa in the upper 20 bits of OUT_P
+        msw, lsb = struct.unpack_from('>HB', self._data, 0)
+        return float(((msw << 8) | lsb) >> 4) / 4.0
+
+    def _decode_altitude(self):
+        # Q16.4 m in the upper 20 bits of OUT_P
+        alt_int, lsb = struct.unpack_from('>hB', self._data, 0)
+        return float(alt_int + ((lsb >> 4) & 0x0F) / 16.0)
+
+    def _decode_temperature(self):
+        # Q8.8 deg C in OUT_T
+        temp_int, temp_frac = struct.unpack_from('>bB', self._data, 3)
+        return float(temp_int + temp_frac / 256.0)
+
     def pressure(self):
         if self.mode == ALTITUDE:
             raise MPL3115A2exception("Incorrect Measurement Mode MPL3115A2")
 
-        OUT_P_MSB = self.i2c.readfrom_mem(MPL3115_I2CADDR, MPL3115_PRESSURE_DATA_MSB,1)
-        OUT_P_CSB = self.i2c.readfrom_mem(MPL3115_I2CADDR, MPL3115_PRESSURE_DATA_CSB,1)
-        OUT_P_LSB = self.i2c.readfrom_mem(MPL3115_I2CADDR, MPL3115_PRESSURE_DATA_LSB,1)
-
-        return float((OUT_P_MSB[0] << 10) + (OUT_P_CSB[0] << 2) + ((OUT_P_LSB[0] >> 6) & 0x03) + ((OUT_P_LSB[0] >> 4) & 0x03) / 4.0)
+        self.i2c.readfrom_mem_into(MPL3115_I2CADDR, MPL3115_PRESSURE_DATA_MSB, self._p_data)
+        return self._decode_pressure()
 
     def altitude(self):
         if self.mode == PRESSURE:
             raise MPL3115A2exception("Incorrect Measurement Mode MPL3115A2")
 
-        OUT_P_MSB = self.i2c.readfrom_mem(MPL3115_I2CADDR, MPL3115_PRESSURE_DATA_MSB,1)
-        OUT_P_CSB = self.i2c.readfrom_mem(MPL3115_I2CADDR, MPL3115_PRESSURE_DATA_CSB,1)
-        OUT_P_LSB = self.i2c.readfrom_mem(MPL3115_I2CADDR, MPL3115_PRESSURE_DATA_LSB,1)
-
-        alt_int = (OUT_P_MSB[0] << 8) + (OUT_P_CSB[0])
-        alt_frac = ((OUT_P_LSB[0] >> 4) & 0x0F)
-
-        if alt_int > 32767:
-            alt_int -= 65536
-
-        return float(alt_int + alt_frac / 16.0)
+        self.i2c.readfrom_mem_into(MPL3115_I2CADDR, MPL3115_PRESSURE_DATA_MSB, self._p_data)
+        return self._decode_altitude()
 
     def temperature(self):
-        OUT_T_MSB = self.i2c.readfrom_mem(MPL3115_I2CADDR, MPL3115_TEMP_DATA_MSB,1)
-        OUT_T_LSB = self.i2c.readfrom_mem(MPL3115_I2CADDR, MPL3115_TEMP_DATA_LSB,1)
-
-        temp_int = OUT_T_MSB[0]
-        temp_frac = OUT_T_LSB[0]
+        self.i2c.readfrom_mem_into(MPL3115_I2CADDR, MPL3115_TEMP_DATA_MSB, self._t_data)
+        return self._decode_temperature()
 
-        if temp_int > 127:
-            temp_int -= 256
-
-        return float(temp_int + temp_frac / 256.0)
+    def pressure_temperature(self):
+        """ returns (pressure or altitude depending on mode, temperature) from one burst read """
+        self.i2c.readfrom_mem_into(MPL3115_I2CADDR, MPL3115_PRESSURE_DATA_MSB, self._data)
+        if self.mode == PRESSURE:
+            return (self._decode_pressure(), self._decode_temperature())
+        return (self._decode_altitude(), self._decode_temperature())
@@ -10,9 +10,34 @@
 
 import time
 from machine import I2C
+import instrument
 import math
+from crc8 import crc8
 
-__version__ = '0.0.2'
+__version__ = '0.0.3'
+
+# Resolution settings (user register bits D7 and D0)
+RES_RH12_T14 = const(0x00)
+RES_RH8_T12 = const(0x01)
+RES_RH10_T13 = const(0x80)
+RES_RH11_T11 = const(0x81)
+
+# Max conversion times in ms for each resolution, datasheet table 2 rounded
+# up: (humidity, temperature)
+_CONVERSION_MS = {
+    RES_RH12_T14: (12, 11),
+    RES_RH8_T12: (4, 4),
+    RES_RH10_T13: (5, 7),
+    RES_RH11_T11: (7, 3),
+}
+
+# A read NACKed because the conversion is still running is retried every
+# _NACK_RETRY_MS, at most _NACK_RETRIES times
+_NACK_RETRIES = const(5)
+_NACK_RETRY_MS = const(2)
+
+class SI7006A20exception(Exception):
+    pass
 
 class SI7006A20:
     """ class for handling the temperature sensor SI7006-A20
@@ -24,87 +49,158 @@ class SI7006A20:
 
     TEMP_NOHOLDMASTER = const(0xF3)
     HUMD_NOHOLDMASTER = const(0xF5)
+    TEMP_FROM_HUMD = const(0xE0)
+    USER_REG_READ = const(0xE7)
+    USER_REG_WRITE = const(0xE6)
 
     def __init__(self, pysense = None, sda = 'P22', scl = 'P21'):
         if pysense is not None:
             self.i2c = pysense.i2c
         else:
-            self.i2c = I2C(0, mode=I2C.MASTER, pins=(sda, scl))
+            self.i2c = instrument.wrap_i2c(I2C(0, mode=I2C.MASTER, pins=(sda, scl)), 'pysense')
+
+        self._buf = bytearray(3)
+        self._cmd = bytearray(1)
+        self._ready_at = None
+        self.resolution = self.read_user_reg() & RES_RH11_T11
 
     def _getWord(self, high, low):
         return ((high & 0xFF) << 8) + (low & 0xFF)
 
+    def _command(self, cmd):
+        self._cmd[0] = cmd
+        self.i2c.writeto(SI7006A20_I2C_ADDR, self._cmd)
+
+    def _trigger(self, cmd, wait_ms):
+        self._command(cmd)
+        self._ready_at = time.ticks_add(time.ticks_ms(), wait_ms)
+        return wait_ms
+
+    def _collect(self):
+        """ waits for the pending conversion and returns the crc checked raw word """
+        if self._ready_at is None:
+            raise SI7006A20exception("No conversion triggered")
+        remaining = time.ticks_diff(self._ready_at, time.ticks_ms())
+        if remaining > 0:
+            time.sleep_ms(remaining)
+        self._ready_at = None
+
+        retries = 0
+        while True:
+            try:
+                self.i2c.readfrom_into(SI7006A20_I2C_ADDR, self._buf)
+                break
+            except OSError:
+                if retries == _NACK_RETRIES:
+                    raise
+                retries += 1
+                time.sleep_ms(_NACK_RETRY_MS)
+        if crc8(self._buf, 0, 2, 0x00) != self._buf[2]:
+            raise SI7006A20exception("Bad crc SI7006A20")
+        return self._getWord(self._buf[0], self._buf[1])
+
+    def _temp_from_word(self, data):
+        return ((175.72 * data) / 65536.0) - 46.85
+
+    def _humid_from_word(self, data):
+        return ((125.0 * data) / 65536.0) - 6.0
+
+    def ready(self):
+        """ True when the triggered conversion is expected to be done """
+        return self._ready_at is None or time.ticks_diff(self._ready_at, time.ticks_ms()) <= 0
+
+    def trigger_temperature(self):
+        """ starts a temperature conversion, returns the conversion time in ms """
+        return self._trigger(TEMP_NOHOLDMASTER, _CONVERSION_MS[self.resolution][1])
+
+    def collect_temperature(self):
+        """ returns the temperature(degrees Celsius) of the triggered conversion, waiting if needed """
+        return self._temp_from_word(self._collect())
+
+    def trigger_humidity(self):
+        """ starts a humidity conversion (which also converts temperature), returns the conversion time in ms """
+        rh_ms, t_ms = _CONVERSION_MS[self.resolution]
+        return self._trigger(HUMD_NOHOLDMASTER, rh_ms + t_ms)
+
+    def collect_humidity(self):
+        """ returns the relative humidity(%) of the triggered conversion, waiting if needed """
+        return self._humid_from_word(self._collect())
+
     def temperature(self):
         """ obtaining the temperature(degrees Celsius) measured by sensor """
-        self.i2c.writeto(SI7006A20_I2C_ADDR, bytearray([0xF3]))
-        time.sleep(0.5)
-        data = self.i2c.readfrom(SI7006A20_I2C_ADDR, 3)
-        #print("CRC Raw temp data: " + hex(data[0]*65536 + data[1]*256 + data[2]))
-        data = self._getWord(data[0], data[1])
-        temp = ((175.72 * data) / 65536.0) - 46.85
-        return temp
+        self.trigger_temperature()
+        return self.collect_temperature()
 
     def humidity(self):
         """ obtaining the relative humidity(%) measured by sensor """
-        self.i2c.writeto(SI7006A20_I2C_ADDR, bytearray([0xF5]))
-        time.sleep(0.5)
+        self.trigger_humidity()
+        return self.collect_humidity()
+
+    def temperature_from_humidity(self):
+        """ temperature(degrees Celsius) converted during the last humidity measurement, no new conversion """
+        self._command(TEMP_FROM_HUMD)
         data = self.i2c.readfrom(SI7006A20_I2C_ADDR, 2)
-        data = self._getWord(data[0], data[1])
-        humidity = ((125.0 * data) / 65536.0) - 6.0
-        return humidity
+        return self._temp_from_word(self._getWord(data[0], data[1]))
+
+    def read_all(self):
+        """ returns (temperature, humidity, dew point) from a single humidity + temperature conversion pair """
+        humid = self.humidity()
+        temp = self.temperature_from_humidity()
+        return (temp, humid, self._dew_point(temp, humid))
+
+    def set_resolution(self, resolution):
+        """ sets the measurement resolution, one of the RES_* constants """
+        reg = self.read_user_reg()
+        reg = (reg & ~RES_RH11_T11 & 0xFF) | resolution
+        self.i2c.writeto(SI7006A20_I2C_ADDR, bytearray([USER_REG_WRITE, reg]))
+        self.resolution = resolution
 
     def read_user_reg(self):
         """ reading the user configuration register """
-        self.i2c.writeto(SI7006A20_I2C_ADDR, bytearray([0xE7]))
-        time.sleep(0.5)
+        self.i2c.writeto(SI7006A20_I2C_ADDR, bytearray([USER_REG_READ]))
         data = self.i2c.readfrom(SI7006A20_I2C_ADDR, 1)
         return data[0]
 
     def read_heater_reg(self):
         """ reading the heater configuration register """
         self.i2c.writeto(SI7006A20_I2C_ADDR, bytearray([0x11]))
-        time.sleep(0.5)
         data = self.i2c.readfrom(SI7006A20_I2C_ADDR, 1)
         return data[0]
 
     def read_electronic_id(self):
         """ reading electronic identifier """
         self.i2c.writeto(SI7006A20_I2C_ADDR, bytearray([0xFA]) + bytearray([0x0F]))
-        time.sleep(0.5)
         sna = self.i2c.readfrom(SI7006A20_I2C_ADDR, 4)
-        time.sleep(0.1)
         self.i2c.writeto(SI7006A20_I2C_ADDR, bytearray([0xFC]) + bytearray([0xC9]))
-        time.sleep(0.5)
         snb = self.i2c.readfrom(SI7006A20_I2C_ADDR, 4)
         return [sna[0], sna[1], sna[2], sna[3], snb[0], snb[1], snb[2], snb[3]]
 
     def read_firmware(self):
         """ reading firmware version """
         self.i2c.writeto(SI7006A20_I2C_ADDR, bytearray([0x84])+ bytearray([0xB8]))
-        time.sleep(0.5)
         fw = self.i2c.readfrom(SI7006A20_I2C_ADDR, 1)
         return fw[0]
 
     def read_reg(self, reg_addr):
         """ reading a register """
         self.i2c.writeto(SI7006A20_I2C_ADDR, bytearray([reg_addr]))
-        time.sleep(0.5)
         data = self.i2c.readfrom(SI7006A20_I2C_ADDR, 1)
         return data[0]
 
     def write_reg(self, reg_addr, value):
         """ writing a register """
         self.i2c.writeto(SI7006A20_I2C_ADDR, bytearray([reg_addr])+bytearray([value]))
-        time.sleep(0.1)
+
+    def _dew_point(self, temp, humid):
+        if humid <= 0:
+            return None
+        h = (math.log(humid, 10) - 2) / 0.4343 + (17.62 * temp) / (243.12 + temp)
+        return 243.12 * h / (17.62 - h)
 
     def dew_point(self):
         """ computing the dew pointe temperature (deg C) for the current Temperature and Humidity measured pair
             at dew-point temperature the relative humidity is 100% """
-        temp = self.temperature()
-        humid = self.humidity()
-        h = (math.log(humid, 10) - 2) / 0.4343 + (17.62 * temp) / (243.12 + temp)
-        dew_p = 243.12 * h / (17.62 - h)
-        return dew_p
+        return self.read_all()[2]
 
     def humid_ambient(self, t_ambient, dew_p = None):
         """ returns the relative humidity compensated for the current Ambient temperature
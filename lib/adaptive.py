@@ -0,0 +1,68 @@
+# Adaptive sampling interval
+#
+# One AdaptiveInterval per sensor. After every sample update() compares the
+# readings with the reference (the last sample that changed something):
+# while every field stays within its deadband the interval doubles, up to
+# max_ms; as soon as one field moves out of its deadband the interval drops
+# back to min_ms and that sample becomes the new reference. Stable readings
+# cost fewer bus transactions and uplinks, a change is followed closely.
+#
+# Deadbands are absolute, in the units of the sensor payload (ug/m3, ppm,
+# degC, ...). Fields without a value (None or NaN) are not compared.
+#
+#   adapt = AdaptiveInterval(15000, 120000, (0.2, 1.0))
+#   period_ms = adapt.update((temperature, humidity), sample_start_ms)
+#   ...
+#   if adapt.due():
+#       take the next sample
+
+import time
+
+class AdaptiveInterval:
+
+    def __init__(self, min_ms, max_ms, deadbands, factor=2):
+        if min_ms <= 0 or max_ms < min_ms:
+            raise ValueError("Bad interval bounds {}..{} ms".format(min_ms, max_ms))
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.deadbands = tuple(deadbands)
+        self.factor = factor
+
+        self.interval_ms = min_ms
+        self.reference = None
+        self._last = None
+
+        # Samples that moved out of the deadband / stayed in it
+        self.changes = 0
+        self.stable = 0
+
+    def update(self, values, stamp=None):
+        """ takes one sample's values, returns the interval until the next one
+        stamp: ticks_ms the sample was started, due() counts from it (default now) """
+        self._last = time.ticks_ms() if stamp is None else stamp
+        if self._changed(values):
+            self.reference = tuple(values)
+            self.interval_ms = self.min_ms
+            self.changes += 1
+        else:
+            self.interval_ms = min(self.interval_ms * self.factor, self.max_ms)
+            self.stable += 1
+        return self.interval_ms
+
+    def due(self):
+        """ True once interval_ms has passed since the last update() """
+        return self._last is None or time.ticks_diff(time.ticks_ms(), self._last) >= self.interval_ms
+
+    def _changed(self, values):
+        if self.reference is None:
+            return True
+        for value, ref, band in zip(values, self.reference, self.deadbands):
+            if value is None or value != value or ref is None or ref != ref:
+                continue
+            if abs(value - ref) > band:
+                return True
+        return False
+
+    def __str__(self):
+        return "interval {} ms ({}..{}), {} changes, {} stable".format(
+            self.interval_ms, self.min_ms, self.max_ms, self.changes, self.stable)
@@ -0,0 +1,161 @@
+# Uplink airtime budget
+#
+# time_on_air_ms() predicts the airtime of an uplink from its payload size and
+# data rate (Semtech LoRa modem formula, plus the 13 bytes LoRaWAN adds: MAC
+# header, frame header, FPort and MIC).
+#
+# AirtimeBudget keeps a ledger of the airtime used over the last 24 h in
+# hourly buckets, and paces uplinks with a token bucket that refills at
+# budget / window: a frame may go out when the tokens cover its predicted
+# airtime (or are full) and the ledger has room for it. The budget is spread
+# over the day instead of spent in the first hour, with bursts up to one
+# bucket's share. Uplinks are charged whether or not they were paced, the
+# tokens go at most one burst below zero.
+#
+# The ledger is RAM only, the daily cap holds while the device stays up. A
+# caller that reboots between uplinks (deep sleep) carries only the tokens
+# over with restore(): they still keep any window to budget_ms plus two bursts
+# (full tokens at its start, the debt at its end).
+#
+#   budget = AirtimeBudget(30000)           # e.g. TTN fair use, 30 s / 24 h
+#   predicted = budget.predict_ms(len(frame), dr)
+#   if budget.allows(predicted):
+#       send(frame)
+#       budget.record(predicted, lora.stats().tx_time_on_air)
+
+import math
+import time
+
+DAY_MS = 24 * 3600 * 1000
+
+# LoRaWAN MHDR (1) + FHDR without options (7) + FPort (1) + MIC (4)
+LORAWAN_OVERHEAD = 13
+
+# Region -> uplink data rate -> (spreading factor, bandwidth kHz)
+DATA_RATES = {
+    'US915': {0: (10, 125), 1: (9, 125), 2: (8, 125), 3: (7, 125), 4: (8, 500)},
+    'EU868': {0: (12, 125), 1: (11, 125), 2: (10, 125), 3: (9, 125), 4: (8, 125), 5: (7, 125), 6: (7, 250)},
+    'AU915': {0: (12, 125), 1: (11, 125), 2: (10, 125), 3: (9, 125), 4: (8, 125), 5: (7, 125), 6: (8, 500)},
+}
+
+class AirtimeError(Exception):
+    pass
+
+def time_on_air_ms(payload_len, dr, region='US915', cr=1, preamble=8):
+    """ airtime in ms of an uplink carrying payload_len application bytes """
+    try:
+        sf, bw_khz = DATA_RATES[region][dr]
+    except KeyError:
+        raise AirtimeError("Unknown data rate {} for {}".format(dr, region))
+    phy_len = payload_len + LORAWAN_OVERHEAD
+    t_sym = (1 << sf) / bw_khz
+    # Low data rate optimization above 16 ms symbols (SF11/SF12 at 125 kHz)
+    de = 1 if t_sym > 16 else 0
+    n_payload = 8 + max(math.ceil((8 * phy_len - 4 * sf + 28 + 16) / (4 * (sf - 2 * de))) * (cr + 4), 0)
+    return (preamble + 4.25 + n_payload) * t_sym
+
+class AirtimeBudget:
+
+    def __init__(self, budget_ms, window_ms=DAY_MS, buckets=24, region='US915'):
+        self.budget_ms = budget_ms
+        self.window_ms = window_ms
+        self.region = region
+        self._bucket_ms = window_ms // buckets
+
+        # Airtime per bucket, the current one at _bucket
+        self._ledger = [0] * buckets
+        self._bucket = 0
+        self._bucket_start = time.ticks_ms()
+
+        # Token bucket in ms of airtime, starts full
+        self.burst_ms = budget_ms / buckets
+        self.tokens_ms = self.burst_ms
+        self._refilled = self._bucket_start
+
+        self.sends = 0
+        # Uplinks held back because the budget did not allow them
+        self.deferred = 0
+
+        # Last uplink
+        self.predicted_ms = 0
+        self.actual_ms = 0
+
+        # Totals
+        self.predicted_total_ms = 0
+        self.actual_total_ms = 0
+
+    def predict_ms(self, payload_len, dr):
+        return time_on_air_ms(payload_len, dr, self.region)
+
+    def allows(self, airtime_ms):
+        """ True if an uplink of airtime_ms fits the budget now """
+        self._update()
+        # A frame longer than the burst goes out on full tokens and leaves them negative
+        return self.tokens_ms >= min(airtime_ms, self.burst_ms) and sum(self._ledger) + airtime_ms <= self.budget_ms
+
+    def wait_ms(self, airtime_ms):
+        """ time until the tokens cover airtime_ms, 0 if they already do """
+        self._update()
+        missing = min(airtime_ms, self.burst_ms) - self.tokens_ms
+        if missing <= 0:
+            return 0
+        return int(math.ceil(missing * self.window_ms / self.budget_ms))
+
+    def record(self, predicted_ms, actual_ms=None):
+        """ charges one uplink, actual_ms from the radio if it reported it """
+        self._update()
+        used = predicted_ms if not actual_ms else actual_ms
+        self.sends += 1
+        self.predicted_ms = predicted_ms
+        self.actual_ms = actual_ms or 0
+        self.predicted_total_ms += predicted_ms
+        self.actual_total_ms += used
+        # At most one burst of debt: uplinks charged while nothing paced them
+        # must not hold back the sends once pacing starts
+        self.tokens_ms = max(self.tokens_ms - used, -self.burst_ms)
+        self._ledger[self._bucket] += used
+
+    def used_ms(self):
+        """ airtime over the last window """
+        self._update()
+        return sum(self._ledger)
+
+    def restore(self, tokens_ms, elapsed_ms):
+        """ continues from tokens_ms saved elapsed_ms ago, e.g. before a deep sleep """
+        self.tokens_ms = min(tokens_ms + elapsed_ms * self.budget_ms / self.window_ms, self.burst_ms)
+
+    def set_budget(self, budget_ms):
+        """ changes the budget from now on with full tokens, the ledger is kept """
+        self._update()
+        self.budget_ms = budget_ms
+        self.burst_ms = budget_ms / len(self._ledger)
+        self.tokens_ms = self.burst_ms
+
+    def refill(self):
+        """ full tokens and an empty ledger, e.g. when pacing starts: airtime
+        sent while nothing paced it is not held against the budget """
+        self._update()
+        self.tokens_ms = self.burst_ms
+        self._ledger = [0] * len(self._ledger)
+
+    def _update(self):
+        now = time.ticks_ms()
+
+        self.tokens_ms = min(self.tokens_ms + time.ticks_diff(now, self._refilled) * self.budget_ms / self.window_ms,
+                             self.burst_ms)
+        self._refilled = now
+
+        elapsed = time.ticks_diff(now, self._bucket_start)
+        if elapsed >= self.window_ms:
+            self._ledger = [0] * len(self._ledger)
+            self._bucket_start = now
+            return
+        while elapsed >= self._bucket_ms:
+            self._bucket = (self._bucket + 1) % len(self._ledger)
+            self._ledger[self._bucket] = 0
+            self._bucket_start = time.ticks_add(self._bucket_start, self._bucket_ms)
+            elapsed -= self._bucket_ms
+
+    def __str__(self):
+        return "{} sends, {} deferred, airtime {:.0f} ms (predicted {:.0f}), {:.0f}/{} ms in window, {:.0f} ms tokens".format(
+            self.sends, self.deferred, self.actual_ms, self.predicted_ms, self.used_ms(), self.budget_ms, self.tokens_ms)
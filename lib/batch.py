@@ -0,0 +1,208 @@
+# Multi-sample uplinks
+#
+# A SampleBuffer keeps the last samples of one sensor, already quantized with
+# its codec schema, and packs them into frames that fill the data rate limit:
+#
+# Delta frame (BATCH_DELTA), every sample, lossless:
+#   byte 0      : BATCH_DELTA
+#   byte 1      : sensor id
+#   byte 2      : number of samples n
+#   bytes 3..4  : uint16 seconds between samples
+#   bytes 5..6  : uint16 age of the last sample in seconds at packing time
+#   then        : first sample in the schema layout
+#   then        : (n - 1) * fields zigzag varints, each field's change from
+#                 the previous sample
+#
+# Aggregate frame (BATCH_AGGREGATE), one summary of every buffered sample:
+#   bytes 0..6  : as above, BATCH_AGGREGATE
+#   then        : min, mean, max and last, each in the schema layout
+#
+# Fields without a value (the codec's marker) are left out of min/mean/max.
+# The frame types share port 11 with mux frames, byte 0 tells them apart.
+#
+# Pure python + struct only so the host side decoder can import it as well.
+
+import struct
+import time
+from codec import BATCH_DELTA, BATCH_AGGREGATE
+
+BATCH_HEADER = '<BBBHH'
+BATCH_HEADER_SIZE = 7
+
+class BatchError(Exception):
+    pass
+
+def _zigzag(d):
+    return d << 1 if d >= 0 else ((-d) << 1) - 1
+
+def _unzigzag(z):
+    return z >> 1 if not z & 1 else -((z + 1) >> 1)
+
+def _varint_size(z):
+    n = 1
+    while z > 0x7F:
+        z >>= 7
+        n += 1
+    return n
+
+def _put_varint(buf, z):
+    while z > 0x7F:
+        buf.append((z & 0x7F) | 0x80)
+        z >>= 7
+    buf.append(z)
+
+class SampleBuffer:
+
+    def __init__(self, sensor_id, schema, capacity):
+        self.sensor_id = sensor_id
+        self.schema = schema
+        self.capacity = capacity
+        # Samples dropped because the buffer was full
+        self.dropped = 0
+
+        # Ring of quantized field tuples and their ticks_ms stamps, oldest at _start
+        self._samples = [None] * capacity
+        self._stamps = [0] * capacity
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, payload, stamp=None):
+        """ adds one quantized payload (schema.size bytes), dropping the oldest when full """
+        if self._count == self.capacity:
+            self._start = (self._start + 1) % self.capacity
+            self._count -= 1
+            self.dropped += 1
+        i = (self._start + self._count) % self.capacity
+        self._samples[i] = struct.unpack(self.schema.fmt, payload)
+        self._stamps[i] = time.ticks_ms() if stamp is None else stamp
+        self._count += 1
+
+    def drop(self, n):
+        """ forgets the n oldest samples, e.g. once they were sent """
+        n = min(n, self._count)
+        self._start = (self._start + n) % self.capacity
+        self._count -= n
+
+    def pack_delta(self, max_size):
+        """ packs the oldest samples that fit max_size, returns (frame, samples packed)
+        call drop(samples packed) once the frame is sent """
+        if self._count == 0:
+            return (None, 0)
+        if BATCH_HEADER_SIZE + self.schema.size > max_size:
+            raise BatchError("Sensor {} sample does not fit in {} bytes".format(self.sensor_id, max_size))
+
+        first = self._sample(0)
+        body = bytearray(struct.pack(self.schema.fmt, *first))
+        used = BATCH_HEADER_SIZE + len(body)
+        n = 1
+        prev = first
+        while n < self._count and n < 255:
+            sample = self._sample(n)
+            zz = [_zigzag(v - p) for v, p in zip(sample, prev)]
+            size = sum(_varint_size(z) for z in zz)
+            if used + size > max_size:
+                break
+            for z in zz:
+                _put_varint(body, z)
+            used += size
+            prev = sample
+            n += 1
+
+        return (self._header(BATCH_DELTA, n) + bytes(body), n)
+
+    def aggregate_size(self):
+        return BATCH_HEADER_SIZE + 4 * self.schema.size
+
+    def pack_aggregate(self):
+        """ packs min/mean/max/last of every buffered sample, call drop(len(self)) once sent """
+        if self._count == 0:
+            return None
+
+        schema = self.schema
+        n_fields = len(schema.names)
+        low = [None] * n_fields
+        high = [None] * n_fields
+        total = [0] * n_fields
+        valid = [0] * n_fields
+        for k in range(self._count):
+            sample = self._sample(k)
+            for f in range(n_fields):
+                v = sample[f]
+                if v == schema.invalid[f]:
+                    continue
+                if low[f] is None or v < low[f]:
+                    low[f] = v
+                if high[f] is None or v > high[f]:
+                    high[f] = v
+                total[f] += v
+                valid[f] += 1
+
+        mean = [int(round(total[f] / valid[f])) if valid[f] else schema.invalid[f] for f in range(n_fields)]
+        low = [schema.invalid[f] if low[f] is None else low[f] for f in range(n_fields)]
+        high = [schema.invalid[f] if high[f] is None else high[f] for f in range(n_fields)]
+        last = self._sample(self._count - 1)
+
+        return (self._header(BATCH_AGGREGATE, self._count) +
+                struct.pack(schema.fmt, *low) + struct.pack(schema.fmt, *mean) +
+                struct.pack(schema.fmt, *high) + struct.pack(schema.fmt, *last))
+
+    def _sample(self, k):
+        return self._samples[(self._start + k) % self.capacity]
+
+    def _header(self, kind, n):
+        first = self._stamps[self._start]
+        last = self._stamps[(self._start + n - 1) % self.capacity]
+        interval_s = (time.ticks_diff(last, first) // (n - 1) + 500) // 1000 if n > 1 else 0
+        age_s = (time.ticks_diff(time.ticks_ms(), last) + 500) // 1000
+        return struct.pack(BATCH_HEADER, kind, self.sensor_id, min(n, 255),
+                           min(interval_s, 0xFFFF), min(max(age_s, 0), 0xFFFF))
+
+'''
+    decodes a batch frame with the sensor's schema
+    returns (kind, sensor id, header dict, rows)
+    rows: one tuple of quantized values per sample for BATCH_DELTA,
+          (min, mean, max, last) for BATCH_AGGREGATE
+'''
+def unpack_batch(frame, schemas):
+    if len(frame) < BATCH_HEADER_SIZE:
+        raise BatchError("Frame too short")
+    kind, sensor_id, n, interval_s, age_s = struct.unpack_from(BATCH_HEADER, frame)
+    if sensor_id not in schemas:
+        raise BatchError("Unknown sensor id {}".format(sensor_id))
+    schema = schemas[sensor_id]
+    header = {'count': n, 'interval_s': interval_s, 'age_s': age_s}
+    offset = BATCH_HEADER_SIZE
+
+    if kind == BATCH_AGGREGATE:
+        if len(frame) != offset + 4 * schema.size:
+            raise BatchError("Bad aggregate frame size")
+        rows = [struct.unpack_from(schema.fmt, frame, offset + k * schema.size) for k in range(4)]
+        return (kind, sensor_id, header, rows)
+
+    if kind != BATCH_DELTA:
+        raise BatchError("Unknown batch frame type {}".format(kind))
+
+    prev = list(struct.unpack_from(schema.fmt, frame, offset))
+    offset += schema.size
+    rows = [tuple(prev)]
+    for _ in range(n - 1):
+        for f in range(len(prev)):
+            z = 0
+            shift = 0
+            while True:
+                if offset >= len(frame):
+                    raise BatchError("Truncated delta frame")
+                b = frame[offset]
+                offset += 1
+                z |= (b & 0x7F) << shift
+                shift += 7
+                if not b & 0x80:
+                    break
+            prev[f] += _unzigzag(z)
+        rows.append(tuple(prev))
+    if offset != len(frame):
+        raise BatchError("Trailing bytes in frame")
+    return (kind, sensor_id, header, rows)
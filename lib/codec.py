@@ -0,0 +1,137 @@
+# Payload schema registry and quantized codec
+#
+# SCHEMAS is the one definition of the sensor payloads, shared by the firmware
+# (main.py, sps30.py, scd30.py, lib/mux.py, lib/batch.py) and the host
+# decoders (host/decode.py, host/ingest.py). Each Schema declares the sensor
+# id (bit in the mux presence bitmap), its name, its legacy port and the
+# fields in payload order: name, float type (the raw payload the device
+# builds), fixed-point type and scale. Struct formats, payload sizes, port
+# maps and the host's NumPy dtypes are all derived from it; the frame
+# versions (byte 0 of MUX_PORT frames) are declared below.
+#
+# Quantization: each field is stored as a fixed-point integer, raw value *
+# scale, rounded and clamped to the integer type. The scales are chosen
+# against the sensor accuracy, e.g. CO2 in ppm as uint16, temperature in
+# 0.01 degC as int16, PM in 0.1 ug/m3 as uint16, which halves the float32
+# payloads. The largest unsigned / smallest signed value of each type is
+# reserved for "no value" (None or NaN in, None out); larger values clamp
+# below it.
+#
+# Packing: the formats are compiled once per schema and each packs into a
+# preallocated buffer with one struct.pack_into; pack_raw() and encode()
+# return that buffer, which the next call overwrites.
+#
+# Pure python + struct only so the host side decoder can import it as well.
+
+import struct
+
+# Port of multiplexed and batch frames, byte 0 tells them apart
+MUX_PORT = 11
+
+# Frame versions
+MUX_VERSION_FLOAT = 1   # mux frame of float payloads
+MUX_VERSION = 2         # mux frame of quantized payloads
+BATCH_DELTA = 3         # batch frame, quantized samples as deltas (lib/batch.py)
+BATCH_AGGREGATE = 4     # batch frame, min/mean/max/last
+
+# Sensor ids (bit position in the presence bitmap)
+SENSOR_SPS30 = 0
+SENSOR_SCD30 = 1
+SENSOR_PYSENSE = 2
+
+# Integer type -> (lowest, highest) valid value, and the "no value" marker
+_RANGE = {
+    'B': (0, 0xFE), 'H': (0, 0xFFFE), 'I': (0, 0xFFFFFFFE),
+    'b': (-0x7F, 0x7F), 'h': (-0x7FFF, 0x7FFF), 'i': (-0x7FFFFFFF, 0x7FFFFFFF),
+}
+_INVALID = {
+    'B': 0xFF, 'H': 0xFFFF, 'I': 0xFFFFFFFF,
+    'b': -0x80, 'h': -0x8000, 'i': -0x80000000,
+}
+
+class CodecError(Exception):
+    pass
+
+class Schema:
+
+    # fields: (name, raw type, fixed-point type, scale) in payload order
+    def __init__(self, sensor_id, name, port, fields):
+        self.sensor_id = sensor_id
+        self.name = name
+        self.port = port
+        self.names = tuple(f[0] for f in fields)
+        self.scales = tuple(f[3] for f in fields)
+        self.raw_fmt = '<' + ''.join(f[1] for f in fields)
+        self.fmt = '<' + ''.join(f[2] for f in fields)
+        self.size = struct.calcsize(self.fmt)
+        self.raw_size = struct.calcsize(self.raw_fmt)
+        self._ranges = tuple(_RANGE[f[2]] for f in fields)
+        self.invalid = tuple(_INVALID[f[2]] for f in fields)
+
+        # Reused by every pack_raw() / encode()
+        self._raw_buf = bytearray(self.raw_size)
+        self._buf = bytearray(self.size)
+
+    def pack_raw(self, values):
+        """ packs the float payload, returns the schema's buffer (overwritten by the next call) """
+        struct.pack_into(self.raw_fmt, self._raw_buf, 0, *values)
+        return self._raw_buf
+
+    def encode(self, values):
+        """ packs a sequence of values (floats or None) into the compact form,
+        returns the schema's buffer (overwritten by the next call) """
+        self.encode_into(self._buf, 0, values)
+        return self._buf
+
+    def encode_into(self, buf, offset, values):
+        if len(values) != len(self.scales):
+            raise CodecError("Expected {} values, got {}".format(len(self.scales), len(values)))
+        struct.pack_into(self.fmt, buf, offset, *[self._quantize(i, v) for i, v in enumerate(values)])
+
+    def decode(self, payload):
+        """ returns a tuple of floats, None for fields without a value """
+        raw = struct.unpack(self.fmt, payload)
+        return tuple(None if q == self.invalid[i] else q / self.scales[i] for i, q in enumerate(raw))
+
+    def quantize(self, raw_payload):
+        """ converts a float payload in raw_fmt to the compact form, see encode() """
+        return self.encode(struct.unpack(self.raw_fmt, raw_payload))
+
+    def _quantize(self, i, value):
+        if value is None or value != value:
+            return self.invalid[i]
+        lo, hi = self._ranges[i]
+        # Compare before converting so +-inf clamp as well
+        x = value * self.scales[i]
+        if x >= hi:
+            return hi
+        if x <= lo:
+            return lo
+        return int(round(x))
+
+# Sensor id -> schema
+SCHEMAS = {
+    # Mass concentration 0.1 ug/m3, number concentration 0.1 /cm3, typical size 0.001 um
+    SENSOR_SPS30: Schema(SENSOR_SPS30, 'sps30', 8, (
+        ('pm1_0', 'f', 'H', 10), ('pm2_5', 'f', 'H', 10), ('pm4_0', 'f', 'H', 10), ('pm10', 'f', 'H', 10),
+        ('nc0_5', 'f', 'H', 10), ('nc1_0', 'f', 'H', 10), ('nc2_5', 'f', 'H', 10), ('nc4_0', 'f', 'H', 10),
+        ('nc10', 'f', 'H', 10), ('typical_size', 'f', 'H', 1000),
+    )),
+    # CO2 1 ppm, temperature 0.01 degC, humidity 0.01 %RH
+    SENSOR_SCD30: Schema(SENSOR_SCD30, 'scd30', 9, (
+        ('co2', 'f', 'H', 1), ('temperature', 'f', 'h', 100), ('humidity', 'f', 'H', 100),
+    )),
+    # Temperature 0.01 degC, humidity 0.01 %RH, LTR329 channel counts (16 bit)
+    SENSOR_PYSENSE: Schema(SENSOR_PYSENSE, 'pysense', 10, (
+        ('temperature', 'f', 'h', 100), ('humidity', 'f', 'H', 100), ('lux_ch0', 'i', 'H', 1), ('lux_ch1', 'i', 'H', 1),
+    )),
+}
+
+# Legacy port -> sensor id
+LEGACY_PORTS = dict((schema.port, sensor_id) for sensor_id, schema in SCHEMAS.items())
+
+'''
+    converts a dict of {sensor id: float payload} to compact payloads
+'''
+def quantize_payloads(payloads):
+    return dict((sensor_id, SCHEMAS[sensor_id].quantize(payload)) for sensor_id, payload in payloads.items())
@@ -1,16 +1,53 @@
 # Author: Tung To
 # Init: 0xFF
 # Poly: 0x31
-import ubinascii
+#
+# Sensirion CRC-8, table driven.
+#
+# - crc8(data, start, end, init) returns the crc of data[start:end] as an int
+# - check_words(buf, n) checks n word/crc groups of a Sensirion read buffer
+# - calc_crc8(data) is kept for old callers and returns the crc as 1 byte
 
-def calc_crc8(data):
-    crc = 0xFF
-    for i in range(0, 2):
-        crc ^= data[i]
+CRC8_INIT = 0xFF
+CRC8_POLY = 0x31
+
+def _make_table():
+    table = bytearray(256)
+    for i in range(0, 256):
+        crc = i
         for j in range(8, 0, -1):
             if(crc & 0x80):
-                crc = (crc << 1) ^ 0x31
+                crc = ((crc << 1) ^ CRC8_POLY) & 0xFF
             else:
-                crc = (crc << 1)
+                crc = (crc << 1) & 0xFF
+        table[i] = crc
+    return bytes(table)
+
+_TABLE = _make_table()
 
-    return ubinascii.unhexlify(hex(crc)[-2:])
+# init defaults to the Sensirion 0xFF, the Si7006 uses the same poly with init 0x00
+def crc8(data, start=0, end=None, init=CRC8_INIT):
+    if end is None:
+        end = len(data)
+    table = _TABLE
+    crc = init
+    for i in range(start, end):
+        crc = table[crc ^ data[i]]
+    return crc
+
+'''
+    checks every 3 byte group (msb, lsb, crc) of a Sensirion read buffer
+    returns a bitmask of the words that failed, bit i set => word i bad, 0 => all good
+'''
+def check_words(buf, n_words, offset=0):
+    table = _TABLE
+    failed = 0
+    for i in range(0, n_words):
+        j = offset + i * 3
+        if table[table[CRC8_INIT ^ buf[j]] ^ buf[j + 1]] != buf[j + 2]:
+            failed |= 1 << i
+    return failed
+
+# Compatibility wrapper, returns the crc of the first 2 bytes of data as bytes
+def calc_crc8(data):
+    return bytes([crc8(data, 0, 2)])
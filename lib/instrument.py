@@ -0,0 +1,298 @@
+# Runtime instrumentation: counters, timers and histograms
+#
+# Off by default. enable() must run before the drivers are built: they ask
+# for their timers and I2C wrappers at construction, and while disabled they
+# get the shared null objects (NULL_TIMER, NULL_COUNTER, the I2C object
+# itself), so a disabled build costs one no-op call per timed stage and
+# nothing on the I2C paths.
+#
+#   t = instrument.timer('send_pkt')    # once, e.g. in __init__
+#   t0 = t.start()
+#   ...
+#   t.stop(t0)
+#
+#   i2c = instrument.wrap_i2c(I2C(...), 'pysense')   # every call timed
+#
+# Timers measure with time.ticks_us into a Histogram: fixed bucket bounds
+# (BOUNDS_US) and counts in one preallocated array, plus count, total and
+# max, so recording never allocates. total stays a small int (at most
+# TOTAL_MAX): when it would pass it, it is halved along with the number of
+# values it sums, so mean() then weighs recent values more. start() returns
+# the start tick instead of keeping it, a timer can be shared by threads.
+#
+# Output: dump() prints one line per timer and counter; pack(max_size)
+# builds diagnostic uplinks for DIAG_PORT:
+#   [0]  DIAG_VERSION
+#   [1]  number of timer entries n
+#   n *  '<BHIIBB'  timer id, count, mean us, max us, p50 and p90 bucket
+#   ...  '<BI'      counter id, value, to the end of the frame
+# Ids are the index in TIMERS / COUNTERS (append only), metrics without an
+# id are only dumped. unpack() decodes a frame on the host.
+#
+# Pure python (struct, array) so the host side decoder can import it as well.
+
+import time
+import struct
+from array import array
+
+DIAG_PORT = 13
+DIAG_VERSION = 1
+
+# Uplink ids, append only
+TIMERS = (
+    'cycle', 'sample', 'transmit', 'send_pkt', 'pic_wait',
+    'i2c.pysense', 'i2c.sps30', 'i2c.scd30',
+)
+COUNTERS = (
+    'pic_wait.polls', 'i2c.errors', 'tx.failed', 'cycle.overruns',
+)
+
+# Histogram bucket upper bounds in us, the last bucket counts anything longer
+BOUNDS_US = (50, 100, 200, 500, 1000, 2000, 5000, 10000, 20000, 50000,
+             100000, 200000, 500000, 1000000, 2000000, 5000000)
+
+_TIMER_FMT = '<BHIIBB'
+_TIMER_SIZE = struct.calcsize(_TIMER_FMT)
+_COUNTER_FMT = '<BI'
+_COUNTER_SIZE = struct.calcsize(_COUNTER_FMT)
+
+# Largest MicroPython small int on 32 bit ports, anything above is a bignum
+TOTAL_MAX = 0x3FFFFFFF
+
+enabled = False
+_timers = {}
+_counters = {}
+
+class Histogram:
+
+    def __init__(self, bounds=BOUNDS_US):
+        self.bounds = bounds
+        self.counts = array('I', [0] * (len(bounds) + 1))
+        self.count = 0
+        self.total = 0
+        # Values summed in total
+        self.total_count = 0
+        self.max = 0
+
+    def record(self, value):
+        i = 0
+        n = len(self.bounds)
+        while i < n and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        # ticks_diff values are below 2 ** 29, one halving makes room
+        while self.total > TOTAL_MAX - value and self.total:
+            self.total >>= 1
+            self.total_count >>= 1
+        self.total += value
+        self.total_count += 1
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total // self.total_count if self.total_count else 0
+
+    def bucket(self, fraction):
+        """ index of the bucket holding the given fraction of the values """
+        target = fraction * self.count
+        seen = 0
+        for i in range(len(self.counts)):
+            seen += self.counts[i]
+            if seen >= target and seen:
+                return i
+        return 0
+
+    def percentile(self, fraction):
+        """ upper bound of bucket(fraction), at most max """
+        i = self.bucket(fraction)
+        return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+
+    def reset(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+        self.count = 0
+        self.total = 0
+        self.total_count = 0
+        self.max = 0
+
+class Timer:
+
+    def __init__(self, name):
+        self.name = name
+        self.hist = Histogram()
+
+    def start(self):
+        return time.ticks_us()
+
+    def stop(self, t0):
+        """ records the time since start(), returns it in us """
+        us = time.ticks_diff(time.ticks_us(), t0)
+        self.hist.record(us)
+        return us
+
+    def __str__(self):
+        h = self.hist
+        return "{} n={} avg={} p50<={} p90<={} max={} us".format(
+            self.name, h.count, h.mean(), h.percentile(0.5), h.percentile(0.9), h.max)
+
+class Counter:
+
+    def __init__(self, name):
+        self.name = name
+        self.value = 0
+
+    def add(self, n=1):
+        self.value += n
+
+    def __str__(self):
+        return "{} {}".format(self.name, self.value)
+
+class _NullTimer:
+
+    def start(self):
+        return 0
+
+    def stop(self, t0):
+        return 0
+
+class _NullCounter:
+
+    def add(self, n=1):
+        pass
+
+NULL_TIMER = _NullTimer()
+NULL_COUNTER = _NullCounter()
+
+class InstrumentedI2C:
+    """ times every transfer of an I2C object, anything else is passed through """
+
+    def __init__(self, i2c, name):
+        self._i2c = i2c
+        self._timer = timer('i2c.' + name)
+        self._errors = counter('i2c.errors')
+
+    def _call(self, fn, *args):
+        t0 = time.ticks_us()
+        try:
+            return fn(*args)
+        except Exception:
+            self._errors.add()
+            raise
+        finally:
+            self._timer.stop(t0)
+
+    def readfrom(self, *args):
+        return self._call(self._i2c.readfrom, *args)
+
+    def readfrom_into(self, *args):
+        return self._call(self._i2c.readfrom_into, *args)
+
+    def writeto(self, *args):
+        return self._call(self._i2c.writeto, *args)
+
+    def readfrom_mem(self, *args):
+        return self._call(self._i2c.readfrom_mem, *args)
+
+    def readfrom_mem_into(self, *args):
+        return self._call(self._i2c.readfrom_mem_into, *args)
+
+    def writeto_mem(self, *args):
+        return self._call(self._i2c.writeto_mem, *args)
+
+    def __getattr__(self, name):
+        return getattr(self._i2c, name)
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+def timer(name):
+    """ the timer of name, NULL_TIMER while disabled """
+    if not enabled:
+        return NULL_TIMER
+    if name not in _timers:
+        _timers[name] = Timer(name)
+    return _timers[name]
+
+def counter(name):
+    """ the counter of name, NULL_COUNTER while disabled """
+    if not enabled:
+        return NULL_COUNTER
+    if name not in _counters:
+        _counters[name] = Counter(name)
+    return _counters[name]
+
+def wrap_i2c(i2c, name):
+    """ i2c with every transfer timed as 'i2c.<name>', i2c itself while disabled """
+    if not enabled or i2c is None:
+        return i2c
+    return InstrumentedI2C(i2c, name)
+
+def reset():
+    for t in _timers.values():
+        t.hist.reset()
+    for c in _counters.values():
+        c.value = 0
+
+def dump():
+    """ prints every timer and counter """
+    for name in sorted(_timers):
+        print(_timers[name])
+    if _counters:
+        print(", ".join(str(_counters[name]) for name in sorted(_counters)))
+
+'''
+    diagnostic uplink frames of the timers and counters with an id, each no
+    longer than max_size
+'''
+def pack(max_size):
+    timers = [(TIMERS.index(name), t.hist) for name, t in _timers.items() if name in TIMERS and t.hist.count]
+    counters = [(COUNTERS.index(name), c.value) for name, c in _counters.items() if name in COUNTERS]
+    timers.sort(key=lambda e: e[0])
+    counters.sort(key=lambda e: e[0])
+
+    frames = []
+    while timers or counters:
+        n = min(len(timers), max(max_size - 2, 0) // _TIMER_SIZE, 255)
+        room = max_size - 2 - n * _TIMER_SIZE
+        m = min(len(counters), room // _COUNTER_SIZE)
+        if n == 0 and m == 0:
+            break
+        frame = bytearray(2 + n * _TIMER_SIZE + m * _COUNTER_SIZE)
+        frame[0] = DIAG_VERSION
+        frame[1] = n
+        offset = 2
+        for i, h in timers[:n]:
+            struct.pack_into(_TIMER_FMT, frame, offset, i, min(h.count, 0xFFFF), min(h.mean(), 0xFFFFFFFF),
+                             min(h.max, 0xFFFFFFFF), h.bucket(0.5), h.bucket(0.9))
+            offset += _TIMER_SIZE
+        for i, value in counters[:m]:
+            struct.pack_into(_COUNTER_FMT, frame, offset, i, min(value, 0xFFFFFFFF))
+            offset += _COUNTER_SIZE
+        frames.append(bytes(frame))
+        timers = timers[n:]
+        counters = counters[m:]
+    return frames
+
+'''
+    decodes a diagnostic uplink
+    returns {'timers': {name: {count, mean_us, max_us, p50_us, p90_us}}, 'counters': {name: value}}
+    pXX_us are the bucket upper bounds, at most max_us
+'''
+def unpack(frame):
+    if frame[0] != DIAG_VERSION:
+        raise ValueError("Unknown diagnostic version {}".format(frame[0]))
+    timers = {}
+    offset = 2
+    for _ in range(frame[1]):
+        i, count, mean, top, p50, p90 = struct.unpack_from(_TIMER_FMT, frame, offset)
+        offset += _TIMER_SIZE
+        bound = lambda b: min(BOUNDS_US[b], top) if b < len(BOUNDS_US) else top
+        timers[TIMERS[i]] = {'count': count, 'mean_us': mean, 'max_us': top, 'p50_us': bound(p50), 'p90_us': bound(p90)}
+    counters = {}
+    while offset + _COUNTER_SIZE <= len(frame):
+        i, value = struct.unpack_from(_COUNTER_FMT, frame, offset)
+        offset += _COUNTER_SIZE
+        counters[COUNTERS[i]] = value
+    return {'timers': timers, 'counters': counters}
@@ -0,0 +1,119 @@
+# Multiplexed uplink frame
+#
+# Packs the payloads of every enabled sensor into a single LoRa frame so that
+# one uplink (one port, one LoRaWAN header) carries a whole sensing cycle.
+#
+# Frame layout:
+#   byte 0      : frame version (MUX_VERSION)
+#   byte 1      : presence bitmap, bit n set => payload of sensor n follows
+#   bytes 2..   : payloads in ascending bit order, each of its fixed size
+#
+# Payload sizes are fixed per frame version and sensor id (see SENSOR_SIZES)
+# so no length bytes are needed. Version 1 frames carry float32 payloads,
+# version 2 the quantized payloads of lib/codec.py. If the payloads do not fit the data rate limit they are split
+# over several frames, each with its own header.
+#
+# Sensor ids, frame versions and payload sizes come from the schema registry
+# in lib/codec.py.
+#
+# Pure python + struct only so the host side decoder can import it as well.
+
+from codec import SCHEMAS, MUX_VERSION, MUX_VERSION_FLOAT
+
+MUX_HEADER_SIZE = 2
+
+# Frame version -> payload size in bytes for each sensor id
+SENSOR_SIZES = {
+    MUX_VERSION_FLOAT: dict((sensor_id, schema.raw_size) for sensor_id, schema in SCHEMAS.items()),
+    MUX_VERSION: dict((sensor_id, schema.size) for sensor_id, schema in SCHEMAS.items()),
+}
+
+# US915 maximum application payload (bytes) per uplink data rate
+US915_MAX_PAYLOAD = {0: 11, 1: 53, 2: 125, 3: 242, 4: 242}
+
+class MuxError(Exception):
+    pass
+
+def max_payload(dr):
+    return US915_MAX_PAYLOAD.get(dr, US915_MAX_PAYLOAD[0])
+
+'''
+    packs a dict of {sensor id: payload} into as few frames as possible
+    returns a list of frames, each no longer than max_size
+'''
+def pack_frames(payloads, max_size, version=MUX_VERSION):
+    sizes = SENSOR_SIZES[version]
+    frames = []
+    bitmap = 0
+    body = []
+    used = MUX_HEADER_SIZE
+
+    for sensor_id in sorted(payloads):
+        payload = payloads[sensor_id]
+        if len(payload) != sizes[sensor_id]:
+            raise MuxError("Bad payload size for sensor {}".format(sensor_id))
+        if MUX_HEADER_SIZE + len(payload) > max_size:
+            raise MuxError("Sensor {} payload does not fit in {} bytes".format(sensor_id, max_size))
+
+        # Flush current frame when full
+        if used + len(payload) > max_size:
+            frames.append(_build(version, bitmap, body))
+            bitmap = 0
+            body = []
+            used = MUX_HEADER_SIZE
+
+        bitmap |= 1 << sensor_id
+        body.append(payload)
+        used += len(payload)
+
+    if bitmap:
+        frames.append(_build(version, bitmap, body))
+
+    return frames
+
+def _build(version, bitmap, body):
+    return bytes([version, bitmap]) + b''.join(body)
+
+'''
+    splits a frame back into a dict of {sensor id: payload bytes}
+    the frame version is frame[0]
+'''
+def unpack_frame(frame):
+    if len(frame) < MUX_HEADER_SIZE:
+        raise MuxError("Frame too short")
+    if frame[0] not in SENSOR_SIZES:
+        raise MuxError("Unknown frame version {}".format(frame[0]))
+    sizes = SENSOR_SIZES[frame[0]]
+
+    bitmap = frame[1]
+    offset = MUX_HEADER_SIZE
+    payloads = {}
+
+    for sensor_id in range(0, 8):
+        if not bitmap & (1 << sensor_id):
+            continue
+        if sensor_id not in sizes:
+            raise MuxError("Unknown sensor id {}".format(sensor_id))
+        size = sizes[sensor_id]
+        if offset + size > len(frame):
+            raise MuxError("Truncated payload for sensor {}".format(sensor_id))
+        payloads[sensor_id] = frame[offset:offset + size]
+        offset += size
+
+    if offset != len(frame):
+        raise MuxError("Trailing bytes in frame")
+
+    return payloads
+
+'''
+    merges two frames of the same version carrying different sensors
+    returns the merged frame, or None if they overlap or it would exceed max_size
+'''
+def merge_frames(a, b, max_size):
+    if a[0] != b[0] or a[0] not in SENSOR_SIZES or a[1] & b[1]:
+        return None
+    if len(a) + len(b) - MUX_HEADER_SIZE > max_size:
+        return None
+    payloads = unpack_frame(a)
+    payloads.update(unpack_frame(b))
+    return _build(a[0], a[1] | b[1], [payloads[sensor_id] for sensor_id in sorted(payloads)])
@@ -12,6 +12,7 @@ from machine import Pin
 from machine import I2C
 import time
 import pycom
+import instrument
 
 __version__ = '0.0.2'
 
@@ -86,6 +87,10 @@ class Pycoproc:
             self.i2c = i2c
         else:
             self.i2c = I2C(0, mode=I2C.MASTER, pins=(sda, scl))
+        # Every Pysense driver shares this bus object
+        self.i2c = instrument.wrap_i2c(self.i2c, 'pysense')
+        self._wait_timer = instrument.timer('pic_wait')
+        self._wait_polls = instrument.counter('pic_wait.polls')
 
         self.sda = sda
         self.scl = scl
@@ -127,6 +132,7 @@ class Pycoproc:
         return self.i2c.readfrom(I2C_SLAVE_ADDR, size + 1)[1:(size + 1)]
 
     def _wait(self):
+        t0 = self._wait_timer.start()
         count = 0
         time.sleep_us(10)
         while self.i2c.readfrom(I2C_SLAVE_ADDR, 1)[0] != 0xFF:
@@ -134,6 +140,8 @@ class Pycoproc:
             count += 1
             if (count > 500):  # timeout after 50ms
                 raise Exception('Board timeout')
+        self._wait_polls.add(count + 1)
+        self._wait_timer.stop(t0)
 
     def _send_cmd(self, cmd):
         self._write(bytes([cmd]))
@@ -0,0 +1,85 @@
+# Sensor registry
+#
+# Creates and configures each driver once and hands the same instance out on
+# every cycle. Drivers are built from factories, factory(registry) -> driver,
+# and a factory may get() other entries (e.g. the Pysense board) which makes
+# them dependencies: invalidating an entry also drops everything built on it.
+#
+# After a bus error call invalidate(), the drivers are rebuilt lazily on their
+# next get(). Time spent building drivers is kept apart from cycle time.
+
+import time
+
+class SensorRegistry:
+
+    def __init__(self):
+        self._factories = {}
+        self._order = []
+        self._instances = {}
+        self._dependents = {}
+        self._building = []
+
+        # Stats, in ms
+        self.setup_ms = 0
+        self.last_setup_ms = 0
+        self.setups = 0
+        self.cycle_ms = 0
+        self.cycle_setup_ms = 0
+        self._cycle_start = None
+
+    def register(self, name, factory):
+        self._factories[name] = factory
+        self._order.append(name)
+        self._dependents[name] = []
+
+    # Builds every registered driver now, returns the time it took in ms
+    def setup(self):
+        start = time.ticks_ms()
+        for name in self._order:
+            self.get(name)
+        return time.ticks_diff(time.ticks_ms(), start)
+
+    def get(self, name):
+        if self._building:
+            # Called from another factory: record the dependency
+            parent = self._building[-1]
+            if parent not in self._dependents[name]:
+                self._dependents[name].append(parent)
+
+        instance = self._instances.get(name)
+        if instance is None:
+            start = time.ticks_ms()
+            self._building.append(name)
+            try:
+                instance = self._factories[name](self)
+            finally:
+                self._building.pop()
+            elapsed = time.ticks_diff(time.ticks_ms(), start)
+
+            self._instances[name] = instance
+            self.setups += 1
+            # Nested builds are already part of the outer build time
+            if not self._building:
+                self.setup_ms += elapsed
+                self.last_setup_ms = elapsed
+                self.cycle_setup_ms += elapsed
+
+        return instance
+
+    # Drops name and its dependents (or everything when name is None)
+    def invalidate(self, name=None):
+        if name is None:
+            self._instances.clear()
+            return
+        if self._instances.pop(name, None) is not None:
+            for dependent in self._dependents[name]:
+                self.invalidate(dependent)
+
+    def begin_cycle(self):
+        self._cycle_start = time.ticks_ms()
+        self.cycle_setup_ms = 0
+
+    # Returns the cycle time in ms, cycle_setup_ms is the part spent rebuilding drivers
+    def end_cycle(self):
+        self.cycle_ms = time.ticks_diff(time.ticks_ms(), self._cycle_start)
+        return self.cycle_ms
@@ -0,0 +1,159 @@
+# Remote configuration over downlinks
+#
+# A downlink on CONFIG_PORT is a sequence of commands, each an opcode byte
+# followed by its arguments:
+#
+#   0x01 SET       key (uint8), value in the key's format (SETTINGS)
+#   0x02 DEFAULTS  every setting back to the value built into main.py
+#   0x03 REPORT    send the current settings on CONFIG_PORT
+#   0x04 REBOOT    reset once the frame is applied, for settings only read
+#                  at boot (which sensors are enabled)
+#
+#   e.g. 01 01 3c00 01 02 02  -> CYCLE_S = 60, LORA_DR = 2
+#
+# A frame is parsed completely before anything is applied, so a bad command
+# (unknown opcode or key, value out of range, truncated frame) rejects the
+# whole frame. Reports use the same encoding: a sequence of SET commands.
+#
+# Settings are main.py globals. The wire value is the global divided by its
+# scale, e.g. periods in seconds on the air and in ms on the device. Applied
+# settings are persisted in NVS, one integer per key (cfg<key>), and loaded
+# again at boot.
+#
+# Pure python + struct only so the host side tools can import it as well.
+
+import struct
+
+CONFIG_PORT = 12
+
+CMD_SET = 0x01
+CMD_DEFAULTS = 0x02
+CMD_REPORT = 0x03
+CMD_REBOOT = 0x04
+
+# key -> (main.py global, wire format, scale, lowest, highest) of the wire value
+SETTINGS = {
+    1: ('CYCLE_S', '<H', 1, 1, 3600),
+    2: ('LORA_DR', '<B', 1, 0, 4),
+    3: ('PM_PERIOD_MS', '<H', 1000, 1, 3600),
+    4: ('CO2_PERIOD_MS', '<H', 1000, 2, 3600),
+    5: ('using_pm', '<B', 1, 0, 1),
+    6: ('using_co2', '<B', 1, 0, 1),
+    7: ('using_pysense_sensor', '<B', 1, 0, 1),
+    8: ('using_mux', '<B', 1, 0, 1),
+    9: ('using_quantized', '<B', 1, 0, 1),
+    10: ('using_batch', '<B', 1, 0, 1),
+    11: ('BATCH_CYCLES', '<B', 1, 1, 255),
+    12: ('BATCH_MODE', '<B', 1, 3, 4),
+    13: ('using_adaptive', '<B', 1, 0, 1),
+    14: ('using_airtime_budget', '<B', 1, 0, 1),
+    15: ('AIRTIME_BUDGET_MS', '<H', 1000, 1, 0xFFFF),
+}
+
+# Global name -> key
+KEYS = dict((setting[0], key) for key, setting in SETTINGS.items())
+
+# Read at boot only, applied after a REBOOT
+BOOT_SETTINGS = ('using_pm', 'using_co2', 'using_pysense_sensor')
+
+class RemoteError(Exception):
+    pass
+
+def _is_flag(name):
+    return name.startswith('using_')
+
+'''
+    parses a downlink into a list of (opcode, name, value) commands
+    name and value are None for commands without arguments
+'''
+def parse(frame):
+    commands = []
+    offset = 0
+    while offset < len(frame):
+        op = frame[offset]
+        offset += 1
+        if op != CMD_SET:
+            if op not in (CMD_DEFAULTS, CMD_REPORT, CMD_REBOOT):
+                raise RemoteError("Unknown command 0x{:02x}".format(op))
+            commands.append((op, None, None))
+            continue
+
+        if offset >= len(frame):
+            raise RemoteError("Truncated SET")
+        key = frame[offset]
+        offset += 1
+        if key not in SETTINGS:
+            raise RemoteError("Unknown setting {}".format(key))
+        name, fmt, scale, lo, hi = SETTINGS[key]
+        size = struct.calcsize(fmt)
+        if offset + size > len(frame):
+            raise RemoteError("Truncated value for {}".format(name))
+        wire = struct.unpack_from(fmt, frame, offset)[0]
+        offset += size
+        if not lo <= wire <= hi:
+            raise RemoteError("{} = {} out of range {}..{}".format(name, wire, lo, hi))
+        commands.append((CMD_SET, name, bool(wire) if _is_flag(name) else wire * scale))
+    return commands
+
+def encode_set(name, value):
+    """ SET command for a setting, value in device units """
+    key = KEYS[name]
+    _, fmt, scale, lo, hi = SETTINGS[key]
+    if int(value) % scale:
+        raise RemoteError("{} must be a multiple of {}".format(name, scale))
+    wire = int(value) // scale
+    if not lo <= wire <= hi:
+        raise RemoteError("{} = {} out of range {}..{}".format(name, wire, lo, hi))
+    return bytes([CMD_SET, key]) + struct.pack(fmt, wire)
+
+'''
+    report frames of settings {name: value}, each no longer than max_size
+'''
+def pack_report(values, max_size):
+    frames = []
+    frame = b''
+    for key in sorted(SETTINGS):
+        name = SETTINGS[key][0]
+        if name not in values:
+            continue
+        cmd = encode_set(name, values[name])
+        if len(frame) + len(cmd) > max_size:
+            frames.append(frame)
+            frame = b''
+        frame += cmd
+    if frame:
+        frames.append(frame)
+    return frames
+
+class Config:
+
+    # defaults: {global name: value} as built in, nvs_get / nvs_set / nvs_erase: pycom's
+    def __init__(self, defaults, nvs_get, nvs_set, nvs_erase):
+        self.defaults = dict(defaults)
+        self._get = nvs_get
+        self._set = nvs_set
+        self._erase = nvs_erase
+        self.applied = 0
+        self.rejected = 0
+
+    def load(self):
+        """ settings saved in NVS, {name: value} """
+        values = {}
+        for key, (name, _, _, _, _) in SETTINGS.items():
+            value = self._get('cfg{}'.format(key), None)
+            if value is not None and name in self.defaults:
+                values[name] = bool(value) if _is_flag(name) else value
+        return values
+
+    def save(self, name, value):
+        self._set('cfg{}'.format(KEYS[name]), int(value))
+
+    def reset(self):
+        """ forgets the saved settings, returns the defaults """
+        for key in SETTINGS:
+            try:
+                self._erase('cfg{}'.format(key))
+            except Exception:
+                # Not saved
+                pass
+        return dict(self.defaults)
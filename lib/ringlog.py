@@ -0,0 +1,244 @@
+# Store-and-forward log for unsent uplinks
+#
+# Fixed-record circular log on flash. Every record lives in a fixed size slot
+# and record seq always goes to slot (seq - 1) % slots, so:
+# - the file is preallocated once and never grows
+# - records are appended in RAM and written in batches of contiguous slots,
+#   which keeps the number of flash writes (and wear) down
+# - on boot the newest record is found with a binary search over the slot
+#   sequence numbers (O(log slots) reads) instead of a scan of every record
+#
+# File layout:
+#   [0:16]  meta A  \  '<IIIB' magic, generation, tail seq, crc8
+#   [16:32] meta B  /  written alternately, the valid one with the highest
+#                      generation wins
+#   [32:]   slots      '<IBBB' seq, port, length, crc8 + payload_size bytes
+#
+# Appended records and the tail (oldest unsent record) stay in RAM until
+# flush(), which append() runs every batch records. A reset or power down
+# before the flush loses up to batch - 1 appended records, and records acked
+# since the last flush are sent again; call flush() before a planned power
+# down such as a deep sleep. Flushed records survive a reset, except one torn
+# by a write cut short, which peek() skips.
+#
+# FileBackend works on any ordinary file, /flash on the board or a temporary
+# file on a host.
+
+import struct
+from crc8 import crc8
+
+RINGLOG_MAGIC = 0x52474C31  # 'RGL1'
+
+_META_FMT = '<IIIB'
+_META_SIZE = 16
+_SLOTS_OFFSET = 2 * _META_SIZE
+_SLOT_HEADER_FMT = '<IBBB'
+_SLOT_HEADER_SIZE = 7
+
+class FileBackend:
+
+    def __init__(self, path, size):
+        self.size = size
+        try:
+            self._f = open(path, 'r+b')
+        except OSError:
+            self._f = open(path, 'w+b')
+
+        # Preallocate the whole file with zeros
+        self._f.seek(0, 2)
+        end = self._f.tell()
+        if end < size:
+            zeros = bytes(512)
+            while end < size:
+                n = min(512, size - end)
+                self._f.write(zeros if n == 512 else bytes(n))
+                end += n
+            self._f.flush()
+
+    def read_into(self, offset, buf):
+        self._f.seek(offset)
+        return self._f.readinto(buf)
+
+    def write(self, offset, data):
+        self._f.seek(offset)
+        self._f.write(data)
+
+    def sync(self):
+        self._f.flush()
+
+    def close(self):
+        self._f.close()
+
+class RingLog:
+
+    def __init__(self, backend, slots, payload_size, batch=8):
+        self.slots = slots
+        self.payload_size = payload_size
+        self.slot_size = _SLOT_HEADER_SIZE + payload_size
+        self.batch = batch
+
+        self._backend = backend
+        self._slot_buf = bytearray(self.slot_size)
+        self._meta_buf = bytearray(_META_SIZE)
+
+        # Pending records not yet on flash, seqs [flushed_seq, head_seq)
+        self._pending = bytearray(batch * self.slot_size)
+        self._n_pending = 0
+
+        # Stats
+        self.appended = 0
+        self.dropped = 0
+        self.flushes = 0
+
+        self._meta_gen = 0
+        self._meta_dirty = False
+        tail = self._load_meta()
+        self.head_seq = self._find_head()
+        self.flushed_seq = self.head_seq
+        self.tail_seq = max(tail, self.head_seq - slots, 1)
+
+    @staticmethod
+    def file_size(slots, payload_size):
+        return _SLOTS_OFFSET + slots * (_SLOT_HEADER_SIZE + payload_size)
+
+    def __len__(self):
+        return self.head_seq - self.tail_seq
+
+    '''
+        buffers a record, flushes to flash when a whole batch is pending
+        returns the record seq
+    '''
+    def append(self, port, payload):
+        n = len(payload)
+        if n > self.payload_size:
+            raise ValueError("Record of {} bytes exceeds slot size {}".format(n, self.payload_size))
+
+        seq = self.head_seq
+        off = self._n_pending * self.slot_size
+        buf = self._pending
+        struct.pack_into(_SLOT_HEADER_FMT, buf, off, seq, port, n, 0)
+        buf[off + _SLOT_HEADER_SIZE:off + _SLOT_HEADER_SIZE + n] = payload
+        buf[off + 6] = self._slot_crc(buf, off, n)
+
+        self._n_pending += 1
+        self.head_seq += 1
+        self.appended += 1
+
+        # Oldest unsent record overwritten
+        if self.head_seq - self.tail_seq > self.slots:
+            self.tail_seq = self.head_seq - self.slots
+            self._meta_dirty = True
+            self.dropped += 1
+
+        if self._n_pending == self.batch:
+            self.flush()
+
+        return seq
+
+    # Returns the oldest unsent record as (seq, port, payload), None when empty
+    def peek(self):
+        while self.tail_seq < self.head_seq:
+            seq = self.tail_seq
+            if seq >= self.flushed_seq:
+                buf = self._pending
+                off = (seq - self.flushed_seq) * self.slot_size
+            else:
+                buf = self._slot_buf
+                off = 0
+                self._backend.read_into(self._slot_offset(seq), buf)
+
+            _seq, port, n, crc = struct.unpack_from(_SLOT_HEADER_FMT, buf, off)
+            if _seq == seq and n <= self.payload_size and crc == self._slot_crc(buf, off, n):
+                return (seq, port, bytes(buf[off + _SLOT_HEADER_SIZE:off + _SLOT_HEADER_SIZE + n]))
+
+            # Torn or overwritten slot, skip it
+            self.ack(seq)
+
+        return None
+
+    # Marks every record up to seq as sent
+    def ack(self, seq):
+        if seq >= self.tail_seq:
+            self.tail_seq = seq + 1
+            self._meta_dirty = True
+
+    # Writes pending records and the tail pointer to flash
+    def flush(self):
+        if self._n_pending:
+            seq = self.flushed_seq
+            first = (seq - 1) % self.slots
+            n = self._n_pending
+            mv = memoryview(self._pending)
+
+            # Contiguous write, split in two when wrapping around
+            n_first = min(n, self.slots - first)
+            self._backend.write(self._slot_offset(seq), mv[0:n_first * self.slot_size])
+            if n_first < n:
+                self._backend.write(_SLOTS_OFFSET, mv[n_first * self.slot_size:n * self.slot_size])
+
+            self.flushed_seq += n
+            self._n_pending = 0
+
+        if self._meta_dirty:
+            self._save_meta()
+
+        self._backend.sync()
+        self.flushes += 1
+
+    def _slot_offset(self, seq):
+        return _SLOTS_OFFSET + ((seq - 1) % self.slots) * self.slot_size
+
+    def _slot_crc(self, buf, off, n):
+        crc = crc8(buf, off, off + 6)
+        return crc8(buf, off + _SLOT_HEADER_SIZE, off + _SLOT_HEADER_SIZE + n, crc)
+
+    # Seq of the record in slot i, 0 when empty or invalid
+    def _slot_seq(self, i):
+        buf = self._slot_buf
+        self._backend.read_into(_SLOTS_OFFSET + i * self.slot_size, buf)
+        seq, port, n, crc = struct.unpack_from(_SLOT_HEADER_FMT, buf, 0)
+        if seq == 0 or n > self.payload_size or crc != self._slot_crc(buf, 0, n):
+            return 0
+        return seq
+
+    '''
+        slots 0..k hold the newest lap, slots after k an older lap (smaller
+        seqs) or nothing, so the newest record is the last slot whose seq is
+        not smaller than the seq in slot 0
+    '''
+    def _find_head(self):
+        first = self._slot_seq(0)
+        if first == 0:
+            # Empty, or slot 0 torn right after a wrap
+            last = self._slot_seq(self.slots - 1)
+            return last + 1 if last else 1
+
+        lo = 0
+        hi = self.slots - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self._slot_seq(mid) >= first:
+                lo = mid
+            else:
+                hi = mid - 1
+
+        return first + lo + 1
+
+    def _load_meta(self):
+        tail = 1
+        for i in range(0, 2):
+            buf = self._meta_buf
+            self._backend.read_into(i * _META_SIZE, buf)
+            magic, gen, seq, crc = struct.unpack_from(_META_FMT, buf, 0)
+            if magic == RINGLOG_MAGIC and crc == crc8(buf, 0, 12) and gen >= self._meta_gen:
+                self._meta_gen = gen
+                tail = seq
+        return tail
+
+    def _save_meta(self):
+        self._meta_gen += 1
+        buf = self._meta_buf
+        struct.pack_into(_META_FMT, buf, 0, RINGLOG_MAGIC, self._meta_gen, self.tail_seq, 0)
+        buf[12] = crc8(buf, 0, 12)
+        self._backend.write((self._meta_gen & 1) * _META_SIZE, buf)
+        self._meta_dirty = False
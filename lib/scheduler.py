@@ -0,0 +1,148 @@
+# Cooperative scheduler for periodic tasks
+#
+# Runs on uasyncio (MicroPython) or asyncio (CPython). Each task is an async
+# function called every period_ms: the next run is due one period after the
+# previous one was due, not after it finished, so a slow run does not shift
+# the schedule. A run that starts after the following deadline has passed
+# skips the missed periods.
+#
+# A task may return its next period in ms (e.g. an adaptive sampling rate),
+# None keeps the current one.
+#
+# Per task timing: lateness is how long after its deadline a run started,
+# which shows tasks (or blocking code) holding up the loop.
+#
+#   sched = Scheduler()
+#   bus_lock = sched.lock()
+#   sched.every('sps30', 10000, lambda: pm_sensor.poll(bus_lock))
+#   sched.run()
+
+import time
+
+try:
+    import uasyncio as asyncio
+except ImportError:
+    try:
+        import asyncio
+    except ImportError:
+        # Firmware without uasyncio, only the thread based loops can run
+        asyncio = None
+
+def available():
+    """ False on firmware without uasyncio, Scheduler cannot run there """
+    return asyncio is not None
+
+def sleep_ms(ms):
+    """ awaitable, asyncio.sleep_ms on uasyncio """
+    if hasattr(asyncio, 'sleep_ms'):
+        return asyncio.sleep_ms(ms)
+    return asyncio.sleep(ms / 1000)
+
+# ticks_* are looked up on every call so a patched time module is picked up
+def ticks_ms():
+    if hasattr(time, 'ticks_ms'):
+        return time.ticks_ms()
+    return int(time.monotonic() * 1000)
+
+def ticks_diff(a, b):
+    if hasattr(time, 'ticks_diff'):
+        return time.ticks_diff(a, b)
+    return a - b
+
+def ticks_add(a, b):
+    if hasattr(time, 'ticks_add'):
+        return time.ticks_add(a, b)
+    return a + b
+
+class TaskStats:
+
+    def __init__(self, name, period_ms):
+        self.name = name
+        self.period_ms = period_ms
+        self.runs = 0
+        self.errors = 0
+        # Runs that started after the next deadline, their periods were skipped
+        self.overruns = 0
+
+        # Start delay after the deadline, in ms
+        self.late_ms = 0
+        self.late_max_ms = 0
+        self.late_total_ms = 0
+
+        # Run time, in ms
+        self.run_ms = 0
+        self.run_max_ms = 0
+
+    def record(self, late_ms, run_ms):
+        self.runs += 1
+        self.late_ms = late_ms
+        self.late_max_ms = max(self.late_max_ms, late_ms)
+        self.late_total_ms += late_ms
+        self.run_ms = run_ms
+        self.run_max_ms = max(self.run_max_ms, run_ms)
+
+    def late_avg_ms(self):
+        return self.late_total_ms // self.runs if self.runs else 0
+
+    def __str__(self):
+        return "{}: {} runs, late {} ms (avg {}, max {}), run {} ms (max {}), {} overruns, {} errors".format(
+            self.name, self.runs, self.late_ms, self.late_avg_ms(), self.late_max_ms,
+            self.run_ms, self.run_max_ms, self.overruns, self.errors)
+
+class Scheduler:
+
+    def __init__(self):
+        self._tasks = []
+        self._running = False
+        self.stats = {}
+
+    def lock(self):
+        """ async lock for a resource shared by tasks, e.g. an I2C bus """
+        return asyncio.Lock()
+
+    def every(self, name, period_ms, fn, delay_ms=0):
+        """ runs await fn() every period_ms, the first time delay_ms after start
+        fn may return a new period_ms """
+        stats = TaskStats(name, period_ms)
+        self.stats[name] = stats
+        self._tasks.append((fn, stats, delay_ms))
+        return stats
+
+    def run(self):
+        """ runs every task until stop(), blocks """
+        asyncio.run(self._main())
+
+    def stop(self):
+        self._running = False
+
+    async def _main(self):
+        self._running = True
+        runners = [asyncio.create_task(self._periodic(fn, stats, delay_ms)) for fn, stats, delay_ms in self._tasks]
+        for runner in runners:
+            await runner
+
+    async def _periodic(self, fn, stats, delay_ms):
+        due = ticks_add(ticks_ms(), delay_ms)
+        if delay_ms > 0:
+            await sleep_ms(delay_ms)
+
+        while self._running:
+            start = ticks_ms()
+            try:
+                period_ms = await fn()
+                if period_ms is not None:
+                    stats.period_ms = period_ms
+            except Exception as e:
+                stats.errors += 1
+                print("{}: {}".format(stats.name, e))
+            now = ticks_ms()
+            stats.record(max(ticks_diff(start, due), 0), ticks_diff(now, start))
+
+            due = ticks_add(due, stats.period_ms)
+            wait = ticks_diff(due, now)
+            if wait < 0:
+                # Missed one or more deadlines, restart the schedule from now
+                stats.overruns += 1
+                due = now
+                wait = 0
+            await sleep_ms(wait)
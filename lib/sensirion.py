@@ -0,0 +1,46 @@
+# Sensirion I2C frame decoder shared by sps30 and scd30
+#
+# Sensirion sensors send every 16 bit word followed by its crc8:
+#   [msb, lsb, crc] [msb, lsb, crc] ...
+# and a big endian float32 is made of two consecutive words.
+#
+# SensirionFrame strips the crc bytes into a preallocated buffer and unpacks
+# all floats with one unpack_from, so decoding a sample does not build any
+# intermediate bytes objects. What a sample still allocates is the tuple
+# unpack_from returns and its floats (boxed objects on the board), copied
+# into the reused values list.
+
+import struct
+from crc8 import check_words
+
+class SensirionFrame:
+
+    def __init__(self, n_floats):
+        self.n_floats = n_floats
+        self.n_words = n_floats * 2
+        self.read_len = n_floats * 6
+        self.values = [0.0] * n_floats
+
+        self._fmt = '>{}f'.format(n_floats)
+        self._raw = bytearray(n_floats * 4)
+
+    '''
+        checks the crc of every word in read and decodes the floats into self.values
+        returns a bitmask of the words with a bad crc, values are only updated when 0
+    '''
+    def decode(self, read):
+        failed = check_words(read, self.n_words)
+        if failed:
+            return failed
+
+        # Strip crc bytes: word i lives at read[3i:3i+2]
+        raw = self._raw
+        j = 0
+        for i in range(0, self.read_len, 3):
+            raw[j] = read[i]
+            raw[j + 1] = read[i + 1]
+            j += 2
+
+        self.values[:] = struct.unpack_from(self._fmt, raw)
+
+        return 0
@@ -0,0 +1,266 @@
+# Common I2C driver for Sensirion sensors (SPS30, SCD30)
+#
+# A SensirionDevice describes one sensor model: address, number of float
+# values per sample, read length and command set. SensirionSensor runs the
+# start/stop/ready/read loop for any device and keeps all of its buffers per
+# instance, preallocated at construction.
+#
+# Readiness: instead of polling the ready flag every 100 ms, the driver sleeps
+# until the sensor's next measurement is due (measurement_interval after the
+# last sample) and then checks once, backing off exponentially while the flag
+# is not set. poll_stats() reports how many ready checks each sample cost.
+#
+# class methods:
+# - start()
+# - stop()
+# - sample()
+# - poll(bus_lock)
+# - get_packed_msg()
+#
+# start() should be run from a separate thread so that stop() can update exit flag
+# sample() takes a single measurement, for callers that do not keep a thread
+# start() and sample() take an optional thread lock held for every bus access
+# poll() is sample() as a scheduler task, sharing the bus through an async lock
+
+from machine import I2C
+import time
+import struct
+from crc8 import calc_crc8, crc8
+from sensirion import SensirionFrame
+from scheduler import sleep_ms
+from snapshot import Snapshot
+import instrument
+
+# Sensirion I2C COMMANDS shared by SPS30 and SCD30
+SENSIRION_START_ADDR    = b'\x00\x10'
+SENSIRION_READY_ADDR    = b'\x02\x02'
+SENSIRION_READ_ADDR     = b'\x03\x00'
+SENSIRION_STOP_ADDR     = b'\x01\x04'
+SENSIRION_RESET_ADDR    = b'\xD3\x04'
+
+# Sensirion I2C COMMAND OPTIONS
+SENSIRION_START_MEASUREMENT = b'\x03\x00'
+
+# Ready flag backoff (ms), first retry and cap
+READY_BACKOFF_MIN_MS = 50
+READY_BACKOFF_MAX_MS = 1600
+# Give up and reset after this many measurement intervals without data
+READY_TIMEOUT_INTERVALS = 5
+
+class _NoLock:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+# Stands in for the bus lock of callers that have the bus to themselves
+_NO_LOCK = _NoLock()
+
+class SensirionDevice:
+
+    def __init__(self, name, addr, n_floats, read_len=None, measurement_interval=1, payload_fmt=None,
+                 start_addr=SENSIRION_START_ADDR, ready_addr=SENSIRION_READY_ADDR,
+                 read_addr=SENSIRION_READ_ADDR, stop_addr=SENSIRION_STOP_ADDR,
+                 reset_addr=SENSIRION_RESET_ADDR, start_option=SENSIRION_START_MEASUREMENT):
+        self.name = name
+        self.addr = addr
+        self.n_floats = n_floats
+        # Each float is 2 words of 3 bytes (msb, lsb, crc)
+        self.read_len = read_len if read_len is not None else n_floats * 6
+        # Seconds between two new measurements on the sensor side
+        self.measurement_interval = measurement_interval
+        # Packed sample layout, n_floats float32 unless the schema registry says otherwise
+        self.payload_fmt = payload_fmt if payload_fmt is not None else '<{}f'.format(n_floats)
+        self.start_addr = start_addr
+        self.ready_addr = ready_addr
+        self.read_addr = read_addr
+        self.stop_addr = stop_addr
+        self.reset_addr = reset_addr
+        self.start_option = start_option
+
+class SensirionSensor:
+
+    def __init__(self, device, b, p, br, interval):
+
+        self._device = device
+        self._interval = interval
+        self._exit_flag = False
+
+        # Per instance state, allocated once
+        self._curr_data = [None] * device.n_floats
+        # Packed samples for readers in other threads/tasks
+        self.snapshot = Snapshot(struct.calcsize(device.payload_fmt))
+        self._frame = SensirionFrame(device.n_floats)
+        self._read_buf = bytearray(device.read_len)
+        self._ready_buf = bytearray(3)
+        self._pack_fmt = device.payload_fmt
+        self._start_cmd = device.start_addr + device.start_option + calc_crc8(device.start_option)
+
+        # Readiness state and counters
+        self._last_sample = None
+        self._polls = 0
+        self._polls_total = 0
+        self._samples = 0
+
+        self._i2c = instrument.wrap_i2c(I2C(b, pins=p, baudrate=br), device.name.lower())
+        while device.addr not in self._i2c.scan():
+            print("{} not connected.".format(device.name))
+            time.sleep(3)
+
+        self._send_start()
+
+    def start(self, bus_lock=None):
+
+        lock = bus_lock if bus_lock is not None else _NO_LOCK
+
+        # Main operating loop
+        while not self._exit_flag:
+
+            try:
+
+                self.sample(bus_lock)
+
+                # Sleep timer
+                time.sleep(self._interval)
+
+            except Exception as e:
+                # Reset sensor in case I2C Bus fail, bad crc8, whatever
+                print(e)
+                with lock:
+                    self._reset()
+                time.sleep(3)
+
+    # One measurement: waits until it is ready, reads and decodes it
+    # Raises on bus errors and bad crc8, start() resets the sensor then
+    # bus_lock (a _thread lock) is held for each bus access, not while waiting
+    def sample(self, bus_lock=None):
+
+        lock = bus_lock if bus_lock is not None else _NO_LOCK
+
+        # Waits until the next measurement is ready
+        self._wait_ready(lock)
+
+        # Sample sensor
+        with lock:
+            read = self._read_data()
+        self._store(read)
+
+    # Scheduler task (lib/scheduler.py): one measurement, waiting cooperatively
+    # Every bus access holds bus_lock, the async lock of the I2C bus
+    async def poll(self, bus_lock):
+
+        try:
+            await self._wait_ready_async(bus_lock)
+            async with bus_lock:
+                read = self._read_data()
+            self._store(read)
+
+        except Exception as e:
+            # Reset sensor in case I2C Bus fail, bad crc8, whatever
+            print(e)
+            async with bus_lock:
+                self._reset()
+
+    # Called in a separate thread
+    def stop(self):
+
+        self._i2c.writeto(self._device.addr, self._device.stop_addr)
+        self._i2c.deinit()
+        self._exit_flag = True
+
+    # Returns (samples, total ready checks, ready checks for the last sample)
+    def poll_stats(self):
+        return (self._samples, self._polls_total, self._polls)
+
+    # Serialized data for transmission, None before the first sample
+    # Safe from any thread, see snapshot for the sequence number and timestamp
+    # Payload layout: device.payload_fmt
+    def get_packed_msg(self):
+        return self.snapshot.read()[2]
+
+    def _send_start(self):
+
+        # Start measurement mode, returns number of bytes written
+        return self._i2c.writeto(self._device.addr, self._start_cmd)
+
+    def _wait_ready(self, lock):
+
+        for delay in self._ready_schedule():
+            if delay > 0:
+                time.sleep_ms(delay)
+            with lock:
+                ready = self._is_ready()
+            if ready:
+                return
+        raise Exception("{} data not ready".format(self._device.name))
+
+    async def _wait_ready_async(self, bus_lock):
+
+        for delay in self._ready_schedule():
+            await sleep_ms(delay)
+            async with bus_lock:
+                ready = self._is_ready()
+            if ready:
+                return
+        raise Exception("{} data not ready".format(self._device.name))
+
+    def _ready_schedule(self):
+
+        # Yields how long to sleep before each ready check
+        interval_ms = int(self._device.measurement_interval * 1000)
+
+        # Sleep until the next measurement is due
+        delay = 0
+        if self._last_sample is not None:
+            delay = max(interval_ms - time.ticks_diff(time.ticks_ms(), self._last_sample), 0)
+
+        # Check once, then back off exponentially
+        self._polls = 0
+        backoff = READY_BACKOFF_MIN_MS
+        waited = 0
+        while True:
+            self._polls += 1
+            self._polls_total += 1
+            yield delay
+            if waited > interval_ms * READY_TIMEOUT_INTERVALS:
+                return
+            delay = backoff
+            waited += backoff
+            backoff = min(backoff * 2, READY_BACKOFF_MAX_MS)
+
+    def _store(self, read):
+
+        self._last_sample = time.ticks_ms()
+
+        # Check crc8 and deserialize
+        failed = self._frame.decode(read)
+        assert not failed, "Bad crc8, word mask 0x{:x}".format(failed)
+        self._curr_data[:] = self._frame.values
+        self._samples += 1
+
+        # Publish without blocking readers
+        struct.pack_into(self._pack_fmt, self.snapshot.begin(), 0, *self._curr_data)
+        self.snapshot.publish(self._last_sample)
+
+    def _is_ready(self):
+
+        # Returns device ready flag, word 0x0001 with a valid crc
+        self._i2c.writeto(self._device.addr, self._device.ready_addr)
+        self._i2c.readfrom_into(self._device.addr, self._ready_buf)
+        buf = self._ready_buf
+
+        return buf[2] == crc8(buf, 0, 2) and buf[0] == 0 and buf[1] == 1
+
+    def _read_data(self):
+
+        # Reads only the bytes the device descriptor needs into the preallocated buffer
+        self._i2c.writeto(self._device.addr, self._device.read_addr)
+        self._i2c.readfrom_into(self._device.addr, self._read_buf)
+        return self._read_buf
+
+    def _reset(self):
+
+        # Resets sensor
+        self._i2c.writeto(self._device.addr, self._device.reset_addr)
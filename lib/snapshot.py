@@ -0,0 +1,64 @@
+# Double-buffered sample snapshot
+#
+# One writer (a sensor task or thread) and any number of readers, no locks.
+# The writer fills the buffer readers are not using and publishes it by
+# bumping seq; readers copy the last published buffer and retry if the writer
+# started overwriting it meanwhile. Every sample carries its sequence number
+# and a ticks_ms timestamp so consumers can tell a new sample from one they
+# already sent.
+#
+#   buf = snap.begin()          # writer
+#   struct.pack_into(fmt, buf, 0, *values)
+#   snap.publish(time.ticks_ms())
+#
+#   seq, stamp = snap.read_into(out)   # reader, seq 0: nothing published yet
+
+import time
+
+# Reader retries before giving up on a writer that keeps overwriting
+READ_RETRIES = 4
+
+class SnapshotError(Exception):
+    pass
+
+class Snapshot:
+
+    def __init__(self, size):
+        self.size = size
+        self._bufs = (bytearray(size), bytearray(size))
+        self._stamps = [0, 0]
+        # Last published sample, 0 before the first one
+        self.seq = 0
+        # Sample being written, seq + 1 while the writer is between begin() and publish()
+        self._writing = 0
+
+    def begin(self):
+        """ returns the buffer to fill with the next sample """
+        self._writing = self.seq + 1
+        return self._bufs[self._writing & 1]
+
+    def publish(self, stamp=None):
+        """ makes the buffer from begin() the current sample """
+        seq = self._writing
+        self._stamps[seq & 1] = time.ticks_ms() if stamp is None else stamp
+        self.seq = seq
+
+    def read_into(self, out):
+        """ copies the current sample into out, returns (seq, stamp) """
+        for _ in range(READ_RETRIES):
+            seq = self.seq
+            if seq == 0:
+                return (0, 0)
+            i = seq & 1
+            out[:] = self._bufs[i]
+            stamp = self._stamps[i]
+            # The writer only touches this buffer again from sample seq + 2 on
+            if self._writing < seq + 2:
+                return (seq, stamp)
+        raise SnapshotError("snapshot overwritten during read")
+
+    def read(self):
+        """ (seq, stamp, bytes) of the current sample, bytes is None before the first one """
+        out = bytearray(self.size)
+        seq, stamp = self.read_into(out)
+        return (seq, stamp, bytes(out) if seq else None)
@@ -0,0 +1,155 @@
+# Outbound frame queue
+#
+# Bounded in-RAM queue of frames waiting for an uplink. Frames go out by
+# priority (highest first), then in the order they were queued. A frame whose
+# uplink failed stays queued and is retried after a backoff that doubles with
+# every attempt, counted from the start of the attempt (the pop()), up to
+# backoff_max_ms; after max_attempts it is given up.
+#
+# When the queue is full, push() drops by policy:
+#   DROP_OLDEST  the oldest frame
+#   DROP_LOWEST  the oldest of the lowest priority frames, or the new frame if
+#                its priority is lower than every queued one
+#
+# Coalescing: with a merge(port, a, b, max_size) function (e.g. mux
+# merge_frames on the mux port), pop() folds other due frames of the same
+# port into the one it returns while they fit max_size, so one uplink carries
+# them all.
+#
+#   q = TxQueue(16)
+#   q.push(port, frame, priority)
+#   item = q.pop(max_size)          # None if nothing is due
+#   if item is not None:
+#       port, frame, entries = item
+#       given_up = q.done(entries, send(port, frame))
+
+import time
+
+DROP_OLDEST = 0
+DROP_LOWEST = 1
+
+# Entry fields
+_PRIORITY = 0
+_SEQ = 1
+_PORT = 2
+_FRAME = 3
+_ATTEMPTS = 4
+_DUE = 5
+
+class TxQueue:
+
+    def __init__(self, capacity, drop_policy=DROP_OLDEST, max_attempts=4,
+                 backoff_ms=15000, backoff_max_ms=240000, merge=None):
+        self.capacity = capacity
+        self.drop_policy = drop_policy
+        self.max_attempts = max_attempts
+        self.backoff_ms = backoff_ms
+        self.backoff_max_ms = backoff_max_ms
+        self._merge = merge
+
+        # [priority, seq, port, frame, attempts, due ticks_ms]
+        self._entries = []
+        self._seq = 0
+        self._popped = 0
+
+        self.enqueued = 0
+        # Frames sent, each frame of a coalesced uplink counts
+        self.sent = 0
+        self.retried = 0
+        # Frames dropped when full, and given up after max_attempts
+        self.dropped = 0
+        self.given_up = 0
+        # Frames folded into another frame's uplink
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def push(self, port, frame, priority=0):
+        """ queues a copy of frame, returns the frame dropped to make room or None """
+        dropped = None
+        if len(self._entries) >= self.capacity:
+            victim = self._victim(priority)
+            if victim is None:
+                self.dropped += 1
+                return (port, frame)
+            self._entries.remove(victim)
+            self.dropped += 1
+            dropped = (victim[_PORT], victim[_FRAME])
+
+        self._seq += 1
+        # A copy: packers reuse their buffers (codec.Schema.pack_raw / encode)
+        self._entries.append([priority, self._seq, port, bytes(frame), 0, time.ticks_ms()])
+        self.enqueued += 1
+        return dropped
+
+    def pop(self, max_size):
+        """ next due frame as (port, frame, entries), coalesced with other due
+        frames of its port, or None; report the uplink with done(entries, ok) """
+        now = time.ticks_ms()
+        self._popped = now
+        due = [e for e in self._entries if time.ticks_diff(now, e[_DUE]) >= 0]
+        if not due:
+            return None
+        # Highest priority, then first queued
+        due.sort(key=lambda e: (-e[_PRIORITY], e[_SEQ]))
+        first = due[0]
+        frame = first[_FRAME]
+        entries = [first]
+        if self._merge is not None:
+            for e in due[1:]:
+                if e[_PORT] != first[_PORT]:
+                    continue
+                merged = self._merge(first[_PORT], frame, e[_FRAME], max_size)
+                if merged is not None:
+                    frame = merged
+                    entries.append(e)
+        return (first[_PORT], frame, entries)
+
+    def done(self, entries, ok):
+        """ reports the uplink of entries from pop(), returns the frames given up """
+        given_up = []
+        if ok:
+            self.sent += len(entries)
+            self.coalesced += len(entries) - 1
+            for e in entries:
+                self._entries.remove(e)
+            return given_up
+
+        for e in entries:
+            e[_ATTEMPTS] += 1
+            if e[_ATTEMPTS] >= self.max_attempts:
+                self._entries.remove(e)
+                self.given_up += 1
+                given_up.append((e[_PORT], e[_FRAME]))
+            else:
+                self.retried += 1
+                backoff = min(self.backoff_ms << (e[_ATTEMPTS] - 1), self.backoff_max_ms)
+                e[_DUE] = time.ticks_add(self._popped, backoff)
+        return given_up
+
+    def discard(self, entries):
+        """ drops entries from pop() without an uplink, e.g. frames too long for the data rate """
+        for e in entries:
+            self._entries.remove(e)
+        self.dropped += len(entries)
+
+    def clear(self):
+        """ empties the queue, returns the queued (port, frame) """
+        frames = [(e[_PORT], e[_FRAME]) for e in sorted(self._entries, key=lambda e: e[_SEQ])]
+        self._entries = []
+        return frames
+
+    def _victim(self, priority):
+        if self.drop_policy == DROP_LOWEST:
+            lowest = min(e[_PRIORITY] for e in self._entries)
+            if priority < lowest:
+                return None
+            candidates = [e for e in self._entries if e[_PRIORITY] == lowest]
+        else:
+            candidates = self._entries
+        return min(candidates, key=lambda e: e[_SEQ])
+
+    def __str__(self):
+        return "{} queued, {} enqueued, {} sent, {} retried, {} coalesced, {} dropped, {} given up".format(
+            len(self._entries), self.enqueued, self.sent, self.retried, self.coalesced, self.dropped, self.given_up)
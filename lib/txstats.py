@@ -0,0 +1,45 @@
+# Uplink statistics
+#
+# One record() per uplink: latency is the time from socket.send() until the
+# radio reported TX_PACKET_EVENT / TX_FAILED_EVENT (or the wait timed out),
+# airtime is lora.stats().tx_time_on_air for that packet. Times in ms.
+
+class TxStats:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.packets = 0
+        self.failed = 0
+        self.timeouts = 0
+
+        # Last packet
+        self.latency_ms = 0
+        self.airtime_ms = 0
+
+        # Totals
+        self.latency_max_ms = 0
+        self.latency_total_ms = 0
+        self.airtime_total_ms = 0
+
+    def record(self, latency_ms, airtime_ms, ok, timed_out=False):
+        self.packets += 1
+        if not ok:
+            self.failed += 1
+        if timed_out:
+            self.timeouts += 1
+
+        self.latency_ms = latency_ms
+        self.airtime_ms = airtime_ms
+        self.latency_max_ms = max(self.latency_max_ms, latency_ms)
+        self.latency_total_ms += latency_ms
+        self.airtime_total_ms += airtime_ms
+
+    def latency_avg_ms(self):
+        return self.latency_total_ms // self.packets if self.packets else 0
+
+    def __str__(self):
+        return "{} packets, {} failed, {} timeouts, latency {} ms (avg {}, max {}), airtime {} ms (total {})".format(
+            self.packets, self.failed, self.timeouts, self.latency_ms, self.latency_avg_ms(),
+            self.latency_max_ms, self.airtime_ms, self.airtime_total_ms)
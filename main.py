@@ -1,5 +1,6 @@
 import _thread
 import time
+import machine
 import ubinascii
 import socket
 import struct
@@ -7,6 +8,19 @@ import pycom
 from network import LoRa
 from sps30 import sps30
 from scd30 import scd30
+from mux import pack_frames, merge_frames, max_payload, MuxError, MUX_HEADER_SIZE
+from codec import quantize_payloads, SCHEMAS, MUX_PORT, MUX_VERSION, MUX_VERSION_FLOAT, SENSOR_SPS30, SENSOR_SCD30, SENSOR_PYSENSE
+from batch import SampleBuffer, BatchError, BATCH_DELTA, BATCH_AGGREGATE, BATCH_HEADER_SIZE
+from registry import SensorRegistry
+from ringlog import RingLog, FileBackend
+from txstats import TxStats
+from airtime import AirtimeBudget
+from txqueue import TxQueue, DROP_LOWEST
+from scheduler import Scheduler, available as scheduler_available
+from adaptive import AdaptiveInterval
+import instrument
+from instrument import DIAG_PORT
+from remote import Config, RemoteError, CONFIG_PORT, CMD_SET, CMD_DEFAULTS, CMD_REPORT, CMD_REBOOT, KEYS, BOOT_SETTINGS, parse, pack_report
 
 # create an OTA authentication params
 dev_eui = ubinascii.unhexlify('70B3D54994CBFEDA')
@@ -22,6 +36,166 @@ using_pm = False
 using_co2 = False
 using_pysense_sensor = True
 
+# Sensirion sampling periods, the tasks run in one scheduler thread
+PM_PERIOD_MS = 10000
+CO2_PERIOD_MS = 10000
+# Older samples are stale and not sent, e.g. when a sensor task stopped
+MAX_SAMPLE_AGE_MS = 60000
+
+# Send every sensor in one multiplexed uplink on MUX_PORT (lib/codec.py) instead
+# of one uplink per sensor on its legacy port
+using_mux = True
+# Multiplexed payloads as fixed-point integers (lib/codec.py), about half the float32 size
+using_quantized = True
+
+# Batch mode (lib/batch.py): sample every CYCLE_S but uplink every BATCH_CYCLES
+# cycles, either every sample as deltas (BATCH_DELTA) or min/mean/max/last
+# (BATCH_AGGREGATE, deltas for sensors whose aggregate does not fit a frame)
+using_batch = False
+BATCH_CYCLES = 8
+BATCH_MODE = BATCH_DELTA
+# Samples kept per sensor, the oldest are dropped when uplinks fail to drain them
+BATCH_CAPACITY = 64
+
+# Keep frames that failed to send on flash and resend them when the link is back
+using_backlog = True
+BACKLOG_PATH = '/flash/backlog.bin'
+BACKLOG_SLOTS = 5000
+# Slots for the built-in LORA_DR, a remote data rate does not change the file
+# layout: frames too long for the slots are not logged
+BACKLOG_RECORD_SIZE = max_payload(LORA_DR)
+
+# Deep-sleep duty cycle: wake, sample, send, then power down for the rest of
+# the cycle instead of staying awake in main's loop
+using_deepsleep = False
+CYCLE_S = 15
+# The PIC sleep timer counts whole seconds
+MIN_SLEEP_S = 1
+
+# Adaptive sampling (lib/adaptive.py): a sensor's sampling interval doubles
+# while its readings stay within the deadbands, up to the max, and drops back
+# to the min on a change. Sensirion task periods and Pysense reads (every
+# cycle at most) follow it, and so do the uplinks, only new samples are sent
+using_adaptive = False
+# ADAPTIVE (intervals and deadbands) follows the remote configuration below,
+# it is built from the loaded periods
+
+# LoRaWAN session: restored from NVRAM at boot instead of joining again, and
+# checkpointed every LORA_SAVE_EVERY uplinks. A reset restores a frame counter
+# up to LORA_SAVE_EVERY - 1 behind the network's, which drops those uplinks as
+# replays: the confirmed uplink after the reset gets no ack and the device joins
+# again. There is no API to move the counter on, so 1 (one NVRAM write per
+# uplink) is the only value that keeps the session across a reset
+LORA_SAVE_EVERY = 1
+
+# send_pkt waits for lora_cb to report the end of each uplink, polling every
+# TX_POLL_MS, and counts it as failed after TX_TIMEOUT_MS without an event
+TX_TIMEOUT_MS = 6000
+TX_POLL_MS = 10
+
+# Airtime budget (lib/airtime.py): every uplink's predicted and actual airtime
+# goes to a 24 h ledger; with using_airtime_budget uplinks that do not fit are
+# held back: skipped (the next cycle sends newer samples), or in batch mode
+# kept in the buffers and merged into the next batch. The ledger is in RAM: with
+# using_deepsleep it starts empty on every wake and only the tokens, saved
+# across sleeps, pace the uplinks (any 24 h then stays within the budget plus
+# two bursts, see lib/airtime.py)
+using_airtime_budget = False
+# TTN fair use policy: 30 s of uplink airtime per 24 h
+AIRTIME_BUDGET_MS = 30000
+AIRTIME_REGION = 'US915'
+
+# Outbound queue (lib/txqueue.py): frames wait in RAM by priority, a failed
+# uplink is retried after a backoff doubling from TXQ_BACKOFF_MS, and frames
+# due together on MUX_PORT are merged into one uplink when they fit. Frames
+# dropped when the queue is full or given up after TXQ_MAX_ATTEMPTS go to the
+# flash backlog
+TXQ_CAPACITY = 16
+TXQ_DROP_POLICY = DROP_LOWEST
+TXQ_MAX_ATTEMPTS = 3
+# First retry on the next CYCLE_S cycle, then every second, fourth, ... cycle
+TXQ_BACKOFF_MS = 10000
+TXQ_BACKOFF_MAX_MS = 120000
+# Queue uplinks per cycle, each one waits for the radio
+TXQ_SENDS_PER_CYCLE = 4
+# Config reports answer a downlink, batch frames carry many samples while a
+# cycle's frame is followed by the next one, diagnostics are dropped first
+PRIORITY_CONFIG = 3
+PRIORITY_BATCH = 2
+PRIORITY_SAMPLE = 1
+PRIORITY_DIAG = 0
+
+# Instrumentation (lib/instrument.py): I2C transfers of every driver, PIC
+# waits, uplinks and the main loop stages timed into histograms. The summary
+# is printed every INSTRUMENT_EVERY cycles (every wake in deep-sleep mode) and
+# with using_diag_uplink also sent on DIAG_PORT. Disabled, the drivers use the
+# null timers and the bare I2C objects
+using_instrument = False
+using_diag_uplink = False
+INSTRUMENT_EVERY = 240
+
+# Remote configuration (lib/remote.py): downlinks on CONFIG_PORT change the
+# settings of remote.SETTINGS above (cycle, data rate, Sensirion periods,
+# sensor and codec flags, airtime budget) at runtime. Applied settings are
+# saved in NVS and replace the built-in values at boot; the sensor flags only
+# take effect after a reboot. A downlink is rejected when a sample of an
+# enabled sensor would not fit an uplink with the new settings (frames_fit)
+config = Config(dict((name, globals()[name]) for name in KEYS), pycom.nvs_get, pycom.nvs_set, pycom.nvs_erase)
+globals().update(config.load())
+# Sensor flags as booted, a remote change only applies to the next boot
+boot_sensors = dict((name, globals()[name]) for name in BOOT_SETTINGS)
+# Sensor flag -> sensor id
+SENSOR_FLAGS = {
+    'using_pm': SENSOR_SPS30,
+    'using_co2': SENSOR_SCD30,
+    'using_pysense_sensor': SENSOR_PYSENSE,
+}
+# Setting -> (scheduler task, sensor id) of the Sensirion sampling periods
+SENSOR_PERIODS = {
+    'PM_PERIOD_MS': ('sps30', SENSOR_SPS30),
+    'CO2_PERIOD_MS': ('scd30', SENSOR_SCD30),
+}
+
+# Adaptive sampling, sensor id -> (min ms, max ms, deadband per payload field)
+# The minimums are the periods loaded above, saved remote changes included
+ADAPTIVE = {
+    # PM mass ug/m3, number concentration /cm3, typical size um
+    SENSOR_SPS30: (PM_PERIOD_MS, 12 * PM_PERIOD_MS, (1.0, 1.0, 1.0, 1.0, 5.0, 5.0, 5.0, 5.0, 5.0, 0.05)),
+    # CO2 ppm, temperature degC, humidity %RH
+    SENSOR_SCD30: (CO2_PERIOD_MS, 12 * CO2_PERIOD_MS, (20.0, 0.2, 1.0)),
+    # Temperature degC, humidity %RH, light channel counts
+    SENSOR_PYSENSE: (CYCLE_S * 1000, 8 * CYCLE_S * 1000, (0.2, 1.0, 20, 20)),
+}
+
+# Set by lora_cb when the radio reports the end of an uplink / a failed uplink
+tx_done = False
+tx_failed = False
+tx_stats = TxStats()
+airtime = AirtimeBudget(AIRTIME_BUDGET_MS, region=AIRTIME_REGION)
+tx_queue = TxQueue(TXQ_CAPACITY, TXQ_DROP_POLICY, TXQ_MAX_ATTEMPTS, TXQ_BACKOFF_MS, TXQ_BACKOFF_MAX_MS,
+                   merge=lambda port, a, b, max_size: merge_frames(a, b, max_size) if port == MUX_PORT else None)
+backlog = None
+
+# Sequence number of the last sample sent per sensor id, each sample is sent once
+sent_seqs = {}
+# Sensor id -> SampleBuffer in batch mode
+batches = {}
+# Sensor id -> AdaptiveInterval with using_adaptive
+adaptive = {}
+# Frames received on CONFIG_PORT by lora_cb, applied by the main loop
+downlinks = []
+
+# Session state
+# This boot is a wake from deep_sleep(), told by an NVS marker: the PIC sleep
+# cuts the power, machine.reset_cause() reports a power-on reset after it
+woke_from_sleep = False
+lora_radio = None
+lora_socket = None
+sensor_tasks = None
+uplinks_since_save = 0
+verify_session = False
+first_uplink_ms = None
+
 if using_pysense_sensor:
     from pysense import Pysense
     from LIS2HH12 import LIS2HH12
@@ -30,24 +204,310 @@ if using_pysense_sensor:
     from MPL3115A2 import MPL3115A2,ALTITUDE,PRESSURE
 
 def main():
+    global backlog, lora_radio, sensor_tasks, woke_from_sleep
 
     pycom.heartbeat(False)
 
+    woke_from_sleep = pycom.nvs_get('slept', 0) == 1
+    if woke_from_sleep:
+        pycom.nvs_set('slept', 0)
+
+    # Settings saved before frames_fit checked them, the drivers would fail every cycle
+    if config.load() and not frames_fit(current_settings()):
+        print("Saved settings do not fit DR{} uplinks, rebooting with the defaults".format(LORA_DR))
+        config.reset()
+        machine.reset()
+
+    # Before any driver is built, they take their timers at construction
+    if using_instrument:
+        instrument.enable()
+
+    if using_deepsleep:
+        duty_cycle()
+        return
+
     # Sensor initializations with default params
     # bus   = 1
     # sda   = P10
     # scl   = P11
     # baud  = 20000
-    # interval  = 10
+    # interval  = PM_PERIOD_MS / CO2_PERIOD_MS, used by the thread loops
+    pm_sensor = sps30(interval=PM_PERIOD_MS / 1000) if using_pm else None
+    co2_sensor = scd30(interval=CO2_PERIOD_MS / 1000) if using_co2 else None
+
+    # Pysense drivers are created and configured once, then reused every cycle
+    pysense_sensors = pysense_registry() if using_pysense_sensor else None
+    if using_pysense_sensor:
+        print("Pysense setup: {} ms".format(pysense_sensors.setup()))
+
+    if using_adaptive:
+        for sensor_id, (min_ms, max_ms, deadbands) in ADAPTIVE.items():
+            adaptive[sensor_id] = AdaptiveInterval(min_ms, max_ms, deadbands)
+
+    # Start the sensor tasks in a separate thread, or one thread per sensor
+    # on firmware without uasyncio
+    if scheduler_available():
+        sensor_tasks = sensor_scheduler(pm_sensor, co2_sensor)
+        if sensor_tasks is not None:
+            _thread.start_new_thread(sensor_tasks.run, ())
+    else:
+        start_sensor_threads(pm_sensor, co2_sensor)
+
+    lora_radio, restored = join_lora()
+    lora_socket = open_socket()
+    register_callback(lora_radio)
+
+    if not restored:
+        time.sleep(4) # this timer is important and caused me some trouble ...
+
+    if using_backlog:
+        backlog = open_backlog()
+
+    # Send pm, co2 and pysense data, payload layouts and sizes in codec.SCHEMAS
+    # (raw_size bytes as floats, size bytes quantized)
+    cycles = 0
+    batch_due = False
+    cycle_timer = instrument.timer('cycle')
+    sample_timer = instrument.timer('sample')
+    transmit_timer = instrument.timer('transmit')
+    overruns = instrument.counter('cycle.overruns')
+    while True:
+        cycle_start = time.ticks_ms()
+        cycle_t0 = cycle_timer.start()
+        if apply_downlinks(lora_socket):
+            print("Rebooting for the new settings")
+            park_queue()
+            machine.reset()
+        t0 = sample_timer.start()
+        payloads = sample(pm_sensor, co2_sensor, pysense_sensors if pysense_due() else None)
+        sample_timer.stop(t0)
+        if SENSOR_PYSENSE in adaptive and SENSOR_PYSENSE in payloads:
+            # Stamped at the cycle start, as pysense_due() is checked one cycle later
+            adaptive[SENSOR_PYSENSE].update(struct.unpack(SCHEMAS[SENSOR_PYSENSE].raw_fmt, payloads[SENSOR_PYSENSE]), cycle_start)
+        cycles += 1
+        t0 = transmit_timer.start()
+        if using_batch:
+            buffer_samples(payloads)
+            if cycles % BATCH_CYCLES == 0:
+                batch_due = True
+            if batch_due:
+                # Tried again every cycle while the airtime budget holds it back
+                batch_due = not transmit_batches(lora_socket)
+        else:
+            transmit(lora_socket, payloads)
+        transmit_timer.stop(t0)
+        print("TX: {}".format(tx_stats))
+        print("Airtime: {}".format(airtime))
+        print("Queue: {}".format(tx_queue))
+        if sensor_tasks is not None:
+            for stats in sensor_tasks.stats.values():
+                print(stats)
+        for sensor_id, adapt in adaptive.items():
+            print("Sensor {} sampling: {}".format(sensor_id, adapt))
+        cycle_timer.stop(cycle_t0)
+        if using_instrument and cycles % INSTRUMENT_EVERY == 0:
+            report_instrumentation()
+
+        # Keep a CYCLE_S cycle whatever the uplinks took
+        remaining = CYCLE_S * 1000 - time.ticks_diff(time.ticks_ms(), cycle_start)
+        if remaining > 0:
+            time.sleep_ms(remaining)
+        else:
+            overruns.add()
+
+    # Stop polling and end threads
+    if sensor_tasks is not None:
+        sensor_tasks.stop()
+    if using_pm:
+        pm_sensor.stop()
+    if using_co2:
+        co2_sensor.stop()
+
+'''
+    scheduler running the Sensirion sensors as tasks, or None without any
+    Both sensors are on bus 1: every transaction holds the bus lock
+'''
+def sensor_scheduler(pm_sensor, co2_sensor):
+    if pm_sensor is None and co2_sensor is None:
+        return None
+
+    sched = Scheduler()
+    bus_lock = sched.lock()
+    if pm_sensor is not None:
+        sched.every('sps30', PM_PERIOD_MS, sensor_task(SENSOR_SPS30, pm_sensor, bus_lock))
+    if co2_sensor is not None:
+        # Half a period apart so the two tasks do not queue on the bus lock
+        sched.every('scd30', CO2_PERIOD_MS, sensor_task(SENSOR_SCD30, co2_sensor, bus_lock), delay_ms=CO2_PERIOD_MS // 2)
+    return sched
+
+'''
+    sampling threads running the Sensirion sensors' start() loops, for firmware
+    without uasyncio. Both sensors are on bus 1: every transaction holds a
+    thread lock. Their periods are fixed, adaptive sampling needs the scheduler
+'''
+def start_sensor_threads(pm_sensor, co2_sensor):
+    bus_lock = _thread.allocate_lock()
+    for sensor in (pm_sensor, co2_sensor):
+        if sensor is not None:
+            _thread.start_new_thread(sensor.start, (bus_lock,))
+
+'''
+    scheduler task polling one Sensirion sensor, returns the next period with using_adaptive
+'''
+def sensor_task(sensor_id, sensor, bus_lock):
+    adapt = adaptive.get(sensor_id)
+    if adapt is None:
+        return lambda: sensor.poll(bus_lock)
+
+    fmt = SCHEMAS[sensor_id].raw_fmt
+    async def task():
+        seq = sensor.snapshot.seq
+        await sensor.poll(bus_lock)
+        msg = sensor.get_packed_msg()
+        if sensor.snapshot.seq != seq and msg is not None:
+            return adapt.update(struct.unpack(fmt, msg))
+    return task
+
+'''
+    True if the Pysense sensors are due for a read this cycle
+'''
+def pysense_due():
+    return SENSOR_PYSENSE not in adaptive or adaptive[SENSOR_PYSENSE].due()
+
+'''
+    one wake period of the deep-sleep mode: sample, send, then power down until
+    the next cycle is due. The LoRaWAN session is kept in NVRAM across sleeps
+    so the device only joins over OTAA when no session was saved
+'''
+def duty_cycle():
+    global backlog, lora_radio
+
     pm_sensor = sps30() if using_pm else None
     co2_sensor = scd30() if using_co2 else None
+    pysense_sensors = pysense_registry() if using_pysense_sensor else None
+    if using_pysense_sensor:
+        pysense_sensors.setup()
 
-    # Start sensors in a separate thread
-    pm_thread = _thread.start_new_thread(pm_sensor.start, ()) if using_pm else None
-    co2_thread = _thread.start_new_thread(co2_sensor.start, ()) if using_co2 else None
+    # One fresh measurement per wake, no sampling threads
+    pm_sample = sample_once(pm_sensor)
+    co2_sample = sample_once(co2_sensor)
+
+    lora_radio, restored = join_lora()
+    lora_socket = open_socket()
+    register_callback(lora_radio)
+    if not restored:
+        time.sleep(4) # see main()
+
+    if using_backlog:
+        backlog = open_backlog()
+
+    # Airtime tokens left before the last sleep, refilled for the time asleep
+    tokens_ms = pycom.nvs_get('air_tokens', None)
+    if tokens_ms is not None and woke_from_sleep:
+        airtime.restore(tokens_ms, pycom.nvs_get('air_sleep_ms', 0))
+
+    t0 = instrument.timer('sample').start()
+    payloads = sample(pm_sample, co2_sample, pysense_sensors)
+    instrument.timer('sample').stop(t0)
+    t0 = instrument.timer('transmit').start()
+    transmit(lora_socket, payloads)
+    instrument.timer('transmit').stop(t0)
+
+    # Downlinks received after the uplinks, a reboot is the next wake anyway
+    apply_downlinks(lora_socket)
+    if len(tx_queue):
+        flush_queue(lora_socket)
+
+    # Frames still waiting for a retry would be lost with RAM
+    park_queue()
+
+    # Sensirion sensors keep measuring (SPS30 fan) unless stopped
+    for sensor in (pm_sensor, co2_sensor):
+        if sensor is not None:
+            sensor.stop()
+
+    # ticks restart on every wake, so this is the awake time of this cycle
+    # (without the boot before main.py runs)
+    awake_ms = time.ticks_ms()
+    sleep_s = max((CYCLE_S * 1000 - awake_ms + 500) // 1000, MIN_SLEEP_S)
+    pycom.nvs_set('awake_ms', awake_ms)
+    pycom.nvs_set('air_tokens', int(airtime.tokens_ms))
+    pycom.nvs_set('air_sleep_ms', sleep_s * 1000)
+    pycom.nvs_set('awake_max_ms', max(awake_ms, pycom.nvs_get('awake_max_ms', 0)))
+    print("Awake: {} ms (max {} ms), sleeping {} s".format(awake_ms, pycom.nvs_get('awake_max_ms'), sleep_s))
+    if using_instrument:
+        instrument.dump()
+
+    deep_sleep(lora_radio, pysense_sensors, sleep_s)
+
+'''
+    takes one measurement, returns the sensor or None if it failed
+'''
+def sample_once(sensor):
+    if sensor is None:
+        return None
+    try:
+        sensor.sample()
+        return sensor
+    except Exception as e:
+        # Left out of this cycle's uplink
+        print(e)
+        sensor._reset()
+        return None
+
+'''
+    saves the LoRaWAN session and the backlog and powers the board down for
+    sleep_s seconds
+'''
+def deep_sleep(lora, pysense_sensors, sleep_s):
+    lora.nvram_save()
+    # Records appended since the last batch are only in RAM
+    if backlog is not None:
+        backlog.flush()
+    # Read by the next boot, whichever way the board powers down
+    pycom.nvs_set('slept', 1)
+
+    if pysense_sensors is not None:
+        # The PIC cuts power to the LoPy and restores it after sleep_s
+        py = pysense_sensors.get('py')
+        py.setup_sleep(sleep_s)
+        py.go_to_sleep()
+
+    # Only reached without a Pysense, or on USB power where the PIC cannot cut it
+    machine.deepsleep(sleep_s * 1000)
+
+'''
+    opens the flash backlog of frames that failed to send
+'''
+def open_backlog():
+    log = RingLog(FileBackend(BACKLOG_PATH, RingLog.file_size(BACKLOG_SLOTS, BACKLOG_RECORD_SIZE)),
+                  BACKLOG_SLOTS, BACKLOG_RECORD_SIZE)
+    print("Backlog: {} unsent frames".format(len(log)))
+    return log
+
+'''
+    restores the LoRaWAN session saved in NVRAM, or prepares the lora channels
+    and joins the network with OTAA
+    returns (lora, True if the session was restored)
+'''
+def join_lora(restore=True):
+    global verify_session, uplinks_since_save
 
-    # Prepare LoRa channels
     lora = LoRa(mode=LoRa.LORAWAN, region=LoRa.US915, device_class=LoRa.CLASS_C)
+    uplinks_since_save = 0
+
+    if restore:
+        lora.nvram_restore()
+        if lora.has_joined():
+            # A session saved right before deep sleep is current. After any other
+            # reset the session may be stale (an erased checkpoint, a counter
+            # behind with LORA_SAVE_EVERY > 1): the first uplink is confirmed,
+            # and a missing ack means joining again (see uplink)
+            verify_session = not woke_from_sleep
+            print('LoRaWAN session restored')
+            return lora, True
+
+    # Prepare LoRa channels
     prepare_channels(lora, LORA_FREQUENCY)
     #lora = LoRa(mode=LoRa.LORA, region=LoRa.US915, frequency=904600000, bandwidth=LoRa.BW_500KHZ, sf=8)
     # Join LoRa network with OTAA
@@ -59,6 +519,25 @@ def main():
         print('.', end='')
     print('')
 
+    # Checkpoint the new session right away
+    lora.nvram_save()
+
+    return lora, False
+
+'''
+    routes the radio events to lora_cb
+'''
+def register_callback(lora):
+    lora.callback(trigger=( LoRa.RX_PACKET_EVENT |
+                            LoRa.TX_PACKET_EVENT |
+                            LoRa.TX_FAILED_EVENT  ), handler=lora_cb)
+
+'''
+    opens the LoRa socket used for every uplink
+'''
+def open_socket():
+    global lora_socket
+
     # Socket initializations
     lora_socket = socket.socket(socket.AF_LORA, socket.SOCK_RAW)
     lora_socket.setsockopt(socket.SOL_LORA, socket.SO_DR, LORA_DR)
@@ -67,48 +546,336 @@ def main():
     # make the socket non blocking by default
     lora_socket.setblocking(False)
 
-    lora.callback(trigger=( LoRa.RX_PACKET_EVENT |
-                            LoRa.TX_PACKET_EVENT |
-                            LoRa.TX_FAILED_EVENT  ), handler=lora_cb)
+    return lora_socket
 
-    time.sleep(4) # this timer is important and caused me some trouble ...
+'''
+    latest sample of a Sensirion sensor, None if there is none yet, it was
+    already sent or it is older than MAX_SAMPLE_AGE_MS
+'''
+def fresh_sample(sensor_id, sensor):
+    if sensor is None:
+        return None
 
-    # Send pm (payload=40bytes) and co2 (payload=12bytes) data every 5 minutes
-    while True:
-        # Poll data
-        if using_pm:
-            pm_data = pm_sensor.get_packed_msg()
-        if using_co2:
-            co2_data = co2_sensor.get_packed_msg()
-        if using_pysense_sensor:
-            py = Pysense()
-            mp = MPL3115A2(py,mode=ALTITUDE) # Returns height in meters. Mode may also be set to PRESSURE, returning a value in Pascals
-            si = SI7006A20(py)
-            lt = LTR329ALS01(py)
-            li = LIS2HH12(py)
-
-        # Send data
-        if using_pm:
-            send_pkt(lora_socket,pm_data, 8)
-        if using_co2:
-            send_pkt(lora_socket, co2_data, 9)
-        if using_pysense_sensor:
-
-            temp = si.temperature()
-            rh = si.humidity()
-            rlux = lt.light()[0]
-            blux = lt.light()[1]
-
-            pysense_pkt = struct.pack('<ffii', temp, rh, rlux, blux)
-            send_pkt(lora_socket, pysense_pkt, 10)
-
-        time.sleep(15 - using_pm * 5 - using_co2 * 5 - using_pysense_sensor * 5)
+    seq, stamp, msg = sensor.snapshot.read()
+    if seq == 0 or sent_seqs.get(sensor_id) == seq:
+        return None
+    if time.ticks_diff(time.ticks_ms(), stamp) > MAX_SAMPLE_AGE_MS:
+        print("Sensor {}: stale sample {}".format(sensor_id, seq))
+        return None
 
-    # Stop polling and end threads
-    if using_pm:
-        pm_sensor.stop()
-    if using_co2:
-        co2_sensor.stop()
+    sent_seqs[sensor_id] = seq
+    return msg
+
+'''
+    reads every sensor that is not None and has new data, returns {sensor id: payload}
+'''
+def sample(pm_sensor, co2_sensor, pysense_sensors):
+    # Poll data
+    payloads = {}
+    pm_msg = fresh_sample(SENSOR_SPS30, pm_sensor)
+    if pm_msg is not None:
+        payloads[SENSOR_SPS30] = pm_msg
+    co2_msg = fresh_sample(SENSOR_SCD30, co2_sensor)
+    if co2_msg is not None:
+        payloads[SENSOR_SCD30] = co2_msg
+    if pysense_sensors is not None:
+        pysense_sensors.begin_cycle()
+        try:
+            si = pysense_sensors.get('si')
+            lt = pysense_sensors.get('lt')
+
+            temp, rh, _ = si.read_all()
+            rlux, blux = lt.light()
+
+            payloads[SENSOR_PYSENSE] = SCHEMAS[SENSOR_PYSENSE].pack_raw((temp, rh, rlux, blux))
+        except Exception as e:
+            # Bus error: drop the drivers, they are rebuilt on the next cycle
+            print(e)
+            pysense_sensors.invalidate()
+
+        print("Pysense cycle: {} ms (re-setup {} ms)".format(pysense_sensors.end_cycle(), pysense_sensors.cycle_setup_ms))
+
+    return payloads
+
+'''
+    queues one cycle worth of payloads and sends the queue
+    returns the number of uplinks
+'''
+def transmit(lora_socket, payloads):
+    # Send data
+    if using_mux:
+        try:
+            if using_quantized:
+                frames = pack_frames(quantize_payloads(payloads), max_payload(LORA_DR), MUX_VERSION)
+            else:
+                frames = pack_frames(payloads, max_payload(LORA_DR), MUX_VERSION_FLOAT)
+        except MuxError as e:
+            # A sample longer than an uplink at LORA_DR, the cycle is dropped
+            print("Cycle dropped: {}".format(e))
+            return flush_queue(lora_socket)
+        packets = [(MUX_PORT, frame) for frame in frames]
+    else:
+        packets = [(SCHEMAS[sensor_id].port, payloads[sensor_id]) for sensor_id in sorted(payloads)]
+
+    for port, pkt in packets:
+        # Over budget: this cycle's samples are dropped, not logged
+        if not airtime_allows(len(pkt)):
+            break
+        queue_frame(port, pkt, PRIORITY_SAMPLE)
+
+    return flush_queue(lora_socket)
+
+'''
+    adds one cycle of payloads to the per sensor batch buffers
+'''
+def buffer_samples(payloads):
+    for sensor_id, payload in quantize_payloads(payloads).items():
+        if sensor_id not in batches:
+            batches[sensor_id] = SampleBuffer(sensor_id, SCHEMAS[sensor_id], BATCH_CAPACITY)
+        batches[sensor_id].append(payload)
+
+'''
+    queues the batch buffers, as many frames as it takes to empty them, and sends the queue
+    returns False if the airtime budget held some back, they stay buffered
+'''
+def transmit_batches(lora_socket):
+    max_size = max_payload(LORA_DR)
+    for sensor_id in sorted(batches):
+        buf = batches[sensor_id]
+        if BATCH_MODE == BATCH_AGGREGATE and len(buf) and buf.aggregate_size() <= max_size:
+            if not airtime_allows(buf.aggregate_size()):
+                flush_queue(lora_socket)
+                return False
+            frame, n = buf.pack_aggregate(), len(buf)
+            queue_frame(MUX_PORT, frame, PRIORITY_BATCH)
+            buf.drop(n)
+        while len(buf):
+            try:
+                frame, n = buf.pack_delta(max_size)
+            except BatchError as e:
+                # A sample longer than an uplink at LORA_DR, its buffered samples are dropped
+                print("Batch dropped: {}".format(e))
+                buf.drop(len(buf))
+                break
+            if not airtime_allows(len(frame)):
+                flush_queue(lora_socket)
+                return False
+            queue_frame(MUX_PORT, frame, PRIORITY_BATCH)
+            buf.drop(n)
+
+    flush_queue(lora_socket)
+    return True
+
+'''
+    queues a frame, the frame the queue drops to make room goes to the backlog
+'''
+def queue_frame(port, pkt, priority):
+    dropped = tx_queue.push(port, pkt, priority)
+    if dropped is not None:
+        log_frame(*dropped)
+
+'''
+    keeps a frame in the flash backlog, if there is one and the frame fits its slots
+'''
+def log_frame(port, pkt):
+    if backlog is None:
+        return
+    if len(pkt) > BACKLOG_RECORD_SIZE:
+        print("Frame of {} bytes too long for the backlog, dropped".format(len(pkt)))
+        return
+    backlog.append(port, pkt)
+
+'''
+    sends up to TXQ_SENDS_PER_CYCLE due frames from the queue, frames given up go to the backlog
+    resends from the backlog once the queue is empty
+    returns the number of uplinks
+'''
+def flush_queue(lora_socket):
+    max_size = max_payload(LORA_DR)
+    ok = True
+    sent = 0
+    while sent < TXQ_SENDS_PER_CYCLE:
+        item = tx_queue.pop(max_size)
+        if item is None or not airtime_allows(len(item[1])):
+            break
+        port, pkt, entries = item
+        if len(pkt) > max_size:
+            # Packed before a remote change to a lower data rate
+            print("Frame of {} bytes too long for DR{}, dropped".format(len(pkt), LORA_DR))
+            tx_queue.discard(entries)
+            continue
+        ok = uplink(lora_socket, pkt, port)
+        sent += 1
+        for given_up in tx_queue.done(entries, ok):
+            log_frame(*given_up)
+        if not ok:
+            # The rest waits, retries included, until the link is back
+            break
+
+    return sent + resend_backlog(lora_socket, ok and not len(tx_queue))
+
+'''
+    moves the queued frames to the backlog, e.g. before a deep sleep clears RAM
+'''
+def park_queue():
+    for port, pkt in tx_queue.clear():
+        log_frame(port, pkt)
+    if backlog is not None:
+        backlog.flush()
+
+'''
+    prints the instrumentation summary, queues it as diagnostic uplinks with
+    using_diag_uplink, and starts a new period
+'''
+def report_instrumentation():
+    print("Instrumentation, last {} cycles:".format(INSTRUMENT_EVERY))
+    instrument.dump()
+    if using_diag_uplink:
+        for frame in instrument.pack(max_payload(LORA_DR)):
+            queue_frame(DIAG_PORT, frame, PRIORITY_DIAG)
+    instrument.reset()
+
+'''
+    True if an uplink of size bytes fits the airtime budget (always without using_airtime_budget)
+'''
+def airtime_allows(size):
+    if not using_airtime_budget or airtime.allows(airtime.predict_ms(size, LORA_DR)):
+        return True
+    airtime.deferred += 1
+    return False
+
+'''
+    resends one logged frame while the link works (ok: the last uplinks went through)
+    returns the number of uplinks
+'''
+def resend_backlog(lora_socket, ok):
+    sent = 0
+    if backlog is not None and ok and len(backlog):
+        record = backlog.peek()
+        if record is not None and len(record[2]) > max_payload(LORA_DR):
+            # Logged at a higher data rate than the current one
+            print("Backlog frame of {} bytes too long for DR{}, dropped".format(len(record[2]), LORA_DR))
+            backlog.ack(record[0])
+        elif record is not None and airtime_allows(len(record[2])):
+            seq, port, pkt = record
+            backlog.ack(seq)
+            if not uplink(lora_socket, pkt, port):
+                backlog.append(port, pkt)
+            sent += 1
+        if not len(backlog):
+            backlog.flush()
+    return sent
+
+'''
+    applies the configuration downlinks received since the last call, a frame
+    with a bad command is rejected as a whole (see lib/remote.py)
+    returns True if a downlink asked for a reboot
+'''
+def apply_downlinks(lora_socket):
+    reboot = False
+    while downlinks:
+        frame = downlinks.pop(0)
+        try:
+            commands = parse(frame)
+        except RemoteError as e:
+            config.rejected += 1
+            print("Config downlink rejected: {}".format(e))
+            continue
+
+        candidate = current_settings()
+        for op, name, value in commands:
+            if op == CMD_SET:
+                candidate[name] = value
+            elif op == CMD_DEFAULTS:
+                candidate.update(config.defaults)
+        # The sensors running now are sampled until the reboot
+        for name in BOOT_SETTINGS:
+            candidate[name] = candidate[name] or boot_sensors[name]
+        if not frames_fit(candidate):
+            config.rejected += 1
+            print("Config downlink rejected: samples do not fit DR{} uplinks".format(candidate['LORA_DR']))
+            continue
+
+        config.applied += 1
+        for op, name, value in commands:
+            if op == CMD_SET:
+                apply_setting(lora_socket, name, value)
+                config.save(name, value)
+            elif op == CMD_DEFAULTS:
+                for name, value in config.reset().items():
+                    apply_setting(lora_socket, name, value)
+            elif op == CMD_REPORT:
+                for report in pack_report(current_settings(), max_payload(LORA_DR)):
+                    queue_frame(CONFIG_PORT, report, PRIORITY_CONFIG)
+            elif op == CMD_REBOOT:
+                reboot = True
+    return reboot
+
+'''
+    the settings of lib/remote.py SETTINGS, {name: value}
+'''
+def current_settings():
+    return dict((name, globals()[name]) for name in KEYS)
+
+'''
+    True if one sample of every sensor enabled in settings fits an uplink at
+    their data rate, the packers refuse longer samples (MuxError, BatchError)
+'''
+def frames_fit(settings):
+    max_size = max_payload(settings['LORA_DR'])
+    for flag, sensor_id in SENSOR_FLAGS.items():
+        if not settings[flag]:
+            continue
+        schema = SCHEMAS[sensor_id]
+        if settings['using_batch']:
+            size = BATCH_HEADER_SIZE + schema.size
+        elif settings['using_mux']:
+            size = MUX_HEADER_SIZE + (schema.size if settings['using_quantized'] else schema.raw_size)
+        else:
+            size = schema.raw_size
+        if size > max_size:
+            return False
+    return True
+
+'''
+    changes one setting of lib/remote.py SETTINGS and what depends on it
+'''
+def apply_setting(lora_socket, name, value):
+    if globals()[name] == value:
+        return
+    print("Config: {} = {}".format(name, value))
+    globals()[name] = value
+
+    if name in BOOT_SETTINGS:
+        print("{} applies after a reboot".format(name))
+    elif name == 'LORA_DR':
+        if value == 4 and lora_radio is not None:
+            lora_radio.add_channel(65, frequency=904600000, dr_min=0, dr_max=4)
+        lora_socket.setsockopt(socket.SOL_LORA, socket.SO_DR, value)
+    elif name == 'AIRTIME_BUDGET_MS':
+        airtime.set_budget(value)
+    elif name == 'using_airtime_budget' and value:
+        airtime.refill()
+    elif name in SENSOR_PERIODS:
+        task, sensor_id = SENSOR_PERIODS[name]
+        if sensor_tasks is not None and task in sensor_tasks.stats:
+            sensor_tasks.stats[task].period_ms = value
+        if sensor_id in adaptive:
+            # The period is the adaptive minimum, the task follows it on the next change
+            adapt = adaptive[sensor_id]
+            adapt.min_ms = min(value, adapt.max_ms)
+
+'''
+    registry of the Pysense drivers, all built on one Pysense board instance
+'''
+def pysense_registry():
+    sensors = SensorRegistry()
+    sensors.register('py', lambda r: Pysense())
+    sensors.register('mp', lambda r: MPL3115A2(r.get('py'), mode=ALTITUDE)) # Returns height in meters. Mode may also be set to PRESSURE, returning a value in Pascals
+    sensors.register('si', lambda r: SI7006A20(r.get('py')))
+    sensors.register('lt', lambda r: LTR329ALS01(r.get('py')))
+    sensors.register('li', lambda r: LIS2HH12(r.get('py')))
+    return sensors
 
 '''
     utility function to setup the lora channels
@@ -133,35 +900,102 @@ def prepare_channels(lora, base_freq):
     call back for handling RX packets
 '''
 def lora_cb(lora):
+    global tx_failed, tx_done
     events = lora.events()
     if events & LoRa.RX_PACKET_EVENT:
         if lora_socket is not None:
             frame, port = lora_socket.recvfrom(512) # longuest frame is +-220
             print(port, frame)
+            if port == CONFIG_PORT:
+                # Applied by the main loop, not in the callback
+                downlinks.append(frame)
     if events & LoRa.TX_PACKET_EVENT:
         #print("tx_time_on_air: {} ms @ dr {}".format(lora.stats().tx_time_on_air, lora.stats().sftx))
         print("Frequency transmitted: {}".format(lora.stats().tx_frequency))
+        tx_done = True
     if events & LoRa.TX_FAILED_EVENT:
-        print("Failed to send packet")
+        tx_failed = True
+        tx_done = True
+        print("Failed to send packet, {} frames queued".format(len(tx_queue)))
+
+'''
+    sends a packet, returns False when the radio reports a failure
+'''
+def uplink(lora_socket, pkt, port):
+    global tx_failed, verify_session, first_uplink_ms, uplinks_since_save, lora_radio
+    tx_failed = False
+
+    confirm = verify_session
+    if confirm:
+        lora_socket.setsockopt(socket.SOL_LORA, socket.SO_CONFIRMED, True)
+    send_pkt(lora_socket, pkt, port)
+    if confirm:
+        lora_socket.setsockopt(socket.SOL_LORA, socket.SO_CONFIRMED, False)
+        verify_session = False
+
+    # Checkpoint the frame counter, it moves on failed uplinks as well
+    uplinks_since_save += 1
+    if uplinks_since_save >= LORA_SAVE_EVERY:
+        lora_radio.nvram_save()
+        uplinks_since_save = 0
+
+    if confirm and tx_failed:
+        # No ack for the restored session, the network rejected it
+        print("Restored LoRaWAN session rejected, joining again")
+        lora_radio.nvram_erase()
+        # A new LoRa object: the checkpoints and lora_cb move to it
+        lora_radio, _ = join_lora(restore=False)
+        register_callback(lora_radio)
+    elif first_uplink_ms is None and not tx_failed:
+        first_uplink_ms = time.ticks_ms()
+        print("First uplink {} ms after boot".format(first_uplink_ms))
+
+    return not tx_failed
 
 '''
     sending lora packet over a specific port
+    returns once the radio reports the end of the uplink, or after TX_TIMEOUT_MS
 '''
 def send_pkt(lora_socket, pkt, port):
+    global tx_done, tx_failed
+
     # LED while transmitting
     # SPS30: lime
     # SCD30: teal
     # Pysense: fuchsia
-    if port == 8:
+    # Multiplexed: white
+    if port == SCHEMAS[SENSOR_SPS30].port:
         pycom.rgbled(0x00FF00)
-    if port == 9:
+    if port == SCHEMAS[SENSOR_SCD30].port:
         pycom.rgbled(0x00FFFF)
-    if port == 10:
+    if port == SCHEMAS[SENSOR_PYSENSE].port:
         pycom.rgbled(0xFF00FF)
+    if port == MUX_PORT:
+        pycom.rgbled(0xFFFFFF)
+
+    tx_done = False
+    predicted_ms = airtime.predict_ms(len(pkt), LORA_DR)
+    timer = instrument.timer('send_pkt')
+    t0 = timer.start()
+    start = time.ticks_ms()
 
     lora_socket.bind(port)
     lora_socket.send(pkt)
-    time.sleep(5) # timer probably necessary.. idk how long tho
+
+    # Wait for lora_cb to report the end of the transmission
+    while not tx_done and time.ticks_diff(time.ticks_ms(), start) < TX_TIMEOUT_MS:
+        time.sleep_ms(TX_POLL_MS)
+
+    timed_out = not tx_done
+    if timed_out:
+        tx_failed = True
+        print("No TX event after {} ms".format(TX_TIMEOUT_MS))
+    airtime_ms = lora_radio.stats().tx_time_on_air
+    tx_stats.record(time.ticks_diff(time.ticks_ms(), start), airtime_ms, not tx_failed, timed_out)
+    airtime.record(predicted_ms, airtime_ms)
+    timer.stop(t0)
+    if tx_failed:
+        instrument.counter('tx.failed').add()
 
     # turn off LED
     pycom.rgbled(0)
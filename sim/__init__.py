@@ -0,0 +1,129 @@
+# Hardware-free simulator for bevo-pycom
+#
+# Runs main.py, sps30/scd30 and the lib/ drivers unchanged under CPython:
+#
+#   from sim import Simulation
+#
+#   sim = Simulation.default()
+#   with sim:
+#       from SI7006A20 import SI7006A20
+#       ...
+#       print(sim.i2c_stats(), sim.clock.now_us)
+#
+# asyncio.run() gets an event loop on the same virtual clock (sim/aio.py).
+#
+# Simulation.default() wires the boards as deployed: SPS30 and SCD30 on bus 1
+# (P10/P11), the Pysense PIC and its sensors on bus 0 (P22/P21), and a LoRa
+# radio. Time is virtual (see sim/clock.py), every I2C transaction is counted
+# and costs bus time, and faults can be injected on buses, devices and radio.
+#
+#   python -m sim [seconds]     runs main.main() for that much virtual time
+#   python -m sim --deepsleep   same in deep-sleep duty-cycle mode, booting
+#                               main again after every machine.deepsleep()
+
+from sim import platform, aio
+from sim.platform import SimDeepSleep, SimReset, PycomState
+
+# The device models share crc8 with the firmware
+platform.add_repo_paths()
+
+from sim.clock import SimClock, SimStop
+from sim.i2c import SimBus, I2C
+from sim.lora import SimRadio, LoRa, uplink_airtime_us, time_on_air_us
+from sim.devices import (SensirionSim, SI7006A20Sim, MPL3115A2Sim, LTR329ALS01Sim,
+                         LIS2HH12Sim, PycoprocSim)
+
+PYSENSE_BUS = 0
+SENSIRION_BUS = 1
+
+# machine.reset_cause() values
+PWRON_RESET = 0
+DEEPSLEEP_RESET = 3
+
+class Simulation:
+
+    def __init__(self, bus_latency_us=50, join_delay_s=5.0):
+        self.clock = SimClock()
+        self.buses = {
+            PYSENSE_BUS: SimBus(PYSENSE_BUS, self.clock, bus_latency_us),
+            SENSIRION_BUS: SimBus(SENSIRION_BUS, self.clock, bus_latency_us),
+        }
+        self.radio = SimRadio(self.clock, join_delay_s)
+        self.pycom = PycomState()
+        self.devices = {}
+        self.deepsleeps = []
+        self.reset_cause = 0
+        self._installed = False
+
+    @classmethod
+    def default(cls, **kwargs):
+        sim = cls(**kwargs)
+        sim.add_device('sps30', SENSIRION_BUS, SensirionSim(0x69, [2.5, 4.0, 5.1, 5.6, 15.0, 18.2, 18.9, 19.0, 19.1, 0.6], 1.0))
+        sim.add_device('scd30', SENSIRION_BUS, SensirionSim(0x61, [612.0, 22.4, 41.5], 2.0))
+        sim.add_device('pycoproc', PYSENSE_BUS, PycoprocSim())
+        sim.add_device('si7006a20', PYSENSE_BUS, SI7006A20Sim())
+        sim.add_device('mpl3115a2', PYSENSE_BUS, MPL3115A2Sim())
+        sim.add_device('ltr329als01', PYSENSE_BUS, LTR329ALS01Sim())
+        sim.add_device('lis2hh12', PYSENSE_BUS, LIS2HH12Sim())
+        return sim
+
+    def add_device(self, name, bus_id, device):
+        self.devices[name] = self.buses[bus_id].attach(device)
+        return device
+
+    def install(self):
+        """ installs the fake platform modules and the virtual clock """
+        I2C.buses = self.buses
+        LoRa.radio = self.radio
+        platform.install(self)
+        self.clock.install()
+        aio.install(self.clock)
+        self._installed = True
+        return self
+
+    def uninstall(self):
+        if self._installed:
+            aio.uninstall()
+            self.clock.uninstall()
+            platform.uninstall()
+            self._installed = False
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, *exc):
+        self.uninstall()
+        return False
+
+    def wake(self, ms):
+        """ sleeps through a deep sleep of ms and boots again. A Pysense PIC
+        sleep cuts the LoPy's power: the boot is a power-on reset, only a
+        machine.deepsleep() alone gives DEEPSLEEP_RESET """
+        self.clock.sleep_us(ms * 1000)
+        pic_sleep = any(isinstance(device, PycoprocSim) and device.asleep for device in self.devices.values())
+        self.reboot(PWRON_RESET if pic_sleep else DEEPSLEEP_RESET)
+
+    def reboot(self, reset_cause=PWRON_RESET):
+        """ RAM, ticks and the radio's joined state are lost, NVRAM, NVS, flash
+        and the sensors are kept. Import main again to run the new boot """
+        self.clock.reboot()
+        self.radio.joined = False
+        self.reset_cause = reset_cause
+        for device in self.devices.values():
+            if isinstance(device, PycoprocSim):
+                device.asleep = False
+        platform.forget_repo_modules()
+
+    def i2c_stats(self):
+        """ transactions, bytes and bus time summed over every bus """
+        total = {}
+        for bus in self.buses.values():
+            for key, value in bus.stats.as_dict().items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+    def reset_stats(self):
+        for bus in self.buses.values():
+            bus.stats.reset()
+        self.clock.slept_us = 0
+        self.clock.sleeps = 0
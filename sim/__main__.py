@@ -0,0 +1,54 @@
+# python -m sim [seconds] [--deepsleep]
+#
+# Runs main.main() against the default simulated boards for the given
+# virtual time (default 120 s) and prints what went over the bus and the air.
+# With --deepsleep main runs in its deep-sleep duty-cycle mode and is booted
+# again after every machine.deepsleep(), until the time is up.
+
+import importlib
+import os
+import sys
+import tempfile
+
+from sim import Simulation, SimStop, SimDeepSleep
+
+def _boot(tmp, deepsleep):
+    main = importlib.import_module('main')
+
+    # Keep flash files out of /flash
+    if hasattr(main, 'BACKLOG_PATH'):
+        main.BACKLOG_PATH = os.path.join(tmp, 'backlog.bin')
+    if deepsleep:
+        main.using_deepsleep = True
+    return main
+
+def run(seconds, deepsleep=False):
+    sim = Simulation.default()
+    with sim:
+        tmp = tempfile.mkdtemp(prefix='bevo-sim-')
+        sim.clock.stop_after(seconds)
+        try:
+            while True:
+                try:
+                    _boot(tmp, deepsleep).main()
+                    break
+                except SimDeepSleep as e:
+                    print("deepsleep {} ms at t={:.1f}s".format(e.ms, sim.clock.now_us / 1e6))
+                    if not deepsleep:
+                        break
+                    sim.wake(e.ms)
+        except SimStop:
+            pass
+
+        print("virtual time: {:.1f} s, slept {:.1f} s".format(sim.clock.now_us / 1e6, sim.clock.slept_us / 1e6))
+        print("i2c: {}".format(sim.i2c_stats()))
+        print("joins: {}, deep sleeps: {}".format(sim.radio.joins, len(sim.deepsleeps)))
+        print("uplinks: {}, airtime {:.1f} ms".format(len(sim.radio.uplinks), sim.radio.airtime_us / 1e3))
+        for uplink in sim.radio.uplinks:
+            print("  t={:.1f}s port={} len={} dr={} airtime={:.1f}ms ok={}".format(
+                uplink.t_us / 1e6, uplink.port, len(uplink.data), uplink.dr, uplink.airtime_us / 1e3, uplink.ok))
+    return sim
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    run(float(args[0]) if args else 120, '--deepsleep' in sys.argv)
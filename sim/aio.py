@@ -0,0 +1,50 @@
+# asyncio on the virtual clock
+#
+# The event loop's time() reads SimClock and its selector sleeps on it, so
+# asyncio.sleep() and call_later() advance virtual time like time.sleep().
+# Simulation.install() sets an event loop policy that hands out these loops,
+# so asyncio.run() in the firmware (lib/scheduler.py) uses one.
+
+import asyncio
+import math
+import selectors
+
+class VirtualSelector(selectors.DefaultSelector):
+
+    def __init__(self, clock):
+        selectors.DefaultSelector.__init__(self)
+        self._clock = clock
+
+    def select(self, timeout=None):
+        # Nothing in the loop wakes on I/O, only timers: sleep until the next one
+        if timeout is None:
+            timeout = 1.0
+        if timeout > 0:
+            # Round up: the loop's timers are float seconds, the clock counts whole us
+            self._clock.sleep_us(math.ceil(timeout * 1000000))
+        return selectors.DefaultSelector.select(self, 0)
+
+class VirtualEventLoop(asyncio.SelectorEventLoop):
+
+    def __init__(self, clock):
+        asyncio.SelectorEventLoop.__init__(self, VirtualSelector(clock))
+        self._clock = clock
+        self._clock_resolution = 1e-6
+
+    def time(self):
+        return self._clock.now_us / 1000000
+
+class VirtualLoopPolicy(asyncio.DefaultEventLoopPolicy):
+
+    def __init__(self, clock):
+        asyncio.DefaultEventLoopPolicy.__init__(self)
+        self._clock = clock
+
+    def new_event_loop(self):
+        return VirtualEventLoop(self._clock)
+
+def install(clock):
+    asyncio.set_event_loop_policy(VirtualLoopPolicy(clock))
+
+def uninstall():
+    asyncio.set_event_loop_policy(None)
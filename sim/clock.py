@@ -0,0 +1,184 @@
+# Virtual clock for the simulator
+#
+# Replaces time.sleep/sleep_ms/sleep_us and the MicroPython ticks_* helpers
+# so a simulated duty cycle runs in virtual time: sleeping advances the clock
+# instantly and fires any timers (radio events, conversions) that fall due.
+#
+# The thread that installed the clock drives time. Other threads (the
+# _thread sensor loops) block in sleep until the driver reaches their wake
+# time, and the driver waits for them to go back to sleep before moving on,
+# so events happen in virtual time order. Threads started with spawn() (the
+# simulated _thread.start_new_thread) count as running until their first sleep.
+
+import _thread
+import heapq
+import threading
+import time as _time
+
+TICKS_PERIOD = 1 << 30
+TICKS_MAX = TICKS_PERIOD - 1
+
+class SimStop(BaseException):
+    """ raised from sleep once the simulation reaches its stop time """
+    pass
+
+class SimClock:
+
+    def __init__(self):
+        self.now_us = 0
+        self.stop_us = None
+        # ticks_* count from the last boot, like on the board
+        self.boot_us = 0
+
+        # Stats
+        self.slept_us = 0
+        self.sleeps = 0
+
+        self._timers = []
+        self._timer_seq = 0
+        self._waiters = []
+        self._cond = threading.Condition()
+        self._running = 0
+        self._driver = threading.current_thread()
+        self._saved = None
+
+    def install(self):
+        """ patches the time module, undo with uninstall() """
+        names = ('sleep', 'sleep_ms', 'sleep_us', 'ticks_ms', 'ticks_us', 'ticks_cpu', 'ticks_diff', 'ticks_add')
+        self._saved = dict((name, getattr(_time, name, None)) for name in names)
+        self._driver = threading.current_thread()
+        _time.sleep = lambda s: self.sleep_us(int(s * 1000000))
+        _time.sleep_ms = lambda ms: self.sleep_us(int(ms) * 1000)
+        _time.sleep_us = self.sleep_us
+        _time.ticks_ms = lambda: ((self.now_us - self.boot_us) // 1000) & TICKS_MAX
+        _time.ticks_us = lambda: (self.now_us - self.boot_us) & TICKS_MAX
+        _time.ticks_cpu = _time.ticks_us
+        _time.ticks_diff = ticks_diff
+        _time.ticks_add = ticks_add
+
+    def uninstall(self):
+        if self._saved is None:
+            return
+        for name, fn in self._saved.items():
+            if fn is None:
+                if hasattr(_time, name):
+                    delattr(_time, name)
+            else:
+                setattr(_time, name, fn)
+        self._saved = None
+
+    def reboot(self):
+        """ restarts ticks_ms/ticks_us from 0 """
+        self.boot_us = self.now_us
+
+    def stop_after(self, seconds):
+        self.stop_us = self.now_us + int(seconds * 1000000)
+
+    def call_at(self, at_us, fn, *args):
+        """ runs fn(*args) in the driver thread once the clock reaches at_us """
+        self._timer_seq += 1
+        heapq.heappush(self._timers, (at_us, self._timer_seq, fn, args))
+
+    def call_later(self, delay_us, fn, *args):
+        self.call_at(self.now_us + int(delay_us), fn, *args)
+
+    def advance(self, us):
+        """ moves time forward without counting it as sleep (bus or CPU time) """
+        if us <= 0:
+            return
+        if threading.current_thread() is self._driver:
+            self._advance_to(self.now_us + int(us))
+        else:
+            # Worker threads only run between driver steps, timers stay with the driver
+            self.now_us += int(us)
+
+    def sleep_us(self, us):
+        us = max(int(us), 0)
+        if threading.current_thread() is self._driver:
+            start = self.now_us
+            self.sleeps += 1
+            try:
+                self._advance_to(start + us)
+            finally:
+                self.slept_us += self.now_us - start
+        else:
+            self._worker_sleep(self.now_us + us)
+
+    def spawn(self, fn, args=()):
+        """ _thread.start_new_thread: the driver waits for the new thread to sleep """
+        with self._cond:
+            self._running += 1
+
+        def run():
+            try:
+                fn(*args)
+            except SimStop:
+                pass
+            finally:
+                with self._cond:
+                    if self._running > 0:
+                        self._running -= 1
+                    self._cond.notify_all()
+
+        return _thread.start_new_thread(run, ())
+
+    def _advance_to(self, target):
+        self._settle()
+        while True:
+            due = None
+            if self._timers and self._timers[0][0] <= target:
+                due = self._timers[0][0]
+            if self._waiters and self._waiters[0][0] <= target and (due is None or self._waiters[0][0] < due):
+                due = self._waiters[0][0]
+            if due is None:
+                break
+
+            if self.stop_us is not None and due > self.stop_us:
+                break
+
+            self.now_us = max(self.now_us, due)
+            if self._timers and self._timers[0][0] <= due:
+                _, _, fn, args = heapq.heappop(self._timers)
+                fn(*args)
+            else:
+                self._release_waiters(due)
+
+        if self.stop_us is not None and target > self.stop_us:
+            self.now_us = max(self.now_us, self.stop_us)
+            raise SimStop()
+
+        self.now_us = max(self.now_us, target)
+
+    def _release_waiters(self, due):
+        with self._cond:
+            while self._waiters and self._waiters[0][0] <= due:
+                _, _, event = heapq.heappop(self._waiters)
+                event.set()
+                self._running += 1
+        self._settle()
+
+    def _settle(self):
+        # Let running threads go on until they sleep again (or give up after 1 s real time)
+        with self._cond:
+            deadline = _time.monotonic() + 1.0
+            while self._running > 0 and _time.monotonic() < deadline:
+                self._cond.wait(0.05)
+            self._running = 0
+
+    def _worker_sleep(self, wake):
+        event = threading.Event()
+        with self._cond:
+            self._timer_seq += 1
+            heapq.heappush(self._waiters, (wake, self._timer_seq, event))
+            if self._running > 0:
+                self._running -= 1
+            self._cond.notify_all()
+        while not event.wait(0.1):
+            if self.stop_us is not None and self.now_us >= self.stop_us:
+                raise SimStop()
+
+def ticks_diff(a, b):
+    return ((a - b + (TICKS_PERIOD >> 1)) & TICKS_MAX) - (TICKS_PERIOD >> 1)
+
+def ticks_add(a, b):
+    return (a + b) & TICKS_MAX
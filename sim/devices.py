@@ -0,0 +1,327 @@
+# Register-level models of the sensors on the bevo-pycom boards
+#
+# Each model answers the same byte sequences as the real chip, computes
+# crcs the same way and takes the datasheet conversion times on the
+# virtual clock, so the unmodified drivers can talk to it.
+#
+# Readings come from plain attributes (values, temperature, ...) that a
+# benchmark or test can change at any time.
+
+import errno
+import struct
+
+from crc8 import crc8
+
+class SimDevice:
+
+    def __init__(self, addr):
+        self.addr = addr
+        self.bus = None
+
+    @property
+    def now_us(self):
+        return self.bus.clock.now_us
+
+    def write(self, data):
+        raise OSError(errno.EIO, 'write not supported')
+
+    def read(self, n):
+        raise OSError(errno.EIO, 'read not supported')
+
+    def write_mem(self, reg, data):
+        raise OSError(errno.EIO, 'write_mem not supported')
+
+    def read_mem(self, reg, n):
+        raise OSError(errno.EIO, 'read_mem not supported')
+
+class RegisterDevice(SimDevice):
+    """ plain register file with auto-increment on burst reads """
+
+    def __init__(self, addr, size=256):
+        SimDevice.__init__(self, addr)
+        self.regs = bytearray(size)
+        self.auto_increment = True
+
+    def write_mem(self, reg, data):
+        for i in range(len(data)):
+            self.on_write(reg + i, data[i])
+
+    def read_mem(self, reg, n):
+        self.refresh()
+        if self.auto_increment:
+            return bytes(self.regs[reg + i] for i in range(n))
+        return bytes([self.regs[reg]] * n)
+
+    def on_write(self, reg, value):
+        self.regs[reg] = value
+
+    def refresh(self):
+        pass
+
+class SensirionSim(SimDevice):
+    """ SPS30 / SCD30 command interface """
+
+    def __init__(self, addr, values, measurement_interval=1.0):
+        SimDevice.__init__(self, addr)
+        self.values = list(values)
+        self.measurement_interval_us = int(measurement_interval * 1000000)
+        self.measuring = False
+        self.next_ready_us = None
+        self.samples_read = 0
+        self.ready_checks = 0
+        self._pointer = None
+        self._corrupt = 0
+
+    def corrupt_crc(self, count=1):
+        """ flips the crc of the next count reads """
+        self._corrupt += count
+
+    def _ready(self):
+        return self.measuring and self.now_us >= self.next_ready_us
+
+    def write(self, data):
+        cmd = bytes(data[0:2])
+        if cmd == b'\x00\x10':
+            if len(data) >= 5 and crc8(data, 2, 4) != data[4]:
+                raise OSError(errno.EIO, 'bad command crc')
+            self.measuring = True
+            self.next_ready_us = self.now_us + self.measurement_interval_us
+        elif cmd in (b'\x01\x04', b'\xD3\x04'):
+            self.measuring = False
+        self._pointer = cmd
+
+    def read(self, n):
+        if self._pointer == b'\x02\x02':
+            self.ready_checks += 1
+            words = struct.pack('>H', 1 if self._ready() else 0)
+        elif self._pointer == b'\x03\x00':
+            words = struct.pack('>{}f'.format(len(self.values)), *self.values)
+            if self._ready():
+                # Data consumed, next one at the following measurement interval
+                elapsed = self.now_us - self.next_ready_us
+                self.next_ready_us += (elapsed // self.measurement_interval_us + 1) * self.measurement_interval_us
+            self.samples_read += 1
+        else:
+            raise OSError(errno.EIO, 'no command pointer')
+
+        out = bytearray()
+        for i in range(0, len(words), 2):
+            out += words[i:i + 2]
+            out.append(crc8(words, i, i + 2))
+        if self._corrupt:
+            self._corrupt -= 1
+            out[2] ^= 0xFF
+
+        # Longer reads than the data set are padded with zero words
+        while len(out) < n:
+            out += b'\x00\x00' + bytes([crc8(b'\x00\x00')])
+        return bytes(out[:n])
+
+class SI7006A20Sim(SimDevice):
+
+    # Conversion times in us per user register resolution bits: (humidity, temperature)
+    CONVERSION_US = {0x00: (7500, 7000), 0x01: (2600, 2400), 0x80: (3700, 4000), 0x81: (5800, 1500)}
+
+    def __init__(self, addr=0x40, temperature=22.0, humidity=45.0):
+        SimDevice.__init__(self, addr)
+        self.temperature = temperature
+        self.humidity = humidity
+        self.user_reg = 0x3A
+        self.conversions = 0
+        self._ready_us = 0
+        self._response = b''
+        self._last_temp_code = 0
+        self._corrupt = 0
+
+    def corrupt_crc(self, count=1):
+        self._corrupt += count
+
+    def _temp_code(self):
+        return max(0, min(0xFFFC, int((self.temperature + 46.85) * 65536 / 175.72))) & 0xFFFC
+
+    def _humid_code(self):
+        return max(0, min(0xFFFC, int((self.humidity + 6.0) * 65536 / 125.0))) & 0xFFFC
+
+    def _word(self, code):
+        word = struct.pack('>H', code)
+        crc = crc8(word, 0, 2, 0x00)
+        if self._corrupt:
+            self._corrupt -= 1
+            crc ^= 0xFF
+        return word + bytes([crc])
+
+    def write(self, data):
+        cmd = data[0]
+        rh_us, t_us = self.CONVERSION_US[self.user_reg & 0x81]
+        if cmd == 0xF3:
+            self.conversions += 1
+            self._ready_us = self.now_us + t_us
+            self._response = self._word(self._temp_code())
+        elif cmd == 0xF5:
+            self.conversions += 1
+            self._ready_us = self.now_us + rh_us + t_us
+            self._last_temp_code = self._temp_code()
+            self._response = self._word(self._humid_code())
+        elif cmd == 0xE0:
+            self._response = struct.pack('>H', self._last_temp_code)
+        elif cmd == 0xE7:
+            self._response = bytes([self.user_reg])
+        elif cmd == 0xE6:
+            self.user_reg = data[1]
+        elif cmd == 0x84:
+            self._response = b'\x20'
+        elif cmd in (0xFA, 0xFC):
+            self._response = b'\x06\x00\x00\x00'
+        else:
+            self._response = b'\x00'
+
+    def read(self, n):
+        if self.now_us < self._ready_us:
+            # Conversion in progress, the chip NACKs its address
+            raise OSError(errno.EIO, 'NACK, conversion in progress')
+        return (self._response + bytes(n))[:n]
+
+class MPL3115A2Sim(RegisterDevice):
+
+    def __init__(self, addr=0x60, pressure=101325.0, altitude=150.0, temperature=22.5, conversion_us=512000):
+        RegisterDevice.__init__(self, addr, 0x30)
+        self.pressure = pressure
+        self.altitude = altitude
+        self.temperature = temperature
+        self.conversion_us = conversion_us
+        self.regs[0x0C] = 0xC4
+        self._ready_us = None
+
+    def on_write(self, reg, value):
+        self.regs[reg] = value
+        if reg == 0x26 and value & 0x01:
+            # Active: first data after one full oversampled conversion
+            self._ready_us = self.now_us + self.conversion_us
+
+    def refresh(self):
+        regs = self.regs
+        if self._ready_us is None or self.now_us < self._ready_us:
+            regs[0x00] = 0
+            return
+        regs[0x00] = 0x0E
+        if regs[0x26] & 0x80:
+            code = int(self.altitude * 16) & 0xFFFFF
+        else:
+            code = int(self.pressure * 4) & 0xFFFFF
+        regs[0x01] = (code >> 12) & 0xFF
+        regs[0x02] = (code >> 4) & 0xFF
+        regs[0x03] = (code << 4) & 0xF0
+        temp = int(self.temperature * 256) & 0xFFFF
+        regs[0x04] = temp >> 8
+        regs[0x05] = temp & 0xF0
+
+class LTR329ALS01Sim(RegisterDevice):
+
+    def __init__(self, addr=0x29, ch0=120, ch1=80):
+        RegisterDevice.__init__(self, addr)
+        self.ch0 = ch0
+        self.ch1 = ch1
+        self.regs[0x86] = 0xA0
+        self.regs[0x87] = 0x05
+
+    def refresh(self):
+        struct.pack_into('<HH', self.regs, 0x88, self.ch1, self.ch0)
+
+class LIS2HH12Sim(RegisterDevice):
+
+    SCALES = {0: 4000, 2: 8000, 3: 16000}
+
+    def __init__(self, addr=30, acceleration=(0.0, 0.0, 1.0)):
+        RegisterDevice.__init__(self, addr)
+        self.acceleration = acceleration
+        self.regs[0x0F] = 0x41
+        self.regs[0x20] = 0x07
+        self.regs[0x23] = 0x04
+
+    def read_mem(self, reg, n):
+        # CTRL4 IF_ADD_INC
+        self.auto_increment = bool(self.regs[0x23] & 0x04)
+        return RegisterDevice.read_mem(self, reg, n)
+
+    def refresh(self):
+        scale = self.SCALES.get((self.regs[0x23] >> 4) & 0x03, 4000)
+        raw = [max(-32768, min(32767, int(g * 1000 * 65536 / scale))) for g in self.acceleration]
+        struct.pack_into('<hhh', self.regs, 0x28, *raw)
+
+class PycoprocSim(SimDevice):
+    """ Pysense PIC: command protocol, memory peek/poke/magic, ADC and sleep """
+
+    CMD_PEEK = 0x00
+    CMD_POKE = 0x01
+    CMD_MAGIC = 0x02
+    CMD_HW_VER = 0x10
+    CMD_FW_VER = 0x11
+    CMD_PROD_ID = 0x12
+    CMD_SETUP_SLEEP = 0x20
+    CMD_GO_SLEEP = 0x21
+    CMD_CALIBRATE = 0x22
+
+    ADCON0_ADDR = 0x9D
+    ADRESL_ADDR = 0x9B
+    ADRESH_ADDR = 0x9C
+
+    def __init__(self, addr=8, hw_version=3, fw_version=13, product_id=0xEF99, battery_voltage=4.1, busy_reads=1):
+        SimDevice.__init__(self, addr)
+        self.hw_version = hw_version
+        self.fw_version = fw_version
+        self.product_id = product_id
+        self.battery_voltage = battery_voltage
+        self.busy_reads = busy_reads
+        self.memory = {}
+        self.commands = 0
+        self.sleep_time_s = None
+        self.asleep = False
+        self.on_sleep = None
+        self._busy = 0
+        self._response = b''
+
+    def write(self, data):
+        self.commands += 1
+        cmd = data[0]
+        self._busy = self.busy_reads
+        self._response = b''
+
+        if cmd == self.CMD_PEEK:
+            self._response = bytes([self._peek(data[1] | (data[2] << 8))])
+        elif cmd == self.CMD_POKE:
+            self._poke(data[1] | (data[2] << 8), data[3])
+        elif cmd == self.CMD_MAGIC:
+            addr = data[1] | (data[2] << 8)
+            self._poke(addr, ((self._peek(addr) & data[3]) | data[4]) ^ data[5])
+            self._response = bytes([self._peek(addr)])
+        elif cmd == self.CMD_HW_VER:
+            self._response = struct.pack('<H', self.hw_version)
+        elif cmd == self.CMD_FW_VER:
+            self._response = struct.pack('<H', self.fw_version)
+        elif cmd == self.CMD_PROD_ID:
+            self._response = struct.pack('<H', self.product_id)
+        elif cmd == self.CMD_SETUP_SLEEP:
+            self.sleep_time_s = data[1] | (data[2] << 8) | (data[3] << 16)
+        elif cmd == self.CMD_GO_SLEEP:
+            self.asleep = True
+            if self.on_sleep is not None:
+                self.on_sleep(self.sleep_time_s)
+
+    def read(self, n):
+        if self._busy > 0:
+            self._busy -= 1
+            return bytes(n)
+        return (b'\xFF' + self._response + bytes(n))[:n]
+
+    def _peek(self, addr):
+        return self.memory.get(addr, 0)
+
+    def _poke(self, addr, value):
+        value &= 0xFF
+        if addr == self.ADCON0_ADDR and value & 0x02:
+            # Conversion finishes at once
+            value &= ~0x02
+            adc = int((self.battery_voltage - 0.01) * 180 * 1023 / (3.3 * 280))
+            self.memory[self.ADRESH_ADDR] = (adc >> 2) & 0xFF
+            self.memory[self.ADRESL_ADDR] = (adc & 0x03) << 6
+        self.memory[addr] = value
@@ -0,0 +1,137 @@
+# Simulated I2C buses and the machine.I2C fake
+#
+# A SimBus holds the devices attached to one bus id, keyed by address, and
+# counts every transaction. machine.I2C objects created for the same bus id
+# share its SimBus, like the real peripheral.
+#
+# Each transaction costs base_latency_us plus 9 bit times per byte at the
+# I2C object's baudrate on the virtual clock. inject_fault() makes the next
+# matching transactions raise OSError like a NACK or bus error would.
+
+import errno
+
+class BusStats:
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.transactions = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.bus_time_us = 0
+        self.errors = 0
+        self.per_address = {}
+
+    def as_dict(self):
+        return {
+            'transactions': self.transactions,
+            'bytes_written': self.bytes_written,
+            'bytes_read': self.bytes_read,
+            'bus_time_us': self.bus_time_us,
+            'errors': self.errors,
+        }
+
+class SimBus:
+
+    def __init__(self, bus_id, clock, base_latency_us=50):
+        self.bus_id = bus_id
+        self.clock = clock
+        self.base_latency_us = base_latency_us
+        self.devices = {}
+        self.stats = BusStats()
+        self._faults = []
+        self.trace = None
+
+    def attach(self, device):
+        device.bus = self
+        self.devices[device.addr] = device
+        return device
+
+    def inject_fault(self, addr=None, count=1, err=errno.EIO):
+        """ next count transactions (to addr, or any address) raise OSError(err) """
+        self._faults.append([addr, count, err])
+
+    def transaction(self, addr, n_written, n_read, baudrate):
+        """ accounts for one transaction and returns the device, raising on faults """
+        n_bytes = 1 + n_written + n_read
+        bus_us = self.base_latency_us + (n_bytes * 9 * 1000000) // baudrate
+
+        stats = self.stats
+        stats.transactions += 1
+        stats.bytes_written += n_written
+        stats.bytes_read += n_read
+        stats.bus_time_us += bus_us
+        stats.per_address[addr] = stats.per_address.get(addr, 0) + 1
+        if self.trace is not None:
+            self.trace.append((self.clock.now_us, addr, n_written, n_read))
+
+        self.clock.advance(bus_us)
+
+        for fault in self._faults:
+            if fault[0] is None or fault[0] == addr:
+                fault[1] -= 1
+                if fault[1] <= 0:
+                    self._faults.remove(fault)
+                stats.errors += 1
+                raise OSError(fault[2], 'I2C bus error')
+
+        device = self.devices.get(addr)
+        if device is None:
+            stats.errors += 1
+            raise OSError(errno.ENODEV, 'I2C device not found')
+        return device
+
+class I2C:
+
+    MASTER = 0
+    SLAVE = 1
+
+    # Set by the simulation, bus id -> SimBus
+    buses = {}
+
+    def __init__(self, bus=0, mode=MASTER, pins=None, baudrate=100000):
+        self.init(mode, pins=pins, baudrate=baudrate, bus=bus)
+
+    def init(self, mode=MASTER, pins=None, baudrate=100000, bus=None):
+        if bus is not None:
+            self._bus = I2C.buses[bus]
+        self.pins = pins
+        self.baudrate = baudrate
+
+    def deinit(self):
+        pass
+
+    def scan(self):
+        return sorted(self._bus.devices)
+
+    def writeto(self, addr, buf, stop=True):
+        buf = _as_bytes(buf)
+        self._bus.transaction(addr, len(buf), 0, self.baudrate).write(buf)
+        return len(buf)
+
+    def readfrom(self, addr, nbytes, stop=True):
+        return bytes(self._bus.transaction(addr, 0, nbytes, self.baudrate).read(nbytes))
+
+    def readfrom_into(self, addr, buf, stop=True):
+        data = self._bus.transaction(addr, 0, len(buf), self.baudrate).read(len(buf))
+        buf[:] = data
+        return None
+
+    def writeto_mem(self, addr, memaddr, buf, addrsize=8):
+        buf = _as_bytes(buf)
+        self._bus.transaction(addr, len(buf) + 1, 0, self.baudrate).write_mem(memaddr, buf)
+        return len(buf)
+
+    def readfrom_mem(self, addr, memaddr, nbytes, addrsize=8):
+        return bytes(self._bus.transaction(addr, 1, nbytes, self.baudrate).read_mem(memaddr, nbytes))
+
+    def readfrom_mem_into(self, addr, memaddr, buf, addrsize=8):
+        data = self._bus.transaction(addr, 1, len(buf), self.baudrate).read_mem(memaddr, len(buf))
+        buf[:] = data
+        return None
+
+def _as_bytes(buf):
+    if isinstance(buf, int):
+        return bytes([buf & 0xFF])
+    return bytes(buf)
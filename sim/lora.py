@@ -0,0 +1,257 @@
+# Simulated LoRaWAN radio: network.LoRa and the AF_LORA socket
+#
+# Uplinks take their LoRa time-on-air (computed from the data rate and the
+# frame length) on the virtual clock, then raise TX_PACKET_EVENT, or
+# TX_FAILED_EVENT when a failure was injected, through the callback
+# registered with LoRa.callback(). Downlinks can be queued with
+# inject_downlink() and raise RX_PACKET_EVENT.
+
+import math
+import errno
+from collections import namedtuple
+
+# LoRaWAN overhead on top of the application payload: MHDR, FHDR, FPort, MIC
+LORAWAN_OVERHEAD = 13
+
+# US915 uplink data rates: DR -> (spreading factor, bandwidth kHz)
+US915_DATA_RATES = {0: (10, 125), 1: (9, 125), 2: (8, 125), 3: (7, 125), 4: (8, 500)}
+
+def time_on_air_us(phy_len, sf, bw_khz, cr=1, preamble=8, header=True, crc=True):
+    """ LoRa modem time-on-air (Semtech AN1200.13) for phy_len bytes """
+    t_sym = (1 << sf) * 1000.0 / bw_khz
+    de = 1 if t_sym > 16000 else 0
+    ih = 0 if header else 1
+    num = 8 * phy_len - 4 * sf + 28 + (16 if crc else 0) - 20 * ih
+    n_payload = 8 + max(math.ceil(num / (4.0 * (sf - 2 * de))) * (cr + 4), 0)
+    return int((preamble + 4.25 + n_payload) * t_sym)
+
+def uplink_airtime_us(payload_len, dr, data_rates=US915_DATA_RATES):
+    sf, bw = data_rates[dr]
+    return time_on_air_us(payload_len + LORAWAN_OVERHEAD, sf, bw)
+
+LoRaStats = namedtuple('LoRaStats', ('rx_timestamp', 'rssi', 'snr', 'sfrx', 'sftx', 'tx_trials',
+                                     'tx_power', 'tx_time_on_air', 'tx_counter', 'tx_frequency'))
+
+class Uplink:
+
+    def __init__(self, t_us, port, data, dr, airtime_us, ok):
+        self.t_us = t_us
+        self.port = port
+        self.data = data
+        self.dr = dr
+        self.airtime_us = airtime_us
+        self.ok = ok
+
+class SimRadio:
+    """ state shared by every LoRa object and socket of one simulation """
+
+    def __init__(self, clock, join_delay_s=5.0):
+        self.clock = clock
+        self.join_delay_us = int(join_delay_s * 1000000)
+        self.joined = False
+        self.joins = 0
+        self.channels = {}
+        self.handler = None
+        self.trigger = 0
+        self.events = 0
+        self.uplinks = []
+        self.downlinks = []
+        self.busy_until_us = 0
+        self.nvram = None
+        self.nvram_saves = 0
+        # Network side: a restored session is dropped when reject_session is set,
+        # and uplinks whose frame counter is not above the last one are replays
+        self.reject_session = False
+        self.session_valid = False
+        self.network_fcnt = 0
+        self.fcnt_up = 0
+        self._fail = 0
+        self._channel_index = 0
+        self._last_airtime_us = 0
+        self._last_sf = 0
+        self._last_frequency = 0
+
+    def fail_next(self, count=1):
+        """ next count uplinks end with TX_FAILED_EVENT """
+        self._fail += count
+
+    def inject_downlink(self, port, data):
+        self.downlinks.append((bytes(data), port))
+        self._raise(LoRa.RX_PACKET_EVENT)
+
+    @property
+    def airtime_us(self):
+        return sum(u.airtime_us for u in self.uplinks)
+
+    def transmit(self, port, data, dr, confirmed=False):
+        if not self.joined:
+            raise OSError(errno.ENETDOWN, 'not joined')
+        now = self.clock.now_us
+        airtime = uplink_airtime_us(len(data), dr)
+        sent = self._fail == 0
+        if not sent:
+            self._fail -= 1
+
+        freqs = sorted(self.channels.values())
+        if freqs:
+            self._last_frequency = freqs[self._channel_index % len(freqs)]
+            self._channel_index += 1
+        self._last_airtime_us = airtime
+        self._last_sf = US915_DATA_RATES[dr][0]
+        self.fcnt_up += 1
+
+        # ok: the network accepted it. Only confirmed uplinks tell the device
+        ok = sent and self.session_valid and self.fcnt_up > self.network_fcnt
+        if ok:
+            self.network_fcnt = self.fcnt_up
+        event_ok = ok if confirmed else sent
+
+        start = max(now, self.busy_until_us)
+        self.busy_until_us = start + airtime
+        self.uplinks.append(Uplink(now, port, bytes(data), dr, airtime, ok))
+        self.clock.call_at(self.busy_until_us, self._raise, LoRa.TX_PACKET_EVENT if event_ok else LoRa.TX_FAILED_EVENT)
+
+    def _raise(self, event):
+        self.events |= event
+        if self.handler is not None and self.trigger & event:
+            self.handler(LoRa._instance)
+
+    def _joined(self):
+        self.joined = True
+        self.session_valid = True
+        self.network_fcnt = 0
+
+class LoRa:
+
+    LORA = 0
+    LORAWAN = 1
+
+    EU868 = 5
+    US915 = 8
+    AS923 = 0
+    AU915 = 1
+
+    CLASS_A = 0
+    CLASS_C = 2
+
+    OTAA = 0
+    ABP = 1
+
+    BW_125KHZ = 0
+    BW_250KHZ = 1
+    BW_500KHZ = 2
+
+    CODING_4_5 = 1
+
+    RX_PACKET_EVENT = 1
+    TX_PACKET_EVENT = 2
+    TX_FAILED_EVENT = 4
+
+    # Set by the simulation
+    radio = None
+    _instance = None
+
+    def __init__(self, mode=LORAWAN, region=US915, device_class=CLASS_A, **kwargs):
+        LoRa._instance = self
+        self.mode = mode
+        self.region = region
+        self.device_class = device_class
+
+    def join(self, activation=OTAA, auth=None, timeout=None, dr=None):
+        radio = LoRa.radio
+        radio.joined = False
+        radio.joins += 1
+        radio.fcnt_up = 0
+        radio.clock.call_later(radio.join_delay_us, radio._joined)
+
+    def has_joined(self):
+        return LoRa.radio.joined
+
+    def add_channel(self, index, frequency=None, dr_min=0, dr_max=3):
+        LoRa.radio.channels[index] = frequency
+
+    def remove_channel(self, index):
+        LoRa.radio.channels.pop(index, None)
+
+    def callback(self, trigger=0, handler=None, arg=None):
+        LoRa.radio.trigger = trigger
+        LoRa.radio.handler = handler
+
+    def events(self):
+        radio = LoRa.radio
+        events = radio.events
+        radio.events = 0
+        return events
+
+    def stats(self):
+        radio = LoRa.radio
+        return LoRaStats(0, -80, 7.0, 0, radio._last_sf, 1, 20, radio._last_airtime_us // 1000,
+                         radio.fcnt_up, radio._last_frequency)
+
+    def nvram_save(self):
+        radio = LoRa.radio
+        radio.nvram_saves += 1
+        radio.nvram = {'joined': radio.joined, 'fcnt_up': radio.fcnt_up}
+
+    def nvram_restore(self):
+        radio = LoRa.radio
+        if radio.nvram is not None:
+            radio.joined = radio.nvram['joined']
+            radio.fcnt_up = radio.nvram['fcnt_up']
+            if radio.reject_session:
+                radio.session_valid = False
+
+    def nvram_erase(self):
+        LoRa.radio.nvram = None
+
+    def mac(self):
+        return b'\x70\xB3\xD5\x49\x94\xCB\xFE\xDA'
+
+class LoRaSocket:
+
+    def __init__(self):
+        self.port = 1
+        self.dr = 0
+        self.confirmed = False
+        self.blocking = True
+        self.sent = 0
+
+    def setsockopt(self, level, option, value):
+        if option == SO_DR:
+            self.dr = value
+        elif option == SO_CONFIRMED:
+            self.confirmed = bool(value)
+
+    def setblocking(self, flag):
+        self.blocking = flag
+
+    def settimeout(self, value):
+        self.blocking = value is None
+
+    def bind(self, port):
+        self.port = port
+
+    def send(self, data):
+        LoRa.radio.transmit(self.port, data, self.dr, self.confirmed)
+        self.sent += 1
+        return len(data)
+
+    def recvfrom(self, n):
+        radio = LoRa.radio
+        if radio.downlinks:
+            data, port = radio.downlinks.pop(0)
+            return (data[:n], port)
+        return (b'', None)
+
+    def recv(self, n):
+        return self.recvfrom(n)[0]
+
+    def close(self):
+        pass
+
+# socket module constants for AF_LORA
+AF_LORA = 160
+SOCK_RAW = 3
+SOL_LORA = 0x10001
+SO_DR = 0x10003
+SO_CONFIRMED = 0x10002
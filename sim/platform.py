@@ -0,0 +1,267 @@
+# Fake MicroPython / Pycom platform modules for CPython
+#
+# install() puts machine, pycom, network, micropython, _thread and the u*
+# aliases in sys.modules, wraps socket so socket.socket(AF_LORA, ...) returns a
+# simulated LoRa socket, and adds a const() builtin.
+#
+# MicroPython folds X = const(...) at compile time, so the Pycom drivers use
+# constants declared in a class body as bare names in their methods. The
+# ConstHoistFinder mimics that: after a repo module is imported, upper case
+# and _private int attributes of its classes are copied to the module globals.
+
+import _thread as _real_thread
+import builtins
+import binascii
+import importlib.abc
+import importlib.machinery
+import os
+import socket as _socket
+import struct
+import sys
+import time
+import types
+
+from sim.i2c import I2C
+from sim.lora import LoRa, LoRaSocket, AF_LORA, SOCK_RAW, SOL_LORA, SO_DR, SO_CONFIRMED
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_PATHS = [REPO_ROOT, os.path.join(REPO_ROOT, 'lib')]
+
+class SimDeepSleep(BaseException):
+    """ raised by machine.deepsleep(), the board would power down here """
+
+    def __init__(self, ms):
+        BaseException.__init__(self, ms)
+        self.ms = ms
+
+class SimReset(BaseException):
+    """ raised by machine.reset() """
+    pass
+
+class PycomState:
+
+    def __init__(self):
+        self.heartbeat = True
+        self.rgbled = 0
+        self.rgb_changes = 0
+        self.nvs = {}
+
+class Pin:
+
+    IN = 1
+    OUT = 2
+    OPEN_DRAIN = 3
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 1
+    IRQ_RISING = 2
+
+    def __init__(self, id, mode=IN, pull=None, value=None):
+        self.id = id
+        self.mode = mode
+        self._value = value or 0
+        self.handler = None
+
+    def __call__(self, value=None):
+        return self.value(value)
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        self._value = value
+
+    def callback(self, trigger=0, handler=None, arg=None):
+        self.handler = handler
+
+# Simulation the fake modules talk to, set by install()
+_current = [None]
+
+def current():
+    return _current[0]
+
+def _make_machine():
+    machine = types.ModuleType('machine')
+    machine.I2C = I2C
+    machine.Pin = Pin
+    machine.PWRON_RESET = 0
+    machine.HARD_RESET = 1
+    machine.WDT_RESET = 2
+    machine.DEEPSLEEP_RESET = 3
+    machine.SOFT_RESET = 4
+
+    def deepsleep(ms=0):
+        current().deepsleeps.append(ms)
+        raise SimDeepSleep(ms)
+
+    def reset():
+        raise SimReset()
+
+    machine.deepsleep = deepsleep
+    machine.reset = reset
+    machine.reset_cause = lambda: current().reset_cause
+    machine.unique_id = lambda: b'\x30\xae\xa4\x00\x00\x01'
+    machine.idle = lambda: None
+    return machine
+
+def _make_pycom():
+    pycom = types.ModuleType('pycom')
+    state = lambda: current().pycom
+
+    def heartbeat(on=None):
+        if on is None:
+            return state().heartbeat
+        state().heartbeat = on
+
+    def rgbled(color):
+        state().rgbled = color
+        state().rgb_changes += 1
+
+    _missing = object()
+
+    def nvs_get(key, default=_missing):
+        nvs = state().nvs
+        if key in nvs:
+            return nvs[key]
+        if default is _missing:
+            raise ValueError('key not found')
+        return default
+
+    def nvs_set(key, value):
+        state().nvs[key] = value
+
+    def nvs_erase(key):
+        state().nvs.pop(key, None)
+
+    def nvs_erase_all():
+        state().nvs.clear()
+
+    pycom.heartbeat = heartbeat
+    pycom.rgbled = rgbled
+    pycom.nvs_get = nvs_get
+    pycom.nvs_set = nvs_set
+    pycom.nvs_erase = nvs_erase
+    pycom.nvs_erase_all = nvs_erase_all
+    pycom.pulses_get = lambda pin, timeout: []
+    return pycom
+
+def _make_network():
+    network = types.ModuleType('network')
+    network.LoRa = LoRa
+    return network
+
+def _make_socket():
+    sock = types.ModuleType('socket')
+
+    def socket(family=_socket.AF_INET, type=_socket.SOCK_STREAM, proto=0):
+        if family == AF_LORA:
+            return LoRaSocket()
+        return _socket.socket(family, type, proto)
+
+    sock.socket = socket
+    sock.AF_LORA = AF_LORA
+    sock.SOCK_RAW = SOCK_RAW
+    sock.SOL_LORA = SOL_LORA
+    sock.SO_DR = SO_DR
+    sock.SO_CONFIRMED = SO_CONFIRMED
+    sock.__getattr__ = lambda name: getattr(_socket, name)
+    return sock
+
+def _make_micropython():
+    micropython = types.ModuleType('micropython')
+    micropython.const = lambda x: x
+    micropython.native = lambda f: f
+    micropython.viper = lambda f: f
+    micropython.mem_info = lambda *args: None
+    micropython.alloc_emergency_exception_buf = lambda n: None
+    return micropython
+
+def _make_thread():
+    thread = types.ModuleType('_thread')
+    thread.start_new_thread = lambda fn, args, kwargs=None: current().clock.spawn(fn, args)
+    thread.__getattr__ = lambda name: getattr(_real_thread, name)
+    return thread
+
+def hoist_consts(module):
+    """ copies upper case or _private int class attributes to the module globals, like const() """
+    for obj in list(vars(module).values()):
+        if isinstance(obj, type) and obj.__module__ == module.__name__:
+            for name, value in vars(obj).items():
+                if (isinstance(value, int) and not isinstance(value, bool)
+                        and (name.upper() == name or name[0] == '_') and not name.startswith('__')
+                        and name not in vars(module)):
+                    setattr(module, name, value)
+
+class _HoistingLoader(importlib.abc.Loader):
+
+    def __init__(self, loader):
+        self._loader = loader
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._loader.exec_module(module)
+        hoist_consts(module)
+
+class ConstHoistFinder(importlib.abc.MetaPathFinder):
+
+    def find_spec(self, name, path, target=None):
+        if '.' in name:
+            return None
+        spec = importlib.machinery.PathFinder.find_spec(name, REPO_PATHS)
+        if spec is None or spec.loader is None or not spec.origin or not spec.origin.endswith('.py'):
+            return None
+        if spec.submodule_search_locations is not None:
+            return None
+        spec.loader = _HoistingLoader(spec.loader)
+        return spec
+
+_saved = {}
+_finder = ConstHoistFinder()
+
+def add_repo_paths():
+    """ makes the repo root (main, sps30, scd30) and lib/ importable """
+    for path in reversed(REPO_PATHS):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+
+def forget_repo_modules():
+    """ drops imported repo modules so the next import runs them again, as after a boot """
+    for name, module in list(sys.modules.items()):
+        path = getattr(module, '__file__', None) or ''
+        if os.path.dirname(os.path.abspath(path)) in REPO_PATHS and path.endswith('.py'):
+            del sys.modules[name]
+
+def install(sim):
+    _current[0] = sim
+    builtins.const = lambda x: x
+    add_repo_paths()
+
+    modules = {
+        'machine': _make_machine(),
+        'pycom': _make_pycom(),
+        'network': _make_network(),
+        'socket': _make_socket(),
+        'micropython': _make_micropython(),
+        '_thread': _make_thread(),
+        'ubinascii': binascii,
+        'ustruct': struct,
+        'utime': time,
+    }
+    for name, module in modules.items():
+        if name not in _saved:
+            _saved[name] = sys.modules.get(name)
+        sys.modules[name] = module
+
+    if _finder not in sys.meta_path:
+        sys.meta_path.insert(0, _finder)
+
+def uninstall():
+    for name, module in _saved.items():
+        if module is None:
+            sys.modules.pop(name, None)
+        else:
+            sys.modules[name] = module
+    _saved.clear()
+    if _finder in sys.meta_path:
+        sys.meta_path.remove(_finder)
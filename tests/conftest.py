@@ -0,0 +1,22 @@
+# pytest setup: the repo root and lib/ importable, as on the board, and a
+# sim fixture for tests that need the platform modules or the virtual clock
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sim import Simulation, platform
+
+platform.add_repo_paths()
+
+@pytest.fixture
+def sim():
+    """ Simulation.default() installed for one test, repo modules imported again afterwards """
+    platform.forget_repo_modules()
+    s = Simulation.default()
+    with s:
+        yield s
+    platform.forget_repo_modules()
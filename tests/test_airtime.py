@@ -0,0 +1,69 @@
+# lib/airtime.py: time on air, token pacing, the 24 h ledger, restore across sleeps
+
+import pytest
+
+from airtime import AirtimeBudget, AirtimeError, time_on_air_ms, DAY_MS
+
+@pytest.mark.parametrize('payload_len, dr, region, ms', [
+    # Semtech LoRa calculator, 13 bytes of LoRaWAN overhead added
+    (11, 0, 'US915', 370.688),
+    (11, 0, 'EU868', 1482.752),
+    (51, 3, 'US915', 118.016),
+])
+def test_time_on_air(payload_len, dr, region, ms):
+    assert time_on_air_ms(payload_len, dr, region) == pytest.approx(ms)
+
+def test_unknown_data_rate():
+    with pytest.raises(AirtimeError):
+        time_on_air_ms(11, 5, 'US915')
+
+def test_pacing(sim):
+    budget = AirtimeBudget(30000)
+    assert budget.burst_ms == 1250
+    for _ in range(3):
+        assert budget.allows(370)
+        budget.record(370)
+    assert not budget.allows(370)
+
+    # The missing 230 ms at 30 s per 24 h
+    wait_ms = budget.wait_ms(370)
+    assert wait_ms == 230 * DAY_MS // 30000
+    sim.clock.advance((wait_ms - 1000) * 1000)
+    assert not budget.allows(370)
+    sim.clock.advance(1000 * 1000)
+    assert budget.allows(370)
+
+def test_debt_bounded(sim):
+    budget = AirtimeBudget(30000)
+    budget.record(5000)
+    assert budget.tokens_ms == -budget.burst_ms
+    assert budget.used_ms() == 5000
+
+def test_ledger_cap(sim):
+    budget = AirtimeBudget(3000)
+    # Sent while nothing paced it, the whole day's budget
+    budget.record(3000)
+    sim.clock.advance(4 * 3600 * 10**6)
+    assert not budget.allows(10)
+    assert budget.tokens_ms == budget.burst_ms
+
+    # Out of the ledger a day later
+    sim.clock.advance((DAY_MS - 4 * 3600 * 1000) * 1000)
+    assert budget.used_ms() == 0
+    assert budget.allows(10)
+
+def test_restore_across_sleeps(sim):
+    # Duty-cycle mode: a new budget on every wake, only the tokens carried over
+    airtime_ms = time_on_air_ms(51, 0)
+    tokens_ms, sent_ms = None, 0
+    for _ in range(24 * 60):
+        budget = AirtimeBudget(30000)
+        if tokens_ms is not None:
+            budget.restore(tokens_ms, 60000)
+        while budget.allows(airtime_ms):
+            budget.record(airtime_ms)
+            sent_ms += airtime_ms
+        tokens_ms = budget.tokens_ms
+        sim.clock.advance(60000 * 1000)
+
+    assert 30000 - airtime_ms < sent_ms <= 30000 + 2 * budget.burst_ms
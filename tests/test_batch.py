@@ -0,0 +1,79 @@
+# lib/batch.py: zigzag varints, delta and aggregate frames
+
+import struct
+
+import pytest
+
+import batch
+from batch import SampleBuffer, BatchError, unpack_batch, BATCH_HEADER_SIZE, BATCH_DELTA, BATCH_AGGREGATE
+from codec import SCHEMAS, SENSOR_SCD30
+
+@pytest.mark.parametrize('d, z', [(0, 0), (-1, 1), (1, 2), (-2, 3), (2, 4), (-64, 127), (64, 128)])
+def test_zigzag(d, z):
+    assert batch._zigzag(d) == z
+    assert batch._unzigzag(z) == d
+
+def test_zigzag_round_trip():
+    for d in range(-70000, 70000, 7):
+        assert batch._unzigzag(batch._zigzag(d)) == d
+
+@pytest.mark.parametrize('z, encoded', [
+    (0, b'\x00'), (0x7F, b'\x7f'), (0x80, b'\x80\x01'), (300, b'\xac\x02'), (0x3FFF, b'\xff\x7f'), (0x4000, b'\x80\x80\x01'),
+])
+def test_varint(z, encoded):
+    buf = bytearray()
+    batch._put_varint(buf, z)
+    assert bytes(buf) == encoded
+    assert batch._varint_size(z) == len(encoded)
+
+def fill(n, step_ms=15000):
+    """ buffer of n SCD30 samples step_ms apart, and their quantized values """
+    schema = SCHEMAS[SENSOR_SCD30]
+    buf = SampleBuffer(SENSOR_SCD30, schema, 64)
+    rows = []
+    for k in range(n):
+        payload = schema.encode((600.0 + 7 * k, 22.0 - 0.3 * k, 40.0 + (k % 3)))
+        rows.append(struct.unpack(schema.fmt, payload))
+        buf.append(payload, k * step_ms)
+    return buf, rows
+
+def test_delta_round_trip(sim):
+    buf, rows = fill(20)
+    sim.clock.advance(19 * 15000 * 1000)
+
+    frame, n = buf.pack_delta(242)
+    assert n == 20
+    kind, sensor_id, header, unpacked = unpack_batch(frame, SCHEMAS)
+    assert (kind, sensor_id) == (BATCH_DELTA, SENSOR_SCD30)
+    assert header == {'count': 20, 'interval_s': 15, 'age_s': 0}
+    assert unpacked == rows
+
+def test_delta_split(sim):
+    buf, rows = fill(20)
+
+    unpacked = []
+    while len(buf):
+        frame, n = buf.pack_delta(24)
+        assert len(frame) <= 24
+        unpacked += unpack_batch(frame, SCHEMAS)[3]
+        buf.drop(n)
+    assert unpacked == rows
+
+def test_delta_sample_too_long(sim):
+    buf, _ = fill(1)
+    with pytest.raises(BatchError):
+        buf.pack_delta(BATCH_HEADER_SIZE + SCHEMAS[SENSOR_SCD30].size - 1)
+
+def test_aggregate(sim):
+    buf, rows = fill(6)
+
+    frame = buf.pack_aggregate()
+    assert len(frame) == buf.aggregate_size()
+    kind, _, header, (low, mean, high, last) = unpack_batch(frame, SCHEMAS)
+    assert kind == BATCH_AGGREGATE
+    assert header['count'] == 6
+    columns = list(zip(*rows))
+    assert low == tuple(min(c) for c in columns)
+    assert high == tuple(max(c) for c in columns)
+    assert mean == tuple(int(round(sum(c) / len(c))) for c in columns)
+    assert last == rows[-1]
@@ -0,0 +1,50 @@
+# lib/codec.py: quantize / decode round-trips, "no value" and clamping
+
+import math
+import struct
+
+import pytest
+
+from codec import SCHEMAS, SENSOR_SPS30, SENSOR_SCD30, SENSOR_PYSENSE, CodecError
+
+# Readings as the drivers report them
+READINGS = {
+    SENSOR_SPS30: (2.5, 4.0, 5.1, 5.6, 15.0, 18.2, 18.9, 19.0, 19.1, 0.6),
+    SENSOR_SCD30: (612.0, 22.4, 41.5),
+    SENSOR_PYSENSE: (-3.27, 55.12, 412, 98),
+}
+
+@pytest.mark.parametrize('sensor_id', sorted(READINGS))
+def test_round_trip(sensor_id):
+    schema = SCHEMAS[sensor_id]
+    values = READINGS[sensor_id]
+
+    payload = bytes(schema.encode(values))
+    assert len(payload) == schema.size
+    for value, decoded, scale in zip(values, schema.decode(payload), schema.scales):
+        assert abs(decoded - value) <= 0.5 / scale
+
+@pytest.mark.parametrize('sensor_id', sorted(READINGS))
+def test_quantize_raw_payload(sensor_id):
+    schema = SCHEMAS[sensor_id]
+    raw = bytes(schema.pack_raw(READINGS[sensor_id]))
+    assert len(raw) == schema.raw_size
+
+    # Same as encoding the float32 values the raw payload holds
+    assert bytes(schema.quantize(raw)) == bytes(schema.encode(struct.unpack(schema.raw_fmt, raw)))
+
+def test_no_value():
+    schema = SCHEMAS[SENSOR_SCD30]
+    assert schema.decode(schema.encode((None, float('nan'), 41.5))) == (None, None, 41.5)
+
+def test_clamp():
+    schema = SCHEMAS[SENSOR_SCD30]
+    co2, temperature, humidity = schema.decode(schema.encode((1e9, -math.inf, -5.0)))
+    # Clamped below the "no value" markers
+    assert co2 == 0xFFFE
+    assert temperature == -0x7FFF / 100
+    assert humidity == 0.0
+
+def test_wrong_field_count():
+    with pytest.raises(CodecError):
+        SCHEMAS[SENSOR_SCD30].encode((612.0, 22.4))
@@ -0,0 +1,35 @@
+# lib/crc8.py against the Sensirion datasheet vector and a bitwise reference
+
+from crc8 import crc8, check_words, calc_crc8, CRC8_POLY
+
+def reference(data, init=0xFF):
+    """ bit by bit CRC-8, poly 0x31, as in the datasheets """
+    crc = init
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ CRC8_POLY) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+    return crc
+
+def test_datasheet_vector():
+    # SPS30 / SCD30 datasheets: CRC(0xBEEF) = 0x92
+    assert crc8(b'\xbe\xef') == 0x92
+    assert calc_crc8(b'\xbe\xef') == b'\x92'
+
+def test_table_matches_reference():
+    data = bytes(range(256)) + b'\x00\xff\x5a'
+    assert crc8(data) == reference(data)
+    assert crc8(data, 10, 40) == reference(data[10:40])
+    # Si7006 init
+    assert crc8(data, 0, 2, 0x00) == reference(data[:2], 0x00)
+
+def test_check_words():
+    buf = bytearray(b'\xbe\xef\x92\x00\x00\x81\x12\x34\x00')
+    buf[8] = crc8(buf, 6, 8)
+    assert check_words(buf, 3) == 0
+    # Offset into the buffer
+    assert check_words(b'\xff' + bytes(buf), 3, 1) == 0
+
+    buf[5] ^= 0x01
+    buf[6] ^= 0x80
+    assert check_words(buf, 3) == 0b110
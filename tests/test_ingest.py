@@ -0,0 +1,109 @@
+# host/ingest.py: NumPy decoding against host/decode.py, inputs, column files
+
+import os
+import sys
+import json
+import base64
+import binascii
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'host'))
+
+import ingest
+from decode import decode_columns, NAMES
+from batch import SampleBuffer
+from codec import SCHEMAS, MUX_PORT, MUX_VERSION_FLOAT, SENSOR_SPS30, SENSOR_SCD30, SENSOR_PYSENSE
+from mux import pack_frames
+
+READINGS = {
+    SENSOR_SPS30: (2.5, 4.0, 5.1, 5.6, 15.0, 18.2, 18.9, 19.0, 19.1, 0.6),
+    SENSOR_SCD30: (612.0, 22.4, float('nan')),
+    SENSOR_PYSENSE: (-3.27, 55.12, 412, 98),
+}
+
+def mux_frames():
+    """ port 11 frames: quantized, float32 and a delta batch of SCD30 samples """
+    quantized = dict((sensor_id, bytes(SCHEMAS[sensor_id].encode(values))) for sensor_id, values in READINGS.items())
+    raw = dict((sensor_id, bytes(SCHEMAS[sensor_id].pack_raw(values))) for sensor_id, values in READINGS.items())
+    frames = pack_frames(quantized, 242) + pack_frames(raw, 242, MUX_VERSION_FLOAT)
+
+    schema = SCHEMAS[SENSOR_SCD30]
+    buf = SampleBuffer(SENSOR_SCD30, schema, 8)
+    for k in range(5):
+        buf.append(schema.encode((600.0 + 7 * k, 22.0 - 0.3 * k, 40.0 + k)), k * 15000)
+    frames.append(bytes(buf.pack_delta(242)[0]))
+    return frames
+
+def test_matches_per_frame_decoder(sim):
+    frames = mux_frames()
+    decoded, bad = ingest.decode_frames(ingest.to_frames([(1000 * i, MUX_PORT, f) for i, f in enumerate(frames)]))
+
+    expected = decode_columns(MUX_PORT, frames)
+    assert bad == 0
+    assert sorted(decoded) == sorted(expected)
+    for sensor, columns in expected.items():
+        assert list(decoded[sensor]['frame']) == columns['frame']
+        for name, values in columns.items():
+            values = [np.nan if v is None else v for v in values]
+            np.testing.assert_allclose(decoded[sensor][name], values, rtol=1e-6)
+
+def test_legacy_and_bad_frames():
+    scd30 = SCHEMAS[SENSOR_SCD30]
+    records = [
+        (5, scd30.port, bytes(scd30.pack_raw((612.0, 22.4, 41.5)))),
+        (6, MUX_PORT, b'\x02\x07\x00'),
+        (7, 99, b'\x00'),
+    ]
+    decoded, bad = ingest.decode_frames(ingest.to_frames(records), first=10)
+
+    assert bad == 2
+    columns = decoded[NAMES[SENSOR_SCD30]]
+    assert list(columns['frame']) == [10]
+    assert list(columns['time_ms']) == [5]
+    assert columns[scd30.names[0]][0] == np.float32(612.0)
+
+def write_inputs(tmp_path, frames):
+    """ the frames as "<port> <hex>" lines and TTN v3 JSON lines """
+    text = tmp_path / 'uplinks.txt'
+    text.write_text(''.join('{} {}\n'.format(MUX_PORT, binascii.hexlify(f).decode()) for f in frames))
+    ttn = tmp_path / 'uplinks.jsonl'
+    ttn.write_text(''.join(json.dumps({
+        'received_at': '2026-01-01T00:00:{:02d}Z'.format(i),
+        'uplink_message': {'f_port': MUX_PORT, 'frm_payload': base64.b64encode(f).decode()},
+    }) + '\n' for i, f in enumerate(frames)))
+    return str(text), str(ttn)
+
+def test_ingest_and_load(sim, tmp_path):
+    frames = mux_frames()
+    text, ttn = write_inputs(tmp_path, frames)
+    out = str(tmp_path / 'out')
+
+    # Chunks of 2 frames, two inputs: frame indices run on across both
+    total, bad, rows = ingest.ingest(out, [text, ttn], chunk=2)
+    columns = ingest.load_columns(out)
+
+    assert (total, bad) == (2 * len(frames), 0)
+    per_input = decode_columns(MUX_PORT, frames)
+    for sensor, expected in per_input.items():
+        assert rows[sensor] == 2 * len(expected['frame'])
+        assert list(columns[sensor]['frame']) == expected['frame'] + [i + len(frames) for i in expected['frame']]
+
+    # TTN receive times, batch samples moved back by their age
+    times = columns[NAMES[SENSOR_SCD30]]['time_ms'][-5:]
+    received = np.datetime64('2026-01-01T00:00:02', 'ms').astype('<i8')
+    assert list(received - times) == [60000, 45000, 30000, 15000, 0]
+
+def test_archive_round_trip(sim, tmp_path):
+    frames = mux_frames()
+    text, _ = write_inputs(tmp_path, frames)
+    archive = str(tmp_path / 'uplinks.frames')
+
+    ingest.write_frames(archive, ingest.read_frames(text, chunk=2))
+    chunks = list(ingest.read_frames(archive, chunk=2))
+    assert [len(c) for c in chunks] == [2, 1]
+    back = np.concatenate(chunks)
+    assert [bytes(row['data'][:row['length']]) for row in back] == frames
+    assert set(back['port']) == {MUX_PORT}
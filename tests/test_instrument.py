@@ -0,0 +1,68 @@
+# lib/instrument.py: histograms, the bounded total, diagnostic frames
+
+import time
+
+from instrument import Histogram, TOTAL_MAX, BOUNDS_US
+
+def enabled_instrument():
+    # A fresh module per test, the timers and counters are module state
+    import instrument
+    instrument.enable()
+    return instrument
+
+def test_histogram():
+    h = Histogram()
+    for value in (40, 90, 90, 150, 3000, 7000000):
+        h.record(value)
+
+    assert list(h.counts[:3]) == [1, 2, 1]
+    assert h.counts[len(BOUNDS_US)] == 1
+    assert (h.count, h.max, h.mean()) == (6, 7000000, 7003370 // 6)
+    assert h.percentile(0.5) == 100
+    assert h.percentile(1.0) == 7000000
+
+    h.reset()
+    assert (h.count, h.total, h.max, h.mean(), sum(h.counts)) == (0, 0, 0, 0, 0)
+
+def test_total_stays_small():
+    h = Histogram()
+    for _ in range(100):
+        h.record(1 << 28)
+    for _ in range(100):
+        h.record(1 << 27)
+
+    assert h.count == 200
+    assert h.total <= TOTAL_MAX
+    # Halving weighs the recent values more, the mean stays between them
+    assert (1 << 27) <= h.mean() < (3 << 26)
+
+def test_pack_round_trip(sim):
+    instrument = enabled_instrument()
+    for name, us in (('cycle', 354000), ('send_pkt', 210000), ('i2c.scd30', 450), ('unlisted', 5)):
+        t = instrument.timer(name)
+        for _ in range(3):
+            t0 = t.start()
+            time.sleep_us(us)
+            t.stop(t0)
+    instrument.counter('tx.failed').add(2)
+    instrument.counter('i2c.errors').add()
+
+    # Two timers ('<BHIIBB', 13 bytes) and a counter ('<BI') per frame
+    frames = instrument.pack(2 + 2 * 13 + 5)
+    assert [len(f) for f in frames] == [33, 20]
+    timers, counters = {}, {}
+    for frame in frames:
+        decoded = instrument.unpack(frame)
+        timers.update(decoded['timers'])
+        counters.update(decoded['counters'])
+
+    assert timers['cycle'] == {'count': 3, 'mean_us': 354000, 'max_us': 354000, 'p50_us': 354000, 'p90_us': 354000}
+    assert timers['i2c.scd30'] == {'count': 3, 'mean_us': 450, 'max_us': 450, 'p50_us': 450, 'p90_us': 450}
+    assert sorted(timers) == ['cycle', 'i2c.scd30', 'send_pkt']
+    assert counters == {'i2c.errors': 1, 'tx.failed': 2}
+
+def test_disabled(sim):
+    import instrument
+    assert instrument.timer('cycle') is instrument.NULL_TIMER
+    assert instrument.counter('tx.failed') is instrument.NULL_COUNTER
+    assert instrument.pack(242) == []
@@ -0,0 +1,88 @@
+# main.py in the simulator: retries, remote data rate changes, adaptive cadence
+
+import importlib
+import struct
+
+import pytest
+
+from sim import SimStop, SimReset
+
+def run_main(sim, tmp_path, seconds, **settings):
+    """ boots main.py with settings replacing its globals, runs it for seconds of virtual time """
+    sim.clock.stop_after(seconds)
+    main = importlib.import_module('main')
+    main.BACKLOG_PATH = str(tmp_path / 'backlog.bin')
+    for name, value in settings.items():
+        setattr(main, name, value)
+        if name in main.boot_sensors:
+            main.boot_sensors[name] = value
+    with pytest.raises(SimStop):
+        main.main()
+    return main
+
+def warm_every_cycle(sim, start=21.0):
+    """ Si7006 temperature up 1 degC every 15 s cycle """
+    si = sim.devices['si7006a20']
+    def bump(t):
+        si.temperature = t
+        sim.clock.call_later(15 * 10**6, bump, t + 1)
+    bump(start)
+
+def downlink_at(sim, t_s, *args):
+    from remote import CONFIG_PORT, encode_set
+    frame = b''.join(encode_set(name, value) for name, value in args)
+    sim.clock.call_at(int(t_s * 10**6), sim.radio.inject_downlink, CONFIG_PORT, frame)
+
+def test_retry_sends_the_failed_frame(sim, tmp_path):
+    warm_every_cycle(sim)
+    sim.radio.fail_next(1)
+    run_main(sim, tmp_path, 40, using_mux=False)
+
+    temperatures = [(u.ok, round(struct.unpack('<ffii', u.data)[0], 1)) for u in sim.radio.uplinks]
+    # The first cycle's frame again, although its buffer was packed over since
+    assert temperatures[:3] == [(False, 21.0), (True, 21.0), (True, 22.0)]
+
+def test_remote_data_rate(sim, tmp_path):
+    downlink_at(sim, 40, ('LORA_DR', 2))
+    main = run_main(sim, tmp_path, 90)
+
+    assert [u.dr for u in sim.radio.uplinks] == [1, 1, 1, 2, 2, 2]
+    assert all(u.ok for u in sim.radio.uplinks)
+    assert sim.pycom.nvs == {'cfg2': 2}
+    assert (main.config.applied, main.config.rejected) == (1, 0)
+
+def test_remote_data_rate_too_low(sim, tmp_path):
+    # 2 + 20 bytes of SPS30 payload do not fit the 11 bytes of DR0
+    downlink_at(sim, 40, ('LORA_DR', 0))
+    downlink_at(sim, 70, ('using_pm', False), ('LORA_DR', 0))
+    main = run_main(sim, tmp_path, 120, using_pm=True)
+
+    assert (main.config.applied, main.config.rejected) == (0, 2)
+    assert main.LORA_DR == 1
+    assert sim.pycom.nvs == {}
+    assert sim.radio.uplinks[-1].t_us > 100 * 10**6
+    assert all(u.ok and u.dr == 1 for u in sim.radio.uplinks)
+
+def test_saved_data_rate_too_low(sim):
+    # Saved by a firmware that did not check it
+    sim.pycom.nvs.update({'cfg2': 0, 'cfg5': 1})
+    main = importlib.import_module('main')
+    with pytest.raises(SimReset):
+        main.main()
+    assert sim.pycom.nvs == {}
+
+def test_adaptive_cadence_stable(sim, tmp_path):
+    run_main(sim, tmp_path, 480, using_adaptive=True)
+
+    times = [u.t_us // 10**6 for u in sim.radio.uplinks]
+    gaps = [b - a for a, b in zip(times, times[1:])]
+    # The Pysense interval doubles from CYCLE_S up to 8 * CYCLE_S
+    assert gaps == [15, 30, 60, 120, 120, 120]
+
+def test_adaptive_cadence_changing(sim, tmp_path):
+    warm_every_cycle(sim)
+    run_main(sim, tmp_path, 120, using_adaptive=True)
+
+    times = [u.t_us // 10**6 for u in sim.radio.uplinks]
+    assert [b - a for a, b in zip(times, times[1:])] == [15] * (len(times) - 1)
+    assert len(times) == 8
@@ -0,0 +1,45 @@
+# lib/mux.py: packing and merging multiplexed frames
+
+import pytest
+
+from codec import SCHEMAS, MUX_VERSION, MUX_VERSION_FLOAT, SENSOR_SPS30, SENSOR_SCD30, SENSOR_PYSENSE
+from mux import pack_frames, unpack_frame, merge_frames, max_payload, MuxError, MUX_HEADER_SIZE
+
+def payloads(*sensor_ids):
+    return dict((sensor_id, bytes([sensor_id + 1]) * SCHEMAS[sensor_id].size) for sensor_id in sensor_ids)
+
+def test_pack_one_frame():
+    frames = pack_frames(payloads(SENSOR_SPS30, SENSOR_SCD30, SENSOR_PYSENSE), max_payload(1))
+    assert len(frames) == 1
+    assert frames[0][:2] == bytes([MUX_VERSION, 0b111])
+    assert unpack_frame(frames[0]) == payloads(SENSOR_SPS30, SENSOR_SCD30, SENSOR_PYSENSE)
+
+def test_pack_split():
+    # 2 + 20 + 6 fits, the Pysense payload goes to a second frame
+    frames = pack_frames(payloads(SENSOR_SPS30, SENSOR_SCD30, SENSOR_PYSENSE), 30)
+    assert [f[1] for f in frames] == [0b011, 0b100]
+
+def test_pack_payload_too_long():
+    with pytest.raises(MuxError):
+        pack_frames(payloads(SENSOR_SPS30), max_payload(0))
+
+def test_merge():
+    a = pack_frames(payloads(SENSOR_PYSENSE), 242)[0]
+    b = pack_frames(payloads(SENSOR_SPS30, SENSOR_SCD30), 242)[0]
+
+    merged = merge_frames(a, b, 242)
+    assert len(merged) == len(a) + len(b) - MUX_HEADER_SIZE
+    # Payloads back in sensor id order whatever the merge order
+    assert merged == merge_frames(b, a, 242)
+    assert unpack_frame(merged) == payloads(SENSOR_SPS30, SENSOR_SCD30, SENSOR_PYSENSE)
+
+def test_merge_refused():
+    a = pack_frames(payloads(SENSOR_PYSENSE), 242)[0]
+    b = pack_frames(payloads(SENSOR_SPS30), 242)[0]
+    # Too long
+    assert merge_frames(a, b, len(a) + len(b) - MUX_HEADER_SIZE - 1) is None
+    # Same sensor twice
+    assert merge_frames(a, a, 242) is None
+    # Different versions
+    raw = {SENSOR_SPS30: bytes(SCHEMAS[SENSOR_SPS30].raw_size)}
+    assert merge_frames(a, pack_frames(raw, 242, MUX_VERSION_FLOAT)[0], 242) is None
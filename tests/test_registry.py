@@ -0,0 +1,79 @@
+# lib/registry.py: build once, dependencies, invalidate
+
+import time
+
+from registry import SensorRegistry
+
+def board_registry(builds):
+    """ a board and two drivers built on it, builds counts the factory calls """
+    def factory(name, parent=None):
+        def build(r):
+            if parent is not None:
+                r.get(parent)
+            builds.append(name)
+            time.sleep_ms(5)
+            return object()
+        return build
+
+    r = SensorRegistry()
+    r.register('py', factory('py'))
+    r.register('si', factory('si', 'py'))
+    r.register('lt', factory('lt', 'py'))
+    r.register('other', factory('other'))
+    return r
+
+def test_built_once(sim):
+    builds = []
+    r = board_registry(builds)
+    r.setup()
+    si = r.get('si')
+
+    assert r.get('si') is si
+    assert builds == ['py', 'si', 'lt', 'other']
+    assert r.setups == 4
+
+def test_invalidate_dependents(sim):
+    builds = []
+    r = board_registry(builds)
+    r.setup()
+    py, other = r.get('py'), r.get('other')
+    del builds[:]
+
+    # The board and everything built on it, the rest is kept
+    r.invalidate('py')
+    r.setup()
+    assert sorted(builds) == ['lt', 'py', 'si']
+    assert r.get('py') is not py
+    assert r.get('other') is other
+
+def test_invalidate_leaf(sim):
+    builds = []
+    r = board_registry(builds)
+    r.setup()
+    del builds[:]
+
+    r.invalidate('si')
+    r.setup()
+    assert builds == ['si']
+
+def test_invalidate_all(sim):
+    builds = []
+    r = board_registry(builds)
+    r.setup()
+    del builds[:]
+
+    r.invalidate()
+    r.setup()
+    assert builds == ['py', 'si', 'lt', 'other']
+
+def test_setup_time_apart_from_cycle(sim):
+    r = board_registry([])
+    r.setup()
+    # si nests the build of py: 10 ms counted once
+    r.invalidate('py')
+    r.begin_cycle()
+    r.get('si')
+    time.sleep_ms(20)
+    assert r.end_cycle() == 30
+    assert (r.cycle_setup_ms, r.last_setup_ms) == (10, 10)
+    assert r.setup_ms == 30
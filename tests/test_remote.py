@@ -0,0 +1,75 @@
+# lib/remote.py: downlink parsing, encoding, reports and NVS persistence
+
+import pytest
+
+from remote import (parse, encode_set, pack_report, Config, RemoteError,
+                    CMD_SET, CMD_DEFAULTS, CMD_REPORT, CMD_REBOOT)
+
+def test_parse():
+    # The example in lib/remote.py
+    assert parse(bytes.fromhex('01013c00010202')) == [(CMD_SET, 'CYCLE_S', 60), (CMD_SET, 'LORA_DR', 2)]
+    # Scaled and flag values
+    assert parse(encode_set('PM_PERIOD_MS', 30000) + encode_set('using_pm', 0)) == [
+        (CMD_SET, 'PM_PERIOD_MS', 30000), (CMD_SET, 'using_pm', False)]
+    assert parse(bytes([CMD_DEFAULTS, CMD_REPORT, CMD_REBOOT])) == [
+        (CMD_DEFAULTS, None, None), (CMD_REPORT, None, None), (CMD_REBOOT, None, None)]
+
+@pytest.mark.parametrize('frame', [
+    b'\x05',                # unknown command
+    b'\x01\x63\x00',        # unknown setting
+    b'\x01',                # truncated SET
+    b'\x01\x01\x3c',        # truncated value
+    b'\x01\x02\x05',        # LORA_DR out of range
+    b'\x01\x01\x00\x00',    # CYCLE_S 0
+    b'\x01\x02\x02\x09',    # a good command, then a bad one
+])
+def test_parse_rejects(frame):
+    with pytest.raises(RemoteError):
+        parse(frame)
+
+def test_encode_set_rejects():
+    with pytest.raises(RemoteError):
+        encode_set('PM_PERIOD_MS', 1500)
+    with pytest.raises(RemoteError):
+        encode_set('LORA_DR', 5)
+
+def test_report_round_trip():
+    values = {'CYCLE_S': 60, 'LORA_DR': 1, 'PM_PERIOD_MS': 10000, 'using_mux': True, 'AIRTIME_BUDGET_MS': 30000}
+    frames = pack_report(values, 8)
+
+    assert all(len(frame) <= 8 for frame in frames)
+    assert len(frames) == 3
+    assert dict((name, value) for frame in frames for _, name, value in parse(frame)) == values
+
+class NVS:
+    """ pycom.nvs_* on a dict """
+
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def set(self, key, value):
+        self.data[key] = value
+
+    def erase(self, key):
+        del self.data[key]
+
+def test_config_persistence():
+    nvs = NVS()
+    config = Config({'CYCLE_S': 15, 'LORA_DR': 1, 'using_pm': True}, nvs.get, nvs.set, nvs.erase)
+    assert config.load() == {}
+
+    config.save('CYCLE_S', 60)
+    config.save('using_pm', False)
+    # Saved by another firmware, not a setting of this one
+    nvs.set('cfg8', 1)
+    assert nvs.data == {'cfg1': 60, 'cfg5': 0, 'cfg8': 1}
+
+    # As after a reboot
+    config = Config(config.defaults, nvs.get, nvs.set, nvs.erase)
+    assert config.load() == {'CYCLE_S': 60, 'using_pm': False}
+
+    assert config.reset() == {'CYCLE_S': 15, 'LORA_DR': 1, 'using_pm': True}
+    assert nvs.data == {}
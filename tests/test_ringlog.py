@@ -0,0 +1,158 @@
+# lib/ringlog.py on a temporary file: head recovery, meta records, peek/ack
+
+import struct
+
+import pytest
+
+import ringlog
+from ringlog import RingLog, FileBackend
+
+SLOTS = 8
+PAYLOAD_SIZE = 12
+BATCH = 4
+
+def open_log(path, batch=BATCH):
+    backend = FileBackend(str(path), RingLog.file_size(SLOTS, PAYLOAD_SIZE))
+    return RingLog(backend, SLOTS, PAYLOAD_SIZE, batch)
+
+def payload(seq):
+    return bytes([seq & 0xFF]) * (1 + seq % PAYLOAD_SIZE)
+
+def fill(path, n):
+    log = open_log(path)
+    for seq in range(1, n + 1):
+        log.append(seq % 200, payload(seq))
+    log.flush()
+    log._backend.close()
+
+def tear_slot(path, i):
+    """ flips the crc of slot i, as a write cut short by a reset """
+    slot_size = ringlog._SLOT_HEADER_SIZE + PAYLOAD_SIZE
+    with open(str(path), 'r+b') as f:
+        f.seek(ringlog._SLOTS_OFFSET + i * slot_size + 6)
+        crc = f.read(1)[0]
+        f.seek(-1, 1)
+        f.write(bytes([crc ^ 0xFF]))
+
+def read_meta(path, i):
+    with open(str(path), 'rb') as f:
+        f.seek(i * ringlog._META_SIZE)
+        return struct.unpack_from(ringlog._META_FMT, f.read(ringlog._META_SIZE))
+
+def test_empty_log(tmp_path):
+    log = open_log(tmp_path / 'log.bin')
+    assert (log.head_seq, log.tail_seq, len(log)) == (1, 1, 0)
+    assert log.peek() is None
+
+# Not full, full, one lap and a bit, several laps ending anywhere in the slots
+@pytest.mark.parametrize('n', [1, 5, SLOTS - 1, SLOTS, SLOTS + 1, 2 * SLOTS + 3, 3 * SLOTS, 5 * SLOTS - 2])
+def test_find_head(tmp_path, n):
+    path = tmp_path / 'log.bin'
+    fill(path, n)
+
+    log = open_log(path)
+    assert log.head_seq == n + 1
+    assert log.tail_seq == max(1, n + 1 - SLOTS)
+    assert log.peek() == (log.tail_seq, log.tail_seq % 200, payload(log.tail_seq))
+
+def test_find_head_torn_slot_0_after_wrap(tmp_path):
+    path = tmp_path / 'log.bin'
+    # Seq SLOTS + 1 in slot 0, the rest of the slots still hold the first lap
+    fill(path, SLOTS + 1)
+    tear_slot(path, 0)
+
+    log = open_log(path)
+    # The torn record is lost, the next append reuses its seq and slot
+    assert log.head_seq == SLOTS + 1
+    assert log.append(1, b'new') == SLOTS + 1
+
+def test_find_head_torn_slot_0_first_lap(tmp_path):
+    path = tmp_path / 'log.bin'
+    fill(path, 1)
+    tear_slot(path, 0)
+
+    assert open_log(path).head_seq == 1
+
+def test_meta_records_alternate(tmp_path):
+    path = tmp_path / 'log.bin'
+    log = open_log(path)
+    for seq in range(1, 7):
+        log.append(1, payload(seq))
+
+    log.ack(2)
+    log.flush()
+    # Generation 1 goes to meta B, 2 to meta A
+    assert read_meta(path, 1)[1:3] == (1, 3)
+    log.ack(4)
+    log.flush()
+    assert read_meta(path, 0)[1:3] == (2, 5)
+    assert read_meta(path, 1)[1:3] == (1, 3)
+
+    # No tail change, no meta write
+    log.flush()
+    assert read_meta(path, 0)[1] == 2
+
+    log._backend.close()
+    assert open_log(path).tail_seq == 5
+
+def test_meta_torn_falls_back_to_older(tmp_path):
+    path = tmp_path / 'log.bin'
+    log = open_log(path)
+    for seq in range(1, 7):
+        log.append(1, payload(seq))
+    log.ack(2)
+    log.flush()
+    log.ack(4)
+    log.flush()
+    log._backend.close()
+
+    # Meta A (generation 2) torn: records 3 and 4 are sent again, none lost
+    with open(str(path), 'r+b') as f:
+        f.seek(12)
+        f.write(b'\x00')
+    log = open_log(path)
+    assert log.tail_seq == 3
+    assert len(log) == 4
+
+def test_peek_ack_flushed_and_pending(tmp_path):
+    log = open_log(tmp_path / 'log.bin')
+    # Seqs 1..4 on flash, 5 and 6 pending in RAM
+    for seq in range(1, 7):
+        log.append(seq, payload(seq))
+    assert (log.flushed_seq, log.head_seq) == (5, 7)
+
+    assert log.peek() == (1, 1, payload(1))
+    log.ack(3)
+    assert log.peek() == (4, 4, payload(4))
+    log.ack(4)
+    assert log.peek() == (5, 5, payload(5))
+    log.ack(5)
+    assert log.peek() == (6, 6, payload(6))
+    log.ack(6)
+    assert log.peek() is None
+    assert len(log) == 0
+
+def test_peek_skips_torn_record(tmp_path):
+    path = tmp_path / 'log.bin'
+    log = open_log(path)
+    for seq in range(1, 5):
+        log.append(1, payload(seq))
+    tear_slot(path, 1)
+
+    assert log.peek() == (1, 1, payload(1))
+    log.ack(1)
+    assert log.peek() == (3, 1, payload(3))
+
+def test_overwrite_oldest(tmp_path):
+    log = open_log(tmp_path / 'log.bin')
+    for seq in range(1, SLOTS + 4):
+        log.append(1, payload(seq))
+
+    assert log.dropped == 3
+    assert len(log) == SLOTS
+    assert log.peek() == (4, 1, payload(4))
+
+def test_append_too_long(tmp_path):
+    log = open_log(tmp_path / 'log.bin')
+    with pytest.raises(ValueError):
+        log.append(1, bytes(PAYLOAD_SIZE + 1))
@@ -0,0 +1,63 @@
+# lib/scheduler.py on CPython asyncio: periods, errors, overruns, stop
+
+import time
+
+from scheduler import Scheduler
+
+def stop_after(sched, runs):
+    """ a task that stops the scheduler on its runs-th run """
+    count = [0]
+    async def task():
+        count[0] += 1
+        if count[0] >= runs:
+            sched.stop()
+    return task
+
+def test_task_sets_period():
+    sched = Scheduler()
+    async def slower():
+        return 20
+    stats = sched.every('slower', 5, slower)
+    sched.every('stop', 10, stop_after(sched, 4))
+    sched.run()
+
+    assert stats.period_ms == 20
+    assert 1 <= stats.runs <= 3
+
+def test_errors_do_not_stop_the_task():
+    sched = Scheduler()
+    async def failing():
+        raise OSError('NACK')
+    stats = sched.every('failing', 5, failing)
+    sched.every('stop', 5, stop_after(sched, 3))
+    sched.run()
+
+    assert stats.runs >= 2
+    assert stats.errors == stats.runs
+
+def test_overrun_skips_missed_periods():
+    sched = Scheduler()
+    async def blocking():
+        # Blocks the loop for three periods
+        time.sleep(0.03)
+    stats = sched.every('blocking', 10, blocking)
+    sched.every('stop', 10, stop_after(sched, 2), delay_ms=5)
+    sched.run()
+
+    assert stats.runs >= 1
+    assert stats.overruns == stats.runs
+    assert stats.run_max_ms >= 30
+
+def test_delay_and_lateness():
+    sched = Scheduler()
+    started = []
+    async def delayed():
+        started.append(time.monotonic())
+        sched.stop()
+    stats = sched.every('delayed', 10, delayed, delay_ms=20)
+    t0 = time.monotonic()
+    sched.run()
+
+    assert started[0] - t0 >= 0.019
+    assert stats.runs == 1
+    assert stats.late_ms == stats.late_avg_ms() < 20
@@ -0,0 +1,36 @@
+# lib/sensirion.py: SensirionFrame.decode
+
+import struct
+
+from crc8 import crc8
+from sensirion import SensirionFrame
+
+def read_buffer(values):
+    """ what the sensor sends for values: big endian float32 words, each followed by its crc """
+    raw = struct.pack('>{}f'.format(len(values)), *values)
+    read = bytearray()
+    for i in range(0, len(raw), 2):
+        read += raw[i:i + 2] + bytes([crc8(raw, i, i + 2)])
+    return read
+
+def test_decode():
+    values = [612.0, 22.375, -41.5]
+    frame = SensirionFrame(3)
+    read = read_buffer(values)
+    assert len(read) == frame.read_len
+
+    reused = frame.values
+    assert frame.decode(read) == 0
+    assert frame.values == values
+    assert frame.values is reused
+
+def test_decode_bad_crc():
+    frame = SensirionFrame(2)
+    frame.decode(read_buffer([1.0, 2.0]))
+
+    read = read_buffer([3.0, 4.0])
+    # Second word of the second float
+    read[11] ^= 0xFF
+    assert frame.decode(read) == 0b1000
+    # Values of the last good frame are kept
+    assert frame.values == [1.0, 2.0]
@@ -0,0 +1,41 @@
+# lib/SI7006A20.py in the simulator: conversion waits and NACKed reads
+
+import pytest
+
+# Datasheet table 2 maximum conversion times in us per resolution (user
+# register bits): (humidity, temperature)
+MAX_CONVERSION_US = {0x00: (12000, 10800), 0x01: (3100, 3800), 0x80: (4500, 6200), 0x81: (7000, 2400)}
+
+def si7006a20():
+    # Imported once the simulator provides machine
+    from SI7006A20 import SI7006A20
+    return SI7006A20()
+
+@pytest.mark.parametrize('resolution', sorted(MAX_CONVERSION_US))
+def test_slowest_part(sim, resolution):
+    device = sim.devices['si7006a20']
+    device.CONVERSION_US = MAX_CONVERSION_US
+    si = si7006a20()
+    si.set_resolution(resolution)
+    stats = sim.buses[0].stats
+    before = stats.transactions
+
+    si.trigger_humidity()
+    si.collect_humidity()
+    si.trigger_temperature()
+    assert abs(si.collect_temperature() - device.temperature) < 0.1
+    # A command and one read per conversion, no read NACKed and retried
+    assert stats.transactions - before == 4
+
+def test_nack_retried(sim):
+    si = si7006a20()
+    si.trigger_temperature()
+    sim.buses[0].inject_fault(0x40, count=3)
+    assert abs(si.collect_temperature() - sim.devices['si7006a20'].temperature) < 0.1
+
+def test_nack_gives_up(sim):
+    si = si7006a20()
+    si.trigger_temperature()
+    sim.buses[0].inject_fault(0x40, count=10)
+    with pytest.raises(OSError):
+        si.collect_temperature()
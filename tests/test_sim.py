@@ -0,0 +1,32 @@
+# sim: waking from deep sleep, as main.py sees it
+
+import importlib
+
+from sim import SimStop, SimDeepSleep, PWRON_RESET
+
+def test_pic_wake_sends_no_confirmed_uplink(sim, tmp_path):
+    # The Pysense PIC cuts the power: every wake is a power-on reset
+    confirmed = []
+    sim.clock.stop_after(120)
+    try:
+        while True:
+            main = importlib.import_module('main')
+            main.BACKLOG_PATH = str(tmp_path / 'backlog.bin')
+            main.using_deepsleep = True
+            send_pkt = main.send_pkt
+            def confirming_send_pkt(lora_socket, pkt, port, main=main, send_pkt=send_pkt):
+                confirmed.append(main.verify_session)
+                return send_pkt(lora_socket, pkt, port)
+            main.send_pkt = confirming_send_pkt
+            try:
+                main.main()
+            except SimDeepSleep as e:
+                sim.wake(e.ms)
+    except SimStop:
+        pass
+
+    assert sim.reset_cause == PWRON_RESET
+    assert len(confirmed) > 2
+    assert not any(confirmed)
+    assert sim.radio.joins == 1
+    assert all(u.ok for u in sim.radio.uplinks)
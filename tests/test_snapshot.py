@@ -0,0 +1,60 @@
+# lib/snapshot.py: publishing, and a read torn by the writer
+
+import pytest
+
+from snapshot import Snapshot, SnapshotError, READ_RETRIES
+
+def write(snap, value, stamp):
+    buf = snap.begin()
+    buf[:] = bytes([value]) * snap.size
+    snap.publish(stamp)
+
+class TearingBuffer(bytearray):
+    """ runs the writer during the first tears copies into it """
+
+    def __init__(self, size, snap, tears):
+        super().__init__(size)
+        self.snap = snap
+        self.tears = tears
+        self.copies = 0
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.copies += 1
+        if self.copies <= self.tears:
+            # Two samples: the writer is back on the buffer being read
+            for _ in range(2):
+                write(self.snap, self.snap.seq + 10, self.snap.seq + 1000)
+
+def test_nothing_published():
+    snap = Snapshot(4)
+    assert snap.read() == (0, 0, None)
+
+def test_read_current_sample():
+    snap = Snapshot(4)
+    write(snap, 1, 100)
+    write(snap, 2, 200)
+    assert snap.read() == (2, 200, b'\x02' * 4)
+
+    # Between begin() and publish() readers get the published sample
+    snap.begin()[:] = b'\x03' * 4
+    assert snap.read() == (2, 200, b'\x02' * 4)
+
+def test_torn_read_retried():
+    snap = Snapshot(4)
+    write(snap, 1, 100)
+    out = TearingBuffer(4, snap, 1)
+    seq, stamp = snap.read_into(out)
+
+    # The second copy is of the sample published meanwhile, stamp and all
+    assert out.copies == 2
+    assert (seq, stamp) == (3, 1002)
+    assert bytes(out) == bytes([12]) * 4
+
+def test_torn_read_gives_up():
+    snap = Snapshot(4)
+    write(snap, 1, 100)
+    out = TearingBuffer(4, snap, READ_RETRIES)
+    with pytest.raises(SnapshotError):
+        snap.read_into(out)
+    assert out.copies == READ_RETRIES
@@ -0,0 +1,93 @@
+# lib/txqueue.py: order, drop policies, retry backoff and coalescing
+
+from mux import merge_frames
+from txqueue import TxQueue, DROP_OLDEST, DROP_LOWEST
+
+def pop_all(q, max_size=242):
+    """ pops and sends every due frame, returns the frames """
+    frames = []
+    while True:
+        item = q.pop(max_size)
+        if item is None:
+            return frames
+        frames.append(item[1])
+        q.done(item[2], True)
+
+def test_priority_then_fifo(sim):
+    q = TxQueue(8)
+    q.push(1, b'a', 0)
+    q.push(1, b'b', 2)
+    q.push(1, b'c', 1)
+    q.push(1, b'd', 2)
+    assert pop_all(q) == [b'b', b'd', b'c', b'a']
+    assert (q.enqueued, q.sent, len(q)) == (4, 4, 0)
+
+def test_push_copies(sim):
+    q = TxQueue(8)
+    buf = bytearray(b'abc')
+    q.push(1, buf)
+    # e.g. codec.Schema.pack_raw reusing its buffer for the next cycle
+    buf[0] = ord('x')
+    assert pop_all(q) == [b'abc']
+
+def test_drop_oldest(sim):
+    q = TxQueue(2, DROP_OLDEST)
+    assert q.push(1, b'a', 2) is None
+    q.push(1, b'b', 0)
+    assert q.push(1, b'c', 0) == (1, b'a')
+    assert q.dropped == 1
+    assert pop_all(q) == [b'b', b'c']
+
+def test_drop_lowest(sim):
+    q = TxQueue(2, DROP_LOWEST)
+    q.push(1, b'a', 2)
+    q.push(1, b'b', 0)
+    assert q.push(1, b'c', 1) == (1, b'b')
+    # Lower than every queued frame: the new frame is dropped
+    assert q.push(1, b'd', 0) == (1, b'd')
+    assert q.dropped == 2
+    assert pop_all(q) == [b'a', b'c']
+
+def test_backoff_and_give_up(sim):
+    q = TxQueue(8, max_attempts=3, backoff_ms=10000, backoff_max_ms=15000)
+    q.push(1, b'a')
+
+    # Retries 10 s after the first attempt, then 15 s (capped) after the second
+    for backoff_ms in (10000, 15000):
+        _, _, entries = q.pop(242)
+        # Counted from the pop, not from the end of the 300 ms uplink
+        sim.clock.advance(300000)
+        assert q.done(entries, False) == []
+        sim.clock.advance((backoff_ms - 301) * 1000)
+        assert q.pop(242) is None
+        sim.clock.advance(1000)
+
+    _, _, entries = q.pop(242)
+    assert q.done(entries, False) == [(1, b'a')]
+    assert (q.retried, q.given_up, len(q)) == (2, 1, 0)
+
+def test_failed_frame_waits_for_backoff(sim):
+    q = TxQueue(8, backoff_ms=10000)
+    q.push(1, b'a')
+    q.done(q.pop(242)[2], False)
+    q.push(1, b'b')
+    # The new frame goes first, the failed one once its backoff is over
+    assert pop_all(q) == [b'b']
+    sim.clock.advance(10000 * 1000)
+    assert pop_all(q) == [b'a']
+
+def test_coalesce(sim):
+    q = TxQueue(8, merge=lambda port, a, b, max_size: merge_frames(a, b, max_size) if port == 11 else None)
+    q.push(11, bytes([2, 0b100]) + bytes(8))
+    q.push(10, b'legacy')
+    q.push(11, bytes([2, 0b010]) + bytes(6))
+
+    port, frame, entries = q.pop(242)
+    assert (port, frame[1], len(frame), len(entries)) == (11, 0b110, 16, 2)
+    q.done(entries, True)
+    assert (q.sent, q.coalesced) == (2, 1)
+
+    # The legacy port frame, then two frames that do not fit one uplink
+    q.push(11, bytes([2, 0b100]) + bytes(8))
+    q.push(11, bytes([2, 0b010]) + bytes(6))
+    assert [len(f) for f in pop_all(q, 15)] == [6, 10, 8]